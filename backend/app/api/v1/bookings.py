@@ -1,13 +1,19 @@
-from fastapi import APIRouter, HTTPException, status, Depends, Query
+from fastapi import APIRouter, HTTPException, status, Depends, Query, Header
 from typing import List, Optional
 from app.models.booking import (
     Booking, BookingCreate, BookingUpdate, BookingResponse,
-    BookingStatus, RentalType
+    BookingQuoteRequest, BookingQuote, BookingStatus, RentalType
 )
 from app.models.vehicle import Vehicle
 from app.auth_supabase import get_current_user, require_role
 from app.models.user import User, UserRole
 from app.database import get_supabase
+from app.surge import surge_engine
+from app.quotes import quote_store
+from app.availability import find_conflicting_bookings
+from app.holds import hold_store
+from app.events import outbox_dispatcher
+from app.idempotency import run_idempotent
 from config import settings
 from datetime import datetime, timedelta
 import uuid
@@ -63,34 +69,24 @@ def calculate_booking_price(
 
 
 def calculate_surge_multiplier(
-    vehicle_id: str,
+    vehicle: dict,
     pickup_date: datetime,
     return_date: datetime
 ) -> float:
     """Calculate surge pricing multiplier based on demand"""
-    supabase = get_supabase()
-    
-    # Check bookings in similar time period
-    # This is a simplified version - implement actual surge logic
-    bookings = supabase.table("bookings").select("id").eq("vehicle_id", vehicle_id).or_(
-        f"and(pickup_date.lte.{pickup_date.isoformat()},return_date.gte.{pickup_date.isoformat()}),"
-        f"and(pickup_date.lte.{return_date.isoformat()},return_date.gte.{return_date.isoformat()})"
-    ).in_("status", ["confirmed", "in_progress"]).execute()
-    
-    # Simple surge: 1.0x base, 1.2x if 50%+ booked, 1.5x if 80%+ booked
-    # In production, implement more sophisticated surge pricing
-    return 1.0
+    # Occupancy comes from the in-memory histogram, no bookings query needed
+    return surge_engine.multiplier(vehicle, pickup_date, return_date)
 
 
-@router.post("/", response_model=BookingResponse, status_code=status.HTTP_201_CREATED)
-async def create_booking(
-    booking_data: BookingCreate,
+@router.post("/quote", response_model=BookingQuote)
+async def create_booking_quote(
+    quote_request: BookingQuoteRequest,
     current_user: User = Depends(get_current_user)
 ):
-    """Create a new booking"""
+    """Get a price quote for a booking (price is locked until the quote expires)"""
     supabase = get_supabase()
     
-    # Check KYC verification
+    # Quotes hold the car, so only customers who can book may request them
     if not current_user.is_kyc_verified:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
@@ -98,7 +94,7 @@ async def create_booking(
         )
     
     # Get vehicle
-    vehicle_response = supabase.table("vehicles").select("*").eq("id", booking_data.vehicle_id).execute()
+    vehicle_response = supabase.table("vehicles").select("*").eq("id", quote_request.vehicle_id).execute()
     if not vehicle_response.data:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -107,37 +103,126 @@ async def create_booking(
     
     vehicle = vehicle_response.data[0]
     
-    # Check availability
-    availability = await check_availability(
-        booking_data.vehicle_id,
-        booking_data.pickup_date,
-        booking_data.return_date,
-        current_user
-    )
+    # Requoting a vehicle replaces its hold, so it does not count towards the limit
+    if hold_store.checkout_holds(current_user.id, exclude_vehicle=quote_request.vehicle_id) >= settings.HOLDS_PER_USER_MAX:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail=f"You can hold at most {settings.HOLDS_PER_USER_MAX} vehicles at once"
+        )
     
-    if not availability["available"]:
+    # Hold the car while the customer checks out
+    hold = hold_store.place(
+        quote_request.vehicle_id,
+        current_user.id,
+        quote_request.pickup_date,
+        quote_request.return_date
+    )
+    if not hold:
         raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Vehicle not available for selected dates"
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Vehicle is being booked by another customer for these dates"
         )
     
     # Calculate surge multiplier
     surge_multiplier = calculate_surge_multiplier(
-        booking_data.vehicle_id,
-        booking_data.pickup_date,
-        booking_data.return_date
+        vehicle,
+        quote_request.pickup_date,
+        quote_request.return_date
     )
     
     # Calculate pricing
     pricing = calculate_booking_price(
         vehicle,
+        quote_request.pickup_date,
+        quote_request.return_date,
+        quote_request.rental_type,
+        surge_multiplier,
+        quote_request.with_driver
+    )
+    
+    quote = quote_store.issue(current_user.id, vehicle, quote_request, pricing)
+    
+    return BookingQuote(**quote, hold_expires_at=hold["expires_at"])
+
+
+@router.post("/", response_model=BookingResponse, status_code=status.HTTP_201_CREATED)
+async def create_booking(
+    booking_data: BookingCreate,
+    current_user: User = Depends(get_current_user),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key")
+):
+    """Create a new booking (retries with the same Idempotency-Key replay the first response)"""
+    return await run_idempotent(
+        idempotency_key,
+        current_user.id,
+        "bookings.create",
+        booking_data,
+        lambda: _create_booking(booking_data, current_user)
+    )
+
+
+async def _create_booking(booking_data: BookingCreate, current_user: User) -> BookingResponse:
+    supabase = get_supabase()
+    
+    # Check KYC verification
+    if not current_user.is_kyc_verified:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="KYC verification required to make bookings"
+        )
+    
+    # A valid quote carries the vehicle and the locked price
+    quote = None
+    if booking_data.quote_id:
+        quote = quote_store.redeem(booking_data.quote_id, current_user.id, booking_data)
+    
+    if quote:
+        vehicle = quote["vehicle"]
+    else:
+        # Get vehicle
+        vehicle_response = supabase.table("vehicles").select("*").eq("id", booking_data.vehicle_id).execute()
+        if not vehicle_response.data:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Vehicle not found"
+            )
+        
+        vehicle = vehicle_response.data[0]
+    
+    # Check availability
+    availability = await check_availability(
+        booking_data.vehicle_id,
         booking_data.pickup_date,
         booking_data.return_date,
-        booking_data.rental_type,
-        surge_multiplier,
-        booking_data.with_driver
+        current_user
     )
     
+    if not availability["available"]:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Vehicle not available for selected dates"
+        )
+    
+    if quote:
+        pricing = quote["pricing"]
+    else:
+        # Calculate surge multiplier
+        surge_multiplier = calculate_surge_multiplier(
+            vehicle,
+            booking_data.pickup_date,
+            booking_data.return_date
+        )
+        
+        # Calculate pricing
+        pricing = calculate_booking_price(
+            vehicle,
+            booking_data.pickup_date,
+            booking_data.return_date,
+            booking_data.rental_type,
+            surge_multiplier,
+            booking_data.with_driver
+        )
+    
     # Create booking
     booking_id = str(uuid.uuid4())
     booking_dict = {
@@ -163,7 +248,26 @@ async def create_booking(
         "updated_at": datetime.utcnow().isoformat(),
     }
     
-    response = supabase.table("bookings").insert(booking_dict).execute()
+    # Keep the car held until the payment webhook confirms the booking
+    hold = hold_store.place(
+        booking_data.vehicle_id,
+        current_user.id,
+        booking_data.pickup_date,
+        booking_data.return_date,
+        booking_id=booking_id
+    )
+    if not hold:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Vehicle is being booked by another customer for these dates"
+        )
+    
+    response = None
+    try:
+        response = supabase.table("bookings").insert(booking_dict).execute()
+    finally:
+        if not (response and response.data):
+            hold_store.release_bookings([booking_id])
     
     if not response.data:
         raise HTTPException(
@@ -171,6 +275,11 @@ async def create_booking(
             detail="Failed to create booking"
         )
     
+    if quote:
+        quote_store.invalidate(booking_data.quote_id)
+    
+    outbox_dispatcher.notify()
+    
     booking = response.data[0]
     booking["vehicle"] = vehicle
     
@@ -247,8 +356,8 @@ async def update_booking(
     """Update booking"""
     supabase = get_supabase()
     
-    # Get existing booking
-    existing = supabase.table("bookings").select("*").eq("id", booking_id).execute()
+    # Get existing booking (with its vehicle, which a mutation never changes)
+    existing = supabase.table("bookings").select("*, vehicles(*)").eq("id", booking_id).execute()
     if not existing.data:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -256,6 +365,7 @@ async def update_booking(
         )
     
     booking = existing.data[0]
+    vehicle = booking.pop("vehicles", None) or {}
     
     # Check authorization
     if booking["customer_id"] != current_user.id and current_user.role not in [UserRole.ORG_ADMIN, UserRole.AGENCY_ADMIN]:
@@ -281,17 +391,21 @@ async def update_booking(
     
     update_data["updated_at"] = datetime.utcnow().isoformat()
     
-    response = supabase.table("bookings").update(update_data).eq("id", booking_id).execute()
+    # Guarded write: only applies if the status was not changed concurrently
+    response = supabase.table("bookings").update(update_data).eq("id", booking_id).eq(
+        "status", booking["status"]
+    ).execute()
     
     if not response.data:
         raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail="Failed to update booking"
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Booking was modified concurrently, please retry"
         )
     
+    outbox_dispatcher.notify()
+    
     booking = response.data[0]
-    vehicle_response = supabase.table("vehicles").select("*").eq("id", booking["vehicle_id"]).execute()
-    booking["vehicle"] = vehicle_response.data[0] if vehicle_response.data else {}
+    booking["vehicle"] = vehicle
     
     return BookingResponse(**booking)
 
@@ -304,8 +418,8 @@ async def cancel_booking(
     """Cancel a booking"""
     supabase = get_supabase()
     
-    # Get existing booking
-    existing = supabase.table("bookings").select("*").eq("id", booking_id).execute()
+    # Get existing booking (with its vehicle, which a mutation never changes)
+    existing = supabase.table("bookings").select("*, vehicles(*)").eq("id", booking_id).execute()
     if not existing.data:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -313,6 +427,7 @@ async def cancel_booking(
         )
     
     booking = existing.data[0]
+    vehicle = booking.pop("vehicles", None) or {}
     
     # Check authorization
     if booking["customer_id"] != current_user.id:
@@ -328,15 +443,23 @@ async def cancel_booking(
             detail="Cannot cancel booking in current status"
         )
     
-    # Update status
+    # Update status (guarded against a concurrent status change)
     response = supabase.table("bookings").update({
         "status": BookingStatus.CANCELLED.value,
         "updated_at": datetime.utcnow().isoformat()
-    }).eq("id", booking_id).execute()
+    }).eq("id", booking_id).eq("status", booking["status"]).execute()
+    
+    if not response.data:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Booking was modified concurrently, please retry"
+        )
+    
+    hold_store.release_bookings([booking_id])
+    outbox_dispatcher.notify()
     
     booking = response.data[0]
-    vehicle_response = supabase.table("vehicles").select("*").eq("id", booking["vehicle_id"]).execute()
-    booking["vehicle"] = vehicle_response.data[0] if vehicle_response.data else {}
+    booking["vehicle"] = vehicle
     
     return BookingResponse(**booking)
 
@@ -348,18 +471,21 @@ async def check_availability(
     current_user: User
 ):
     """Check vehicle availability"""
+    # Checkout holds by other customers are checked in memory first
+    held = hold_store.conflicts(vehicle_id, start_date, end_date, exclude_user=current_user.id)
+    if held:
+        return {
+            "available": False,
+            "conflicting_bookings": 0,
+            "conflicting_holds": held
+        }
+    
     supabase = get_supabase()
     
-    bookings = supabase.table("bookings").select("*").eq("vehicle_id", vehicle_id).or_(
-        f"and(pickup_date.lte.{start_date.isoformat()},return_date.gte.{start_date.isoformat()}),"
-        f"and(pickup_date.lte.{end_date.isoformat()},return_date.gte.{end_date.isoformat()}),"
-        f"and(pickup_date.gte.{start_date.isoformat()},return_date.lte.{end_date.isoformat()})"
-    ).in_("status", ["confirmed", "in_progress"]).execute()
+    conflicts = find_conflicting_bookings(supabase, vehicle_id, start_date, end_date)
     
     return {
-        "available": len(bookings.data) == 0,
-        "conflicting_bookings": len(bookings.data)
+        "available": len(conflicts) == 0,
+        "conflicting_bookings": len(conflicts),
+        "conflicting_holds": 0
     }
-
-
-
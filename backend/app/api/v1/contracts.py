@@ -7,7 +7,10 @@ from app.models.contract import (
 from app.models.booking import Booking, BookingStatus
 from app.auth_supabase import get_current_user, require_role
 from app.models.user import User, UserRole
-from app.database import get_supabase
+from app.database import get_supabase, get_supabase_admin
+from app.contract_pdf import CONTRACTS_BUCKET, contract_pdf_service
+from app.signed_urls import signed_urls, storage_path
+from app.signature_images import SIGNATURE_BUCKET, signature_folder
 from config import settings
 from datetime import datetime
 import uuid
@@ -17,12 +20,22 @@ import json
 router = APIRouter()
 
 
-async def generate_contract_pdf(contract: dict) -> str:
-    """Generate PDF contract document"""
-    # This is a placeholder - implement PDF generation using reportlab
-    # Upload to S3 and return URL
-    # For now, return a placeholder URL
-    return f"https://example.com/contracts/{contract['id']}.pdf"
+def signed_contract(record: dict) -> Contract:
+    """Contract model with PDF and signature paths turned into signed URLs (both are private)"""
+    record = dict(record)
+    fields = ("pdf_url", "signed_pdf_url")
+    paths = {field: storage_path(CONTRACTS_BUCKET, record.get(field)) for field in fields}
+    urls = signed_urls.sign(CONTRACTS_BUCKET, [path for path in paths.values() if path])
+    for field, path in paths.items():
+        record[field] = urls.get(path) if path else None
+    
+    # Older contracts stored a URL, which is passed through as it is
+    fields = ("customer_signature_url", "agency_signature_url")
+    paths = {field: record[field] for field in fields if record.get(field) and "://" not in record[field]}
+    urls = signed_urls.sign(SIGNATURE_BUCKET, paths.values())
+    for field, path in paths.items():
+        record[field] = urls.get(path)
+    return Contract(**record)
 
 
 async def submit_to_rta(contract: dict, environment: str = "sandbox") -> dict:
@@ -61,6 +74,47 @@ async def submit_to_rta(contract: dict, environment: str = "sandbox") -> dict:
         )
 
 
+def create_contract_for_booking(
+    supabase,
+    booking: dict,
+    terms_and_conditions: Optional[str] = None,
+    special_conditions: Optional[str] = None
+) -> dict:
+    """Insert a draft contract for a booking and queue rendering of its PDF"""
+    # Generate contract number
+    contract_number = f"CONTRACT-{datetime.utcnow().strftime('%Y%m%d')}-{uuid.uuid4().hex[:8].upper()}"
+    
+    contract_id = str(uuid.uuid4())
+    contract_dict = {
+        "id": contract_id,
+        "booking_id": booking["id"],
+        "customer_id": booking["customer_id"],
+        "vehicle_id": booking["vehicle_id"],
+        "organization_id": booking["organization_id"],
+        "contract_number": contract_number,
+        "start_date": booking["pickup_date"],
+        "end_date": booking["return_date"],
+        "status": ContractStatus.DRAFT.value,
+        "terms_and_conditions": terms_and_conditions,
+        "special_conditions": special_conditions,
+        "created_at": datetime.utcnow().isoformat(),
+        "updated_at": datetime.utcnow().isoformat(),
+    }
+    
+    response = supabase.table("contracts").insert(contract_dict).execute()
+    
+    if not response.data:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Failed to create contract"
+        )
+    
+    # Rendered in a worker process; pdf_url is set once the PDF is stored
+    contract_pdf_service.schedule(contract_id)
+    
+    return response.data[0]
+
+
 @router.post("/", response_model=Contract, status_code=status.HTTP_201_CREATED)
 async def create_contract(
     contract_data: ContractCreate,
@@ -101,46 +155,14 @@ async def create_contract(
             detail="Contract already exists for this booking"
         )
     
-    # Generate contract number
-    contract_number = f"CONTRACT-{datetime.utcnow().strftime('%Y%m%d')}-{uuid.uuid4().hex[:8].upper()}"
-    
-    contract_id = str(uuid.uuid4())
-    contract_dict = {
-        "id": contract_id,
-        "booking_id": contract_data.booking_id,
-        "customer_id": booking["customer_id"],
-        "vehicle_id": booking["vehicle_id"],
-        "organization_id": booking["organization_id"],
-        "contract_number": contract_number,
-        "start_date": booking["pickup_date"],
-        "end_date": booking["return_date"],
-        "status": ContractStatus.DRAFT.value,
-        "terms_and_conditions": contract_data.terms_and_conditions,
-        "special_conditions": contract_data.special_conditions,
-        "created_at": datetime.utcnow().isoformat(),
-        "updated_at": datetime.utcnow().isoformat(),
-    }
-    
-    response = supabase.table("contracts").insert(contract_dict).execute()
-    
-    if not response.data:
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail="Failed to create contract"
-        )
-    
-    # Generate PDF
-    pdf_url = await generate_contract_pdf(response.data[0])
-    
-    # Update contract with PDF URL
-    supabase.table("contracts").update({
-        "pdf_url": pdf_url
-    }).eq("id", contract_id).execute()
+    contract = create_contract_for_booking(
+        supabase,
+        booking,
+        contract_data.terms_and_conditions,
+        contract_data.special_conditions
+    )
     
-    contract = response.data[0]
-    contract["pdf_url"] = pdf_url
-    
-    return Contract(**contract)
+    return signed_contract(contract)
 
 
 @router.get("/{contract_id}", response_model=Contract)
@@ -168,16 +190,16 @@ async def get_contract(
             detail="Not authorized"
         )
     
-    return Contract(**contract)
+    return signed_contract(contract)
 
 
 @router.post("/{contract_id}/sign")
 async def sign_contract(
     contract_id: str,
-    signature_url: str,
+    signature_url: Optional[str] = None,
     current_user: User = Depends(get_current_user)
 ):
-    """Sign contract"""
+    """Sign contract as the customer or the agency"""
     supabase = get_supabase()
     
     # Get contract
@@ -191,26 +213,67 @@ async def sign_contract(
     contract = contract_response.data[0]
     
     # Check authorization
-    if contract["customer_id"] != current_user.id:
+    if contract["customer_id"] == current_user.id:
+        party = "customer"
+    elif (
+        current_user.role in [UserRole.ORG_ADMIN, UserRole.AGENCY_ADMIN]
+        and current_user.organization_id == contract["organization_id"]
+    ):
+        party = "agency"
+    else:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Not authorized to sign this contract"
         )
     
-    # Update contract with signature
-    update_data = {
-        "customer_signature_url": signature_url,
-        "customer_signed_at": datetime.utcnow().isoformat(),
-        "updated_at": datetime.utcnow().isoformat()
-    }
+    # Signatures are stored as paths in the signer's own folder and signed
+    # when needed, so they never expire on the contract
+    signature_path = storage_path(SIGNATURE_BUCKET, signature_url)
+    if signature_url and (
+        not signature_path
+        or not signature_path.startswith(f"{signature_folder(current_user.id)}/")
+        or ".." in signature_path
+    ):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Upload the signature with the contract_signature upload target first"
+        )
+    if not signature_path and party == "customer":
+        # Customers can sign with the signature from their KYC application
+        kyc_response = supabase.table("kyc").select("signature_image").eq("user_id", current_user.id).execute()
+        if kyc_response.data:
+            signature_path = kyc_response.data[0].get("signature_image")
+    if not signature_path:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="signature_url is required"
+        )
     
-    # If both parties signed, update status
-    if contract.get("agency_signature_url"):
-        update_data["status"] = ContractStatus.SIGNED.value
+    # Signatures are final once both parties have signed
+    if contract["status"] != ContractStatus.DRAFT.value:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Contract can no longer be signed"
+        )
     
-    response = supabase.table("contracts").update(update_data).eq("id", contract_id).execute()
+    # The RPC sets status to signed in the same UPDATE when the other party
+    # has signed, so concurrent signatures cannot both miss each other
+    response = get_supabase_admin().rpc("sign_contract_party", {
+        "p_contract_id": contract_id,
+        "p_party": party,
+        "p_signature_path": signature_path
+    }).execute()
+    if not response.data:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Contract can no longer be signed"
+        )
+    
+    if response.data[0]["status"] == ContractStatus.SIGNED.value:
+        # Rendered in a worker process; signed_pdf_url and its hash are set once stored
+        contract_pdf_service.schedule(contract_id, signed=True)
     
-    return Contract(**response.data[0])
+    return signed_contract(response.data[0])
 
 
 @router.post("/{contract_id}/submit-rta")
@@ -254,7 +317,7 @@ async def submit_contract_to_rta(
     
     response = supabase.table("contracts").update(update_data).eq("id", contract_id).execute()
     
-    return Contract(**response.data[0])
+    return signed_contract(response.data[0])
 
 
 @router.get("/booking/{booking_id}", response_model=Contract)
@@ -282,7 +345,7 @@ async def get_booking_contract(
             detail="Not authorized"
         )
     
-    return Contract(**response.data[0])
+    return signed_contract(response.data[0])
 
 
 
@@ -1,18 +1,88 @@
-from fastapi import APIRouter, HTTPException, status, Depends, UploadFile, File
-from typing import Optional
+from fastapi import APIRouter, HTTPException, status, Depends, UploadFile, File, Query
+from typing import List, Optional, Tuple
 from app.models.kyc import (
     KYC, KYCCreate, KYCDocumentUpload, KYCSignatureUpload,
-    KYCUpdate, KYCStatus, DocumentType
+    KYCUpdate, KYCStatus, DocumentType, KYCQueuePage
 )
 from app.auth_supabase import get_current_user, require_role
 from app.models.user import User, UserRole
-from app.database import get_supabase
-from app.storage import upload_file
-from datetime import datetime
+from app.database import get_supabase, get_supabase_admin
+from app.storage import storage
+from app.signed_urls import signed_urls, storage_path
+from config import settings
+from datetime import datetime, timedelta, timezone
+import base64
 import uuid
 
 router = APIRouter()
 
+# KYC files are private: rows store object paths and responses carry signed URLs
+KYC_BUCKET = "kyc-documents"
+KYC_FILE_FIELDS = [
+    "emirates_id_front", "emirates_id_back",
+    "passport_front", "passport_back",
+    "driving_license_front", "driving_license_back",
+    "visa", "signature_image",
+]
+
+
+def sign_kyc_records(records: List[dict]) -> List[KYC]:
+    """KYC models with every document replaced by a signed URL (one storage call for all records)"""
+    paths = [
+        storage_path(KYC_BUCKET, record.get(field))
+        for record in records for field in KYC_FILE_FIELDS
+    ]
+    urls = signed_urls.sign(KYC_BUCKET, [path for path in paths if path])
+    
+    signed = []
+    for record in records:
+        record = dict(record)
+        for field in KYC_FILE_FIELDS:
+            path = storage_path(KYC_BUCKET, record.get(field))
+            record[field] = urls.get(path) if path else None
+        signed.append(KYC(**record))
+    return signed
+
+
+def signed_kyc(record: dict) -> KYC:
+    return sign_kyc_records([record])[0]
+
+
+def document_field(document_type: DocumentType, side: Optional[str]) -> str:
+    """KYC column that stores a document (front/back side where applicable)"""
+    if document_type == DocumentType.VISA:
+        return "visa"
+    if side not in ("front", "back"):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Side must be 'front' or 'back'"
+        )
+    if document_type == DocumentType.EMIRATES_ID:
+        return f"emirates_id_{side}"
+    if document_type == DocumentType.PASSPORT:
+        return f"passport_{side}"
+    if document_type == DocumentType.DRIVING_LICENSE:
+        return f"driving_license_{side}"
+    raise HTTPException(
+        status_code=status.HTTP_400_BAD_REQUEST,
+        detail="Invalid document type"
+    )
+
+
+def record_kyc_document(supabase, kyc: dict, field: str, file_path: str):
+    """Store a document's storage path on the KYC record, moving it to under_review"""
+    update_data = {
+        field: file_path,
+        "updated_at": datetime.utcnow().isoformat()
+    }
+    
+    # If all required documents uploaded, change status to under_review
+    # (This is simplified - implement proper validation)
+    if kyc["status"] == KYCStatus.PENDING.value:
+        update_data["status"] = KYCStatus.UNDER_REVIEW.value
+    
+    return supabase.table("kyc").update(update_data).eq("id", kyc["id"]).execute()
+
 
 @router.post("/", response_model=KYC, status_code=status.HTTP_201_CREATED)
 async def create_kyc(
@@ -53,7 +123,7 @@ async def create_kyc(
             detail="Failed to create KYC application"
         )
     
-    return KYC(**response.data[0])
+    return signed_kyc(response.data[0])
 
 
 @router.get("/", response_model=KYC)
@@ -71,7 +141,7 @@ async def get_kyc(
             detail="KYC not found"
         )
     
-    return KYC(**response.data[0])
+    return signed_kyc(response.data[0])
 
 
 @router.post("/documents/{document_type}")
@@ -93,47 +163,23 @@ async def upload_document(
         )
     
     kyc = kyc_response.data[0]
+    update_field = document_field(document_type, side)
     
-    # Upload file to Supabase Storage
-    file_url = await upload_file(
+    # Stream to Supabase Storage (size limited, large photos downscaled)
+    uploaded = await storage.upload_file_streaming(
         file=file,
-        bucket="kyc-documents",
+        bucket=KYC_BUCKET,
         folder=f"{current_user.id}/{document_type.value}"
     )
     
-    # Update KYC with document URL
-    update_field = None
-    if document_type == DocumentType.EMIRATES_ID:
-        update_field = f"emirates_id_{side}"
-    elif document_type == DocumentType.PASSPORT:
-        update_field = f"passport_{side}"
-    elif document_type == DocumentType.DRIVING_LICENSE:
-        update_field = f"driving_license_{side}"
-    elif document_type == DocumentType.VISA:
-        update_field = "visa"
-    
-    if not update_field:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Invalid document type"
-        )
-    
-    update_data = {
-        update_field: file_url,
-        "updated_at": datetime.utcnow().isoformat()
-    }
-    
-    # If all required documents uploaded, change status to under_review
-    # (This is simplified - implement proper validation)
-    if kyc["status"] == KYCStatus.PENDING.value:
-        update_data["status"] = KYCStatus.UNDER_REVIEW.value
-    
-    response = supabase.table("kyc").update(update_data).eq("id", kyc["id"]).execute()
+    # Update KYC with document path
+    response = record_kyc_document(supabase, kyc, update_field, uploaded["path"])
+    signed = signed_kyc(response.data[0])
     
     return {
         "message": "Document uploaded successfully",
-        "file_url": file_url,
-        "kyc": KYC(**response.data[0])
+        "file_url": getattr(signed, update_field),
+        "kyc": signed
     }
 
 
@@ -156,25 +202,116 @@ async def upload_signature(
     kyc = kyc_response.data[0]
     
     # Upload signature to Supabase Storage
-    signature_url = await upload_file(
+    uploaded = await storage.upload_file_streaming(
         file=file,
-        bucket="kyc-documents",
+        bucket=KYC_BUCKET,
         folder=f"{current_user.id}/signatures"
     )
     
     # Update KYC
     response = supabase.table("kyc").update({
-        "signature_image": signature_url,
+        "signature_image": uploaded["path"],
         "updated_at": datetime.utcnow().isoformat()
     }).eq("id", kyc["id"]).execute()
+    signed = signed_kyc(response.data[0])
     
     return {
         "message": "Signature uploaded successfully",
-        "signature_url": signature_url,
-        "kyc": KYC(**response.data[0])
+        "signature_url": signed.signature_image,
+        "kyc": signed
     }
 
 
+def _encode_cursor(row: dict) -> str:
+    return base64.urlsafe_b64encode(f"{row['updated_at']}|{row['id']}".encode()).decode()
+
+
+def _decode_cursor(cursor: str) -> Tuple[str, str]:
+    try:
+        updated_at, kyc_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|", 1)
+        # Both values end up in a filter expression, so only well-formed ones pass
+        datetime.fromisoformat(updated_at.replace("Z", "+00:00"))
+        uuid.UUID(kyc_id)
+    except ValueError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid cursor"
+        )
+    return updated_at, kyc_id
+
+
+def _lease_holder(kyc: dict) -> Optional[str]:
+    """Reviewer currently holding a live lease on the application, if any"""
+    if not kyc.get("claimed_by") or not kyc.get("claimed_at"):
+        return None
+    claimed_at = datetime.fromisoformat(kyc["claimed_at"].replace("Z", "+00:00"))
+    if claimed_at + timedelta(minutes=settings.KYC_CLAIM_LEASE_MINUTES) < datetime.now(timezone.utc):
+        return None
+    return kyc["claimed_by"]
+
+
+@router.get("/queue", response_model=KYCQueuePage)
+async def get_review_queue(
+    limit: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = None,
+    current_user: User = Depends(require_role([UserRole.ORG_ADMIN, UserRole.SUPPORT]))
+):
+    """Applications awaiting review, oldest first (Admin only)"""
+    supabase = get_supabase()
+    
+    # Keyset pagination on (updated_at, id), served by idx_kyc_review_queue
+    query = supabase.table("kyc").select("*").eq("status", KYCStatus.UNDER_REVIEW.value)
+    if cursor:
+        updated_at, last_id = _decode_cursor(cursor)
+        query = query.or_(
+            f'updated_at.gt."{updated_at}",and(updated_at.eq."{updated_at}",id.gt.{last_id})'
+        )
+    response = query.order("updated_at").order("id").limit(limit + 1).execute()
+    
+    rows = response.data[:limit]
+    next_cursor = _encode_cursor(rows[-1]) if len(response.data) > limit else None
+    
+    return KYCQueuePage(items=sign_kyc_records(rows), next_cursor=next_cursor)
+
+
+@router.post("/queue/claim", response_model=List[KYC])
+async def claim_reviews(
+    limit: int = Query(5, ge=1, le=50),
+    current_user: User = Depends(require_role([UserRole.ORG_ADMIN, UserRole.SUPPORT]))
+):
+    """Lease the oldest unclaimed applications to the current reviewer (Admin only)"""
+    supabase = get_supabase_admin()
+    
+    # Rows locked by a concurrent claim are skipped, never waited on or shared
+    response = supabase.rpc("claim_kyc_reviews", {
+        "p_reviewer": current_user.id,
+        "p_limit": limit,
+        "p_lease_seconds": settings.KYC_CLAIM_LEASE_MINUTES * 60,
+    }).execute()
+    
+    rows = sorted(response.data or [], key=lambda row: (row["updated_at"], row["id"]))
+    return sign_kyc_records(rows)
+
+
+@router.get("/{kyc_id}", response_model=KYC)
+async def get_kyc_for_review(
+    kyc_id: str,
+    current_user: User = Depends(require_role([UserRole.ORG_ADMIN, UserRole.SUPPORT]))
+):
+    """Get a KYC application with all documents (Admin only)"""
+    supabase = get_supabase()
+    
+    response = supabase.table("kyc").select("*").eq("id", kyc_id).execute()
+    
+    if not response.data:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="KYC not found"
+        )
+    
+    return signed_kyc(response.data[0])
+
+
 @router.put("/{kyc_id}", response_model=KYC)
 async def update_kyc(
     kyc_id: str,
@@ -192,9 +329,19 @@ async def update_kyc(
             detail="KYC not found"
         )
     
+    # Applications leased to another reviewer are theirs until the lease runs out
+    holder = _lease_holder(existing.data[0])
+    if holder and holder != current_user.id:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="KYC is claimed by another reviewer"
+        )
+    
     update_data = kyc_update.dict(exclude_unset=True)
     if "status" in update_data:
         update_data["status"] = update_data["status"].value
+        update_data["claimed_by"] = None
+        update_data["claimed_at"] = None
     
     update_data["reviewed_by"] = current_user.id
     update_data["reviewed_at"] = datetime.utcnow().isoformat()
@@ -216,6 +363,6 @@ async def update_kyc(
             detail="Failed to update KYC"
         )
     
-    return KYC(**response.data[0])
+    return signed_kyc(response.data[0])
 
 
@@ -1,17 +1,73 @@
-from fastapi import APIRouter, HTTPException, status, Depends
-from typing import List
+from fastapi import APIRouter, HTTPException, status, Depends, Query
+from typing import List, Optional
 from app.models.loyalty import (
-    LoyaltyPoints, LoyaltyTransaction, LoyaltyEarnRequest, LoyaltyRedeemRequest,
-    LoyaltyTransactionType
+    LoyaltyPoints, LoyaltyTransaction, LoyaltyEarnRequest,
+    LoyaltyTransactionType, LoyaltyTier, LeaderboardEntry
 )
 from app.auth_supabase import get_current_user, require_role
 from app.models.user import User, UserRole
-from app.database import get_supabase
+from app.database import get_supabase, get_supabase_admin
+from app.leaderboard import loyalty_leaderboard
+from postgrest.exceptions import APIError
 from datetime import datetime, timedelta
 import uuid
 
 router = APIRouter()
 
+# How long a request waits for the leaderboard's first load
+LEADERBOARD_WAIT_SECONDS = 5.0
+
+
+def post_loyalty_transaction(
+    supabase,
+    user_id: str,
+    transaction_type: LoyaltyTransactionType,
+    points: int,
+    booking_id: Optional[str] = None,
+    description: Optional[str] = None,
+    expires_at: Optional[datetime] = None
+) -> Optional[dict]:
+    """
+    Append a ledger entry and apply it to the balance atomically (loyalty_post RPC)
+    
+    Returns:
+        dict: The transaction plus the resulting 'available_points', or None
+        if the booking has already earned its points
+    
+    Raises:
+        HTTPException: 400 if a negative entry exceeds the available points
+    """
+    try:
+        response = supabase.rpc("loyalty_post", {
+            "p_user_id": user_id,
+            "p_type": transaction_type.value,
+            "p_points": points,
+            "p_booking_id": booking_id,
+            "p_description": description,
+            "p_expires_at": expires_at.isoformat() if expires_at else None,
+        }).execute()
+    except APIError as e:
+        if e.message == "insufficient_loyalty_points":
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Insufficient loyalty points"
+            )
+        raise
+    return response.data
+
+
+def credit_booking_points(supabase, user_id: str, booking_id: str, points: int) -> Optional[dict]:
+    """Record an earn transaction for a booking and add it to the user's balance"""
+    return post_loyalty_transaction(
+        supabase,
+        user_id,
+        LoyaltyTransactionType.EARNED,
+        points,
+        booking_id=booking_id,
+        description=f"Points earned from booking {booking_id}",
+        expires_at=datetime.utcnow() + timedelta(days=365)  # Points expire in 1 year
+    )
+
 
 @router.get("/points", response_model=LoyaltyPoints)
 async def get_loyalty_points(
@@ -36,7 +92,59 @@ async def get_loyalty_points(
         supabase.table("loyalty_points").insert(points_dict).execute()
         return LoyaltyPoints(**points_dict)
     
-    return LoyaltyPoints(**response.data[0])
+    points = response.data[0]
+    
+    # Earliest-expiring live lot (index on user_id, expires_at where remaining > 0);
+    # lots that never expire sort last
+    next_lot = supabase.table("loyalty_lots").select("expires_at, remaining").eq(
+        "user_id", current_user.id
+    ).gt("remaining", 0).order("expires_at").limit(1).execute()
+    if next_lot.data and next_lot.data[0]["expires_at"]:
+        points["next_expiry_at"] = next_lot.data[0]["expires_at"]
+        points["next_expiry_points"] = next_lot.data[0]["remaining"]
+    
+    return LoyaltyPoints(**points)
+
+
+async def require_leaderboard():
+    """503 while the leaderboard index is still being loaded"""
+    if not await loyalty_leaderboard.wait_ready(LEADERBOARD_WAIT_SECONDS):
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Leaderboard is loading, please retry shortly"
+        )
+
+
+@router.get("/tier", response_model=LoyaltyTier)
+async def get_loyalty_tier(
+    current_user: User = Depends(get_current_user)
+):
+    """Get current user's loyalty tier and leaderboard rank"""
+    await require_leaderboard()
+    return LoyaltyTier(**loyalty_leaderboard.standing(current_user.id))
+
+
+@router.get("/leaderboard", response_model=List[LeaderboardEntry])
+async def get_loyalty_leaderboard(
+    page: int = Query(1, ge=1),
+    limit: int = Query(20, ge=1, le=100),
+    current_user: User = Depends(get_current_user)
+):
+    """Get the loyalty leaderboard (by lifetime points)"""
+    await require_leaderboard()
+    entries = loyalty_leaderboard.top(limit, (page - 1) * limit)
+    if not entries:
+        return []
+    
+    supabase = get_supabase_admin()
+    
+    # First names only, to keep the leaderboard public-safe
+    users = supabase.table("users").select("id, full_name").in_(
+        "id", [entry["user_id"] for entry in entries]
+    ).execute()
+    names = {user["id"]: (user["full_name"] or "").split(" ")[0] or None for user in users.data}
+    
+    return [LeaderboardEntry(**entry, display_name=names.get(entry["user_id"])) for entry in entries]
 
 
 @router.get("/transactions", response_model=List[LoyaltyTransaction])
@@ -96,96 +204,20 @@ async def earn_loyalty_points(
     # 1 mile = 1 point (simplified - calculate actual miles from booking)
     points = earn_request.points
     
-    # Create transaction
-    transaction_id = str(uuid.uuid4())
-    expires_at = datetime.utcnow() + timedelta(days=365)  # Points expire in 1 year
-    
-    transaction_dict = {
-        "id": transaction_id,
-        "user_id": current_user.id,
-        "booking_id": earn_request.booking_id,
-        "transaction_type": LoyaltyTransactionType.EARNED.value,
-        "points": points,
-        "description": f"Points earned from booking {earn_request.booking_id}",
-        "expires_at": expires_at.isoformat(),
-        "created_at": datetime.utcnow().isoformat(),
-    }
-    
-    supabase.table("loyalty_transactions").insert(transaction_dict).execute()
-    
-    # Update loyalty points
-    points_response = supabase.table("loyalty_points").select("*").eq("user_id", current_user.id).execute()
+    transaction_dict = credit_booking_points(
+        get_supabase_admin(),
+        current_user.id,
+        earn_request.booking_id,
+        points
+    )
     
-    if points_response.data:
-        current_points = points_response.data[0]
-        supabase.table("loyalty_points").update({
-            "total_points": current_points["total_points"] + points,
-            "available_points": current_points["available_points"] + points,
-            "lifetime_points": current_points["lifetime_points"] + points,
-            "updated_at": datetime.utcnow().isoformat(),
-        }).eq("id", current_points["id"]).execute()
-    else:
-        # Create if doesn't exist
-        points_id = str(uuid.uuid4())
-        supabase.table("loyalty_points").insert({
-            "id": points_id,
-            "user_id": current_user.id,
-            "total_points": points,
-            "available_points": points,
-            "lifetime_points": points,
-            "updated_at": datetime.utcnow().isoformat(),
-        }).execute()
-    
-    return {
-        "message": f"Earned {points} loyalty points",
-        "transaction": LoyaltyTransaction(**transaction_dict)
-    }
-
-
-@router.post("/redeem")
-async def redeem_loyalty_points(
-    redeem_request: LoyaltyRedeemRequest,
-    current_user: User = Depends(get_current_user)
-):
-    """Redeem loyalty points"""
-    supabase = get_supabase()
-    
-    # Get current points
-    points_response = supabase.table("loyalty_points").select("*").eq("user_id", current_user.id).execute()
-    
-    if not points_response.data or points_response.data[0]["available_points"] < redeem_request.points:
+    if not transaction_dict:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Insufficient loyalty points"
+            detail="Points already earned for this booking"
         )
     
-    current_points = points_response.data[0]
-    
-    # Create redemption transaction
-    transaction_id = str(uuid.uuid4())
-    transaction_dict = {
-        "id": transaction_id,
-        "user_id": current_user.id,
-        "booking_id": redeem_request.booking_id,
-        "transaction_type": LoyaltyTransactionType.REDEEMED.value,
-        "points": -redeem_request.points,
-        "description": f"Redeemed {redeem_request.points} points",
-        "created_at": datetime.utcnow().isoformat(),
-    }
-    
-    supabase.table("loyalty_transactions").insert(transaction_dict).execute()
-    
-    # Update loyalty points
-    supabase.table("loyalty_points").update({
-        "available_points": current_points["available_points"] - redeem_request.points,
-        "updated_at": datetime.utcnow().isoformat(),
-    }).eq("id", current_points["id"]).execute()
-    
     return {
-        "message": f"Redeemed {redeem_request.points} loyalty points",
-        "remaining_points": current_points["available_points"] - redeem_request.points,
+        "message": f"Earned {points} loyalty points",
         "transaction": LoyaltyTransaction(**transaction_dict)
     }
-
-
-
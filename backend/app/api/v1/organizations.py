@@ -0,0 +1,72 @@
+from fastapi import APIRouter, HTTPException, status, Depends, Query
+from typing import Optional
+from app.models.organization import OrganizationDashboard
+from app.auth_supabase import require_role
+from app.models.user import User, UserRole
+from app.database import get_supabase
+from datetime import date, timedelta
+
+router = APIRouter()
+
+
+@router.get("/{organization_id}/dashboard", response_model=OrganizationDashboard)
+async def get_organization_dashboard(
+    organization_id: str,
+    from_date: Optional[date] = Query(None, alias="from"),
+    to_date: Optional[date] = Query(None, alias="to"),
+    current_user: User = Depends(require_role([UserRole.ORG_ADMIN, UserRole.AGENCY_ADMIN]))
+):
+    """Fleet summary for an organization (defaults to the last 30 days)"""
+    # Admins can only see their own organization
+    if current_user.organization_id != organization_id:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Not authorized to view this organization"
+        )
+    
+    to_date = to_date or date.today()
+    from_date = from_date or to_date - timedelta(days=29)
+    if from_date > to_date:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="'from' must be on or before 'to'"
+        )
+    
+    supabase = get_supabase()
+    
+    # Read from rollups only (database/organization_rollups.sql)
+    daily = supabase.table("organization_daily_stats").select("*").eq(
+        "organization_id", organization_id
+    ).gte("day", from_date.isoformat()).lte("day", to_date.isoformat()).execute()
+    
+    current = supabase.table("organization_stats").select("*").eq(
+        "organization_id", organization_id
+    ).execute()
+    stats = current.data[0] if current.data else {}
+    
+    revenue = sum(float(row["revenue"] or 0) for row in daily.data)
+    refunds = sum(float(row["refunds"] or 0) for row in daily.data)
+    booked_hours = sum(float(row["booked_hours"] or 0) for row in daily.data)
+    rating_sum = sum(float(row["rating_sum"] or 0) for row in daily.data)
+    rating_count = sum(row["rating_count"] or 0 for row in daily.data)
+    
+    fleet_size = stats.get("fleet_size", 0)
+    window_hours = ((to_date - from_date).days + 1) * 24
+    utilization = booked_hours / (fleet_size * window_hours) if fleet_size else 0.0
+    
+    return OrganizationDashboard(
+        organization_id=organization_id,
+        from_date=from_date,
+        to_date=to_date,
+        revenue=round(revenue, 2),
+        refunds=round(refunds, 2),
+        net_revenue=round(revenue - refunds, 2),
+        fleet_size=fleet_size,
+        booked_hours=round(booked_hours, 2),
+        utilization=round(min(utilization, 1.0), 4),
+        bookings_confirmed=sum(row["bookings_confirmed"] or 0 for row in daily.data),
+        bookings_cancelled=sum(row["bookings_cancelled"] or 0 for row in daily.data),
+        active_rentals=stats.get("active_rentals", 0),
+        average_rating=round(rating_sum / rating_count, 2) if rating_count else None,
+        total_reviews=rating_count,
+    )
@@ -1,49 +1,64 @@
-from fastapi import APIRouter, HTTPException, status, Depends, Header
+from fastapi import APIRouter, HTTPException, status, Depends, Header, Request
 from typing import Optional
 from app.models.payment import Payment, PaymentCreate, PaymentIntentResponse, PaymentStatus
 from app.models.booking import Booking, BookingStatus
 from app.auth_supabase import get_current_user, require_role
 from app.models.user import User, UserRole
-from app.database import get_supabase
+from app.database import get_supabase, get_supabase_admin
+from app.stripe_events import stripe_event_consumer
+from app.idempotency import run_idempotent
+from app.stripe_client import stripe_service
 from config import settings
+from postgrest.exceptions import APIError
 import stripe
 from datetime import datetime
+import json
 import uuid
 
 router = APIRouter()
 stripe.api_key = settings.STRIPE_SECRET_KEY
 
+# prepare_payment() error message -> (HTTP status, detail)
+PREPARE_PAYMENT_ERRORS = {
+    "booking_not_found": (status.HTTP_404_NOT_FOUND, "Booking not found"),
+    "not_authorized": (status.HTTP_403_FORBIDDEN, "Not authorized"),
+    "booking_not_pending": (status.HTTP_409_CONFLICT, "Booking is no longer awaiting payment"),
+    "amount_mismatch": (status.HTTP_400_BAD_REQUEST, "Amount does not match the booking total"),
+    "payment_in_progress": (status.HTTP_409_CONFLICT, "A payment for this booking is already in progress"),
+    "insufficient_loyalty_points": (status.HTTP_400_BAD_REQUEST, "Insufficient loyalty points"),
+    "insufficient_wallet_balance": (status.HTTP_400_BAD_REQUEST, "Insufficient wallet balance"),
+    "payment_already_settled": (status.HTTP_409_CONFLICT, "The payment for this request is already settled"),
+}
+
 
 @router.post("/intent", response_model=PaymentIntentResponse)
 async def create_payment_intent(
     payment_data: PaymentCreate,
-    current_user: User = Depends(get_current_user)
+    current_user: User = Depends(get_current_user),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key")
 ):
-    """Create Stripe payment intent"""
+    """Create Stripe payment intent (retries with the same Idempotency-Key replay the first response)"""
+    return await run_idempotent(
+        idempotency_key,
+        current_user.id,
+        "payments.intent",
+        payment_data,
+        lambda: _create_payment_intent(payment_data, current_user, idempotency_key)
+    )
+
+
+async def _create_payment_intent(
+    payment_data: PaymentCreate,
+    current_user: User,
+    idempotency_key: Optional[str] = None
+) -> PaymentIntentResponse:
     if not settings.STRIPE_SECRET_KEY:
         raise HTTPException(
             status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
             detail="Payment service is not configured. Please configure Stripe keys."
         )
     
-    supabase = get_supabase()
-    
-    # Get booking
-    booking_response = supabase.table("bookings").select("*").eq("id", payment_data.booking_id).execute()
-    if not booking_response.data:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Booking not found"
-        )
-    
-    booking = booking_response.data[0]
-    
-    # Verify booking belongs to user
-    if booking["customer_id"] != current_user.id:
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="Not authorized"
-        )
+    supabase = get_supabase_admin()
     
     # Calculate amount (subtract wallet and loyalty points if used)
     amount = payment_data.amount
@@ -53,55 +68,78 @@ async def create_payment_intent(
         # Convert points to currency (1 point = 0.01 AED)
         amount -= payment_data.loyalty_points_used * 0.01
     
+    # A retry with the same Idempotency-Key gets the same payment id, so both
+    # prepare_payment and the keyed Stripe request below see identical input
+    if idempotency_key:
+        payment_id = str(uuid.uuid5(uuid.NAMESPACE_URL, f"payments.intent:{current_user.id}:{idempotency_key}"))
+    else:
+        payment_id = str(uuid.uuid4())
+    
+    # Check the booking owner, reserve points/wallet funds and create the
+    # pending payment in one transaction
+    try:
+        supabase.rpc("prepare_payment", {
+            "p_payment_id": payment_id,
+            "p_booking_id": payment_data.booking_id,
+            "p_customer_id": current_user.id,
+            "p_amount": payment_data.amount,
+            "p_method": payment_data.method.value,
+            "p_wallet_amount": payment_data.wallet_amount or 0.0,
+            "p_loyalty_points": payment_data.loyalty_points_used or 0,
+        }).execute()
+    except APIError as e:
+        error = PREPARE_PAYMENT_ERRORS.get(e.message)
+        if not error:
+            raise
+        raise HTTPException(status_code=error[0], detail=error[1])
+    
     # Create Stripe payment intent
     try:
-        intent = stripe.PaymentIntent.create(
-            amount=int(amount * 100),  # Convert to cents
-            currency="aed",
-            metadata={
-                "booking_id": payment_data.booking_id,
-                "user_id": current_user.id,
+        intent = await stripe_service.create_payment_intent(
+            {
+                "amount": int(amount * 100),  # Convert to cents
+                "currency": "aed",
+                "metadata": {
+                    "booking_id": payment_data.booking_id,
+                    "user_id": current_user.id,
+                    "payment_id": payment_id,
+                },
             },
-        )
-        
-        # Create payment record
-        payment_id = str(uuid.uuid4())
-        payment_dict = {
-            "id": payment_id,
-            "booking_id": payment_data.booking_id,
-            "customer_id": current_user.id,
-            "amount": payment_data.amount,
-            "currency": "AED",
-            "method": payment_data.method.value,
-            "status": PaymentStatus.PENDING.value,
-            "stripe_payment_intent_id": intent.id,
-            "wallet_amount": payment_data.wallet_amount or 0.0,
-            "loyalty_points_used": payment_data.loyalty_points_used or 0,
-            "created_at": datetime.utcnow().isoformat(),
-            "updated_at": datetime.utcnow().isoformat(),
-        }
-        
-        supabase.table("payments").insert(payment_dict).execute()
-        
-        return PaymentIntentResponse(
-            client_secret=intent.client_secret,
-            payment_intent_id=intent.id,
-            amount=amount,
-            currency="AED"
+            # Stripe de-duplicates too, in case our own key record was lost
+            idempotency_key=f"{current_user.id}:{idempotency_key}" if idempotency_key else None,
         )
     except stripe.error.StripeError as e:
+        # Failing the payment releases the reserved points and funds
+        supabase.table("payments").update({
+            "status": PaymentStatus.FAILED.value,
+            "failure_reason": str(e)[:500],
+            "updated_at": datetime.utcnow().isoformat()
+        }).eq("id", payment_id).execute()
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail=f"Stripe error: {str(e)}"
         )
+    
+    supabase.table("payments").update({
+        "stripe_payment_intent_id": intent.id,
+        "updated_at": datetime.utcnow().isoformat()
+    }).eq("id", payment_id).execute()
+    
+    return PaymentIntentResponse(
+        client_secret=intent.client_secret,
+        payment_intent_id=intent.id,
+        amount=amount,
+        currency="AED"
+    )
 
 
 @router.post("/webhook")
 async def stripe_webhook(
-    payload: bytes = Header(...),
+    request: Request,
     stripe_signature: str = Header(...)
 ):
-    """Handle Stripe webhook events"""
+    """Handle Stripe webhook events (stored and acknowledged, applied in the background)"""
+    payload = await request.body()
     try:
         event = stripe.Webhook.construct_event(
             payload, stripe_signature, settings.STRIPE_WEBHOOK_SECRET
@@ -111,36 +149,17 @@ async def stripe_webhook(
     except stripe.error.SignatureVerificationError:
         raise HTTPException(status_code=400, detail="Invalid signature")
     
-    supabase = get_supabase()
+    supabase = get_supabase_admin()
     
-    # Handle different event types
-    if event["type"] == "payment_intent.succeeded":
-        payment_intent = event["data"]["object"]
-        booking_id = payment_intent["metadata"].get("booking_id")
-        
-        # Update payment status
-        supabase.table("payments").update({
-            "status": PaymentStatus.COMPLETED.value,
-            "stripe_charge_id": payment_intent.get("charges", {}).get("data", [{}])[0].get("id"),
-            "updated_at": datetime.utcnow().isoformat()
-        }).eq("stripe_payment_intent_id", payment_intent["id"]).execute()
-        
-        # Update booking status
-        if booking_id:
-            supabase.table("bookings").update({
-                "status": BookingStatus.CONFIRMED.value,
-                "updated_at": datetime.utcnow().isoformat()
-            }).eq("id", booking_id).execute()
-    
-    elif event["type"] == "payment_intent.payment_failed":
-        payment_intent = event["data"]["object"]
-        
-        # Update payment status
-        supabase.table("payments").update({
-            "status": PaymentStatus.FAILED.value,
-            "failure_reason": payment_intent.get("last_payment_error", {}).get("message"),
-            "updated_at": datetime.utcnow().isoformat()
-        }).eq("stripe_payment_intent_id", payment_intent["id"]).execute()
+    # Stripe retries reuse the event id, so duplicates are dropped here
+    supabase.table("stripe_events").upsert({
+        "id": event["id"],
+        "type": event["type"],
+        "payload": json.loads(payload),
+        "received_at": datetime.utcnow().isoformat(),
+    }, on_conflict="id", ignore_duplicates=True).execute()
+    
+    stripe_event_consumer.notify()
     
     return {"status": "success"}
 
@@ -1,10 +1,11 @@
 from fastapi import APIRouter, HTTPException, status, Depends
 from typing import List, Optional
-from app.models.review import Review, ReviewCreate, ReviewUpdate
+from app.models.review import Review, ReviewCreate, ReviewUpdate, VehicleRatingSummary
 from app.models.booking import Booking, BookingStatus
 from app.auth_supabase import get_current_user
 from app.models.user import User
 from app.database import get_supabase
+from app.ratings import build_rating_summary
 from datetime import datetime
 import uuid
 
@@ -82,19 +83,7 @@ async def create_review(
             detail="Failed to create review"
         )
     
-    # Update vehicle rating
-    vehicle_reviews = supabase.table("reviews").select("rating").eq(
-        "vehicle_id", booking["vehicle_id"]
-    ).execute()
-    
-    if vehicle_reviews.data:
-        avg_rating = sum(r["rating"] for r in vehicle_reviews.data) / len(vehicle_reviews.data)
-        supabase.table("vehicles").update({
-            "rating": round(avg_rating, 2),
-            "total_reviews": len(vehicle_reviews.data),
-            "updated_at": datetime.utcnow().isoformat(),
-        }).eq("id", booking["vehicle_id"]).execute()
-    
+    # Vehicle rating and review count are updated by the reviews_vehicle_ratings trigger
     return Review(**response.data[0])
 
 
@@ -118,6 +107,29 @@ async def get_vehicle_reviews(
     return [Review(**item) for item in response.data]
 
 
+@router.get("/vehicle/{vehicle_id}/summary", response_model=VehicleRatingSummary)
+async def get_vehicle_rating_summary(
+    vehicle_id: str,
+    current_user: Optional[User] = Depends(get_current_user)
+):
+    """Star histogram and category averages for a vehicle"""
+    supabase = get_supabase()
+    
+    # One row per vehicle, kept up to date by the reviews_vehicle_ratings trigger
+    response = supabase.table("vehicle_rating_stats").select("*").eq("vehicle_id", vehicle_id).execute()
+    if response.data:
+        return build_rating_summary(vehicle_id, response.data[0])
+    
+    vehicle_response = supabase.table("vehicles").select("id").eq("id", vehicle_id).execute()
+    if not vehicle_response.data:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Vehicle not found"
+        )
+    
+    return build_rating_summary(vehicle_id, None)
+
+
 @router.get("/{review_id}", response_model=Review)
 async def get_review(
     review_id: str,
@@ -174,19 +186,6 @@ async def update_review(
             detail="Failed to update review"
         )
     
-    # Update vehicle rating if rating changed
-    if "rating" in update_data:
-        vehicle_reviews = supabase.table("reviews").select("rating").eq(
-            "vehicle_id", review["vehicle_id"]
-        ).execute()
-        
-        if vehicle_reviews.data:
-            avg_rating = sum(r["rating"] for r in vehicle_reviews.data) / len(vehicle_reviews.data)
-            supabase.table("vehicles").update({
-                "rating": round(avg_rating, 2),
-                "updated_at": datetime.utcnow().isoformat(),
-            }).eq("id", review["vehicle_id"]).execute()
-    
     return Review(**response.data[0])
 
 
@@ -215,27 +214,9 @@ async def delete_review(
             detail="Not authorized"
         )
     
+    # The reviews_vehicle_ratings trigger takes the rating out of the vehicle's aggregates
     supabase.table("reviews").delete().eq("id", review_id).execute()
     
-    # Update vehicle rating
-    vehicle_reviews = supabase.table("reviews").select("rating").eq(
-        "vehicle_id", review["vehicle_id"]
-    ).execute()
-    
-    if vehicle_reviews.data:
-        avg_rating = sum(r["rating"] for r in vehicle_reviews.data) / len(vehicle_reviews.data)
-        supabase.table("vehicles").update({
-            "rating": round(avg_rating, 2),
-            "total_reviews": len(vehicle_reviews.data),
-            "updated_at": datetime.utcnow().isoformat(),
-        }).eq("id", review["vehicle_id"]).execute()
-    else:
-        supabase.table("vehicles").update({
-            "rating": 0.0,
-            "total_reviews": 0,
-            "updated_at": datetime.utcnow().isoformat(),
-        }).eq("id", review["vehicle_id"]).execute()
-    
     return None
 
 
@@ -0,0 +1,177 @@
+from fastapi import APIRouter, HTTPException, status, Depends
+from typing import Tuple
+from app.models.upload import SignedUpload, SignedUploadRequest, UploadComplete, UploadTarget, UploadTargetParams
+from app.models.user import User, UserRole, UserResponse
+from app.models.vehicle import Vehicle
+from app.auth_supabase import get_current_user
+from app.database import get_supabase, get_supabase_admin
+from app.storage import storage
+from app.signed_urls import signed_urls
+from app.signature_images import SIGNATURE_BUCKET, signature_folder
+from app.api.v1.kyc import document_field, record_kyc_document, signed_kyc
+from config import settings
+from datetime import datetime
+
+router = APIRouter()
+
+IMAGE_TARGETS = {
+    UploadTarget.AVATAR, UploadTarget.VEHICLE_IMAGE, UploadTarget.KYC_SIGNATURE, UploadTarget.CONTRACT_SIGNATURE
+}
+
+
+def _resolve_target(supabase, params: UploadTargetParams, current_user: User) -> Tuple[str, str, dict]:
+    """
+    Bucket, folder and owning row for an upload target
+    
+    Folders match the multipart upload endpoints, so files land in the same
+    place whichever way they were uploaded.
+    """
+    if params.target == UploadTarget.AVATAR:
+        return "avatars", current_user.id, {}
+    
+    if params.target == UploadTarget.VEHICLE_IMAGE:
+        if current_user.role not in [UserRole.ORG_ADMIN, UserRole.AGENCY_ADMIN]:
+            raise HTTPException(
+                status_code=status.HTTP_403_FORBIDDEN,
+                detail="Insufficient permissions"
+            )
+        vehicle_response = None
+        if params.vehicle_id:
+            vehicle_response = supabase.table("vehicles").select("*").eq("id", params.vehicle_id).execute()
+        if not vehicle_response or not vehicle_response.data:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Vehicle not found"
+            )
+        return "vehicle-images", params.vehicle_id, vehicle_response.data[0]
+    
+    if params.target == UploadTarget.CONTRACT_SIGNATURE:
+        return SIGNATURE_BUCKET, signature_folder(current_user.id), {}
+    
+    kyc_response = supabase.table("kyc").select("*").eq("user_id", current_user.id).execute()
+    if not kyc_response.data:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="KYC application not found. Please create KYC first."
+        )
+    kyc = kyc_response.data[0]
+    
+    if params.target == UploadTarget.KYC_SIGNATURE:
+        return SIGNATURE_BUCKET, signature_folder(current_user.id), kyc
+    
+    if not params.document_type:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="document_type is required for KYC documents"
+        )
+    document_field(params.document_type, params.side)
+    return "kyc-documents", f"{current_user.id}/{params.document_type.value}", kyc
+
+
+@router.post("/sign", response_model=SignedUpload)
+async def sign_upload(
+    upload_request: SignedUploadRequest,
+    current_user: User = Depends(get_current_user)
+):
+    """Issue a signed URL for uploading a file directly to storage"""
+    supabase = get_supabase()
+    
+    if upload_request.target in IMAGE_TARGETS and not upload_request.content_type.startswith('image/'):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Only image files are allowed"
+        )
+    
+    bucket, folder, _ = _resolve_target(supabase, upload_request, current_user)
+    path = storage.build_path(folder, upload_request.file_name)
+    signed = storage.create_signed_upload(bucket, path)
+    
+    # Tracked until /complete, so the sweep can delete uploads that never get there
+    get_supabase_admin().table("pending_uploads").insert({
+        "bucket": bucket,
+        "path": path,
+        "user_id": current_user.id
+    }).execute()
+    
+    return SignedUpload(bucket=bucket, path=path, **signed)
+
+
+@router.post("/complete")
+async def complete_upload(
+    upload: UploadComplete,
+    current_user: User = Depends(get_current_user)
+):
+    """Verify a direct upload and record its URL"""
+    supabase = get_supabase()
+    
+    bucket, folder, row = _resolve_target(supabase, upload, current_user)
+    
+    # Only files in the caller's own folder can be claimed
+    folder_prefix, _, name = upload.path.rpartition('/')
+    if folder_prefix != folder or not name:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Upload path does not belong to this target"
+        )
+    
+    info = storage.get_object_info(bucket, upload.path)
+    if info:
+        get_supabase_admin().table("pending_uploads").delete().eq("bucket", bucket).eq("path", upload.path).execute()
+    if not info:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Uploaded file not found"
+        )
+    
+    rejection = None
+    if info["size"] > settings.UPLOAD_MAX_BYTES:
+        rejection = HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"File exceeds the {settings.UPLOAD_MAX_BYTES // (1024 * 1024)} MB limit"
+        )
+    elif upload.target in IMAGE_TARGETS and not info["content_type"].startswith('image/'):
+        rejection = HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Only image files are allowed"
+        )
+    if rejection:
+        await storage.delete_file(bucket, upload.path)
+        raise rejection
+    
+    if upload.target in (UploadTarget.AVATAR, UploadTarget.VEHICLE_IMAGE):
+        file_url = supabase.storage.from_(bucket).get_public_url(upload.path)
+    
+    if upload.target == UploadTarget.AVATAR:
+        response = supabase.table("users").update({
+            "profile_picture": file_url,
+            "updated_at": datetime.utcnow().isoformat()
+        }).eq("id", current_user.id).execute()
+        return {"file_url": file_url, "user": UserResponse(**response.data[0])}
+    
+    if upload.target == UploadTarget.VEHICLE_IMAGE:
+        images = row.get("images", []) or []
+        if file_url not in images:
+            images.append(file_url)
+        response = supabase.table("vehicles").update({
+            "images": images,
+            "updated_at": datetime.utcnow().isoformat()
+        }).eq("id", row["id"]).execute()
+        return {"file_url": file_url, "vehicle": Vehicle(**response.data[0])}
+    
+    # Not recorded anywhere yet: the path is passed to POST /contracts/{id}/sign
+    if upload.target == UploadTarget.CONTRACT_SIGNATURE:
+        return {"path": upload.path, "file_url": signed_urls.sign(bucket, [upload.path]).get(upload.path)}
+    
+    # KYC files are private: store the path and answer with a signed URL
+    if upload.target == UploadTarget.KYC_SIGNATURE:
+        field = "signature_image"
+        response = supabase.table("kyc").update({
+            field: upload.path,
+            "updated_at": datetime.utcnow().isoformat()
+        }).eq("id", row["id"]).execute()
+    else:
+        field = document_field(upload.document_type, upload.side)
+        response = record_kyc_document(supabase, row, field, upload.path)
+    kyc = signed_kyc(response.data[0])
+    
+    return {"file_url": getattr(kyc, field), "kyc": kyc}
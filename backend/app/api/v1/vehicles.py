@@ -2,17 +2,24 @@ from fastapi import APIRouter, HTTPException, status, Depends, Query, UploadFile
 from typing import List, Optional
 from app.models.vehicle import (
     Vehicle, VehicleCreate, VehicleUpdate, VehicleSearchParams,
-    VehicleStatus, VehicleCategory
+    VehicleStatus, VehicleCategory, VehicleUtilization, VehicleUtilizationDay
 )
 from app.auth_supabase import get_current_user, require_role
 from app.models.user import User, UserRole
 from app.database import get_supabase
 from app.storage import upload_file, storage
-from datetime import datetime
+from app.surge import surge_engine
+from app.availability import availability_cache, find_conflicting_bookings
+from app.holds import hold_store
+from app.ratings import build_rating_summary
+from datetime import datetime, date, timedelta
 import uuid
 
 router = APIRouter()
 
+# Longest window GET /{vehicle_id}/utilization returns (one row per day)
+UTILIZATION_MAX_DAYS = 366
+
 
 @router.get("/", response_model=List[Vehicle])
 async def list_vehicles(
@@ -91,6 +98,11 @@ async def search_vehicles(
         ).eq("status", "confirmed").execute()
         
         booked_vehicle_ids = [b["vehicle_id"] for b in bookings_query.data]
+        booked_vehicle_ids += hold_store.held_vehicles(
+            search_params.start_date,
+            search_params.end_date,
+            exclude_user=current_user.id if current_user else None
+        )
         if booked_vehicle_ids:
             query = query.not_.in_("id", booked_vehicle_ids)
     
@@ -106,12 +118,15 @@ async def search_vehicles(
 @router.get("/{vehicle_id}", response_model=Vehicle)
 async def get_vehicle(
     vehicle_id: str,
+    include_rating_summary: bool = False,
     current_user: Optional[User] = Depends(get_current_user)
 ):
     """Get vehicle details by ID"""
     supabase = get_supabase()
     
-    response = supabase.table("vehicles").select("*").eq("id", vehicle_id).execute()
+    # The rating summary is embedded in the same request (one stats row per vehicle)
+    columns = "*, vehicle_rating_stats(*)" if include_rating_summary else "*"
+    response = supabase.table("vehicles").select(columns).eq("id", vehicle_id).execute()
     
     if not response.data:
         raise HTTPException(
@@ -119,7 +134,14 @@ async def get_vehicle(
             detail="Vehicle not found"
         )
     
-    return Vehicle(**response.data[0])
+    vehicle = response.data[0]
+    if include_rating_summary:
+        stats = vehicle.pop("vehicle_rating_stats", None)
+        if isinstance(stats, list):
+            stats = stats[0] if stats else None
+        vehicle["rating_summary"] = build_rating_summary(vehicle_id, stats)
+    
+    return Vehicle(**vehicle)
 
 
 @router.post("/", response_model=Vehicle, status_code=status.HTTP_201_CREATED)
@@ -151,6 +173,8 @@ async def create_vehicle(
             detail="Failed to create vehicle"
         )
     
+    surge_engine.track_vehicle(response.data[0])
+    
     return Vehicle(**response.data[0])
 
 
@@ -182,6 +206,8 @@ async def update_vehicle(
             detail="Failed to update vehicle"
         )
     
+    surge_engine.track_vehicle(response.data[0])
+    
     return Vehicle(**response.data[0])
 
 
@@ -203,6 +229,8 @@ async def delete_vehicle(
     
     supabase.table("vehicles").delete().eq("id", vehicle_id).execute()
     
+    surge_engine.untrack_vehicle(vehicle_id)
+    
     return None
 
 
@@ -214,26 +242,106 @@ async def check_availability(
     current_user: Optional[User] = Depends(get_current_user)
 ):
     """Check if vehicle is available for given dates"""
-    supabase = get_supabase()
-    
-    # Check for conflicting bookings
-    bookings = supabase.table("bookings").select("*").eq("vehicle_id", vehicle_id).or_(
-        f"and(pickup_date.lte.{start_date.isoformat()},return_date.gte.{start_date.isoformat()}),"
-        f"and(pickup_date.lte.{end_date.isoformat()},return_date.gte.{end_date.isoformat()}),"
-        f"and(pickup_date.gte.{start_date.isoformat()},return_date.lte.{end_date.isoformat()})"
-    ).in_("status", ["confirmed", "in_progress"]).execute()
+    held = hold_store.conflicts(
+        vehicle_id,
+        start_date,
+        end_date,
+        exclude_user=current_user.id if current_user else None
+    )
+    conflicts = availability_cache.get(vehicle_id, start_date, end_date)
     
-    is_available = len(bookings.data) == 0
+    if conflicts is None:
+        supabase = get_supabase()
+        
+        # Check for conflicting bookings
+        conflicts = len(find_conflicting_bookings(supabase, vehicle_id, start_date, end_date))
+        availability_cache.set(vehicle_id, start_date, end_date, conflicts)
     
     return {
         "vehicle_id": vehicle_id,
         "start_date": start_date,
         "end_date": end_date,
-        "available": is_available,
-        "conflicting_bookings": len(bookings.data)
+        "available": conflicts == 0 and held == 0,
+        "conflicting_bookings": conflicts,
+        "conflicting_holds": held
     }
 
 
+@router.get("/{vehicle_id}/utilization", response_model=VehicleUtilization)
+async def get_vehicle_utilization(
+    vehicle_id: str,
+    from_date: Optional[date] = Query(None, alias="from"),
+    to_date: Optional[date] = Query(None, alias="to"),
+    current_user: User = Depends(require_role([UserRole.ORG_ADMIN, UserRole.AGENCY_ADMIN]))
+):
+    """Daily booked hours, revenue and idle days for a vehicle (Admin only)"""
+    supabase = get_supabase()
+    
+    # Check if vehicle exists
+    vehicle_response = supabase.table("vehicles").select("id, organization_id, created_at").eq("id", vehicle_id).execute()
+    if not vehicle_response.data:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Vehicle not found"
+        )
+    
+    # Revenue figures are only visible to the vehicle's own organization
+    if vehicle_response.data[0]["organization_id"] != current_user.organization_id:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Not authorized to view this vehicle's utilization"
+        )
+    
+    to_date = to_date or date.today()
+    from_date = from_date or to_date - timedelta(days=29)
+    if (to_date - from_date).days >= UTILIZATION_MAX_DAYS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"The range can span at most {UTILIZATION_MAX_DAYS} days"
+        )
+    
+    # Days before the vehicle was listed are not idle days
+    listed_on = datetime.fromisoformat(vehicle_response.data[0]["created_at"].replace("Z", "+00:00")).date()
+    from_date = max(from_date, listed_on)
+    if from_date > to_date:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="'from' must be on or before 'to'"
+        )
+    
+    # Precomputed by the update_vehicle_utilization task
+    response = supabase.table("vehicle_utilization").select("day, booked_hours, revenue").eq(
+        "vehicle_id", vehicle_id
+    ).gte("day", from_date.isoformat()).lte("day", to_date.isoformat()).execute()
+    rows = {row["day"]: row for row in response.data}
+    
+    days = []
+    current = from_date
+    while current <= to_date:
+        row = rows.get(current.isoformat(), {})
+        booked_hours = float(row.get("booked_hours") or 0)
+        days.append(VehicleUtilizationDay(
+            day=current,
+            booked_hours=booked_hours,
+            revenue=float(row.get("revenue") or 0),
+            idle=booked_hours <= 0
+        ))
+        current += timedelta(days=1)
+    
+    booked_hours = sum(d.booked_hours for d in days)
+    
+    return VehicleUtilization(
+        vehicle_id=vehicle_id,
+        from_date=from_date,
+        to_date=to_date,
+        booked_hours=round(booked_hours, 2),
+        revenue=round(sum(d.revenue for d in days), 2),
+        idle_days=sum(1 for d in days if d.idle),
+        utilization=round(min(booked_hours / (len(days) * 24), 1.0), 4),
+        days=days
+    )
+
+
 @router.post("/{vehicle_id}/images")
 async def upload_vehicle_image(
     vehicle_id: str,
@@ -0,0 +1,59 @@
+"""
+Vehicle Availability
+Shared conflicting-booking lookup and a short-lived cache for the public
+availability endpoint, invalidated per vehicle by booking events
+"""
+from app.cache import TTLCache
+from config import settings
+from datetime import datetime
+from typing import Dict, Optional
+import threading
+
+# Booking statuses that block a vehicle
+BLOCKING_STATUSES = ["confirmed", "in_progress"]
+
+
+def find_conflicting_bookings(supabase, vehicle_id: str, start_date: datetime, end_date: datetime) -> list:
+    """Return confirmed/in-progress bookings overlapping the given window"""
+    bookings = supabase.table("bookings").select("id").eq("vehicle_id", vehicle_id).or_(
+        f"and(pickup_date.lte.{start_date.isoformat()},return_date.gte.{start_date.isoformat()}),"
+        f"and(pickup_date.lte.{end_date.isoformat()},return_date.gte.{end_date.isoformat()}),"
+        f"and(pickup_date.gte.{start_date.isoformat()},return_date.lte.{end_date.isoformat()})"
+    ).in_("status", BLOCKING_STATUSES).execute()
+    return bookings.data
+
+
+class AvailabilityCache:
+    """
+    Caches availability answers per (vehicle, window)
+
+    Each vehicle has a generation counter that is part of the cache key, so
+    invalidating a vehicle is O(1): bump the counter and old entries are
+    never read again (they age out of the LRU).
+    """
+
+    def __init__(self):
+        self._cache = TTLCache(
+            maxsize=settings.AVAILABILITY_CACHE_SIZE,
+            ttl=settings.AVAILABILITY_CACHE_TTL_SECONDS
+        )
+        self._generations: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def _key(self, vehicle_id: str, start_date: datetime, end_date: datetime) -> tuple:
+        return (vehicle_id, self._generations.get(vehicle_id, 0), start_date.isoformat(), end_date.isoformat())
+
+    def get(self, vehicle_id: str, start_date: datetime, end_date: datetime) -> Optional[int]:
+        """Cached number of conflicting bookings, or None"""
+        return self._cache.get(self._key(vehicle_id, start_date, end_date))
+
+    def set(self, vehicle_id: str, start_date: datetime, end_date: datetime, conflicts: int):
+        self._cache.set(self._key(vehicle_id, start_date, end_date), conflicts)
+
+    def invalidate(self, vehicle_id: str):
+        with self._lock:
+            self._generations[vehicle_id] = self._generations.get(vehicle_id, 0) + 1
+
+
+# Create singleton instance
+availability_cache = AvailabilityCache()
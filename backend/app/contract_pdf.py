@@ -0,0 +1,377 @@
+"""
+Contract PDF Rendering
+Rental contracts are laid out with reportlab in a pool of worker processes,
+so rendering never blocks the event loop. Each worker registers the fonts
+and builds the paragraph styles once at start-up. The API only gathers the
+contract data, uploads the PDF to the private `contracts` bucket and stores
+its path in `pdf_url`. Once both parties have signed, the contract is
+rendered again with their signature images and stored as the signed PDF,
+together with its SHA-256 for integrity checks.
+"""
+from app.database import get_supabase_admin
+from app.signed_urls import signed_urls
+from app.signature_images import signature_images
+from app.storage import storage
+from config import settings
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+from io import BytesIO
+from typing import Dict, List, Optional, Set, Tuple
+from xml.sax.saxutils import escape
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.styles import ParagraphStyle, getSampleStyleSheet
+from reportlab.lib.units import mm
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont, TTFError
+from reportlab.platypus import Image, Paragraph, SimpleDocTemplate, Spacer, Table, TableStyle
+import asyncio
+import hashlib
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+CONTRACTS_BUCKET = "contracts"
+FONT_DIR = os.path.join(os.path.dirname(__file__), "assets", "fonts")
+
+# Everything the template needs, in one request
+CONTRACT_PDF_COLUMNS = (
+    "*, bookings(*), vehicles(make, model, year, color, license_plate), "
+    "users(full_name, email, phone), organizations(name, email, phone, address)"
+)
+
+DEFAULT_TERMS = (
+    "The customer shall return the vehicle on the agreed date, in the same condition "
+    "and with the same fuel level as at pickup. Traffic fines, Salik tolls and damage "
+    "not covered by insurance during the rental period are charged to the customer. "
+    "The vehicle may only be driven by the customer or drivers approved by the agency."
+)
+
+# Per-process state, set up once by _init_worker
+_styles: Optional[Dict[str, ParagraphStyle]] = None
+
+
+def _init_worker(font_dir: str):
+    """Register fonts and build paragraph styles (once per worker process)"""
+    global _styles
+    regular, bold = "Helvetica", "Helvetica-Bold"
+    try:
+        pdfmetrics.registerFont(TTFont("Lato", os.path.join(font_dir, "Lato-Regular.ttf")))
+        pdfmetrics.registerFont(TTFont("Lato-Bold", os.path.join(font_dir, "Lato-Bold.ttf")))
+        pdfmetrics.registerFontFamily("Lato", normal="Lato", bold="Lato-Bold", italic="Lato", boldItalic="Lato-Bold")
+        regular, bold = "Lato", "Lato-Bold"
+    except (TTFError, OSError):
+        logger.warning("Lato fonts not found in %s, using Helvetica", font_dir)
+
+    base = getSampleStyleSheet()
+    _styles = {
+        "title": ParagraphStyle("ContractTitle", parent=base["Title"], fontName=bold, fontSize=18, leading=22),
+        "heading": ParagraphStyle(
+            "ContractHeading", parent=base["Heading3"], fontName=bold,
+            fontSize=11, spaceBefore=10, spaceAfter=4
+        ),
+        "body": ParagraphStyle("ContractBody", parent=base["BodyText"], fontName=regular, fontSize=9, leading=12),
+        "label": ParagraphStyle("ContractLabel", parent=base["BodyText"], fontName=bold, fontSize=9, leading=12),
+    }
+
+
+def _text(value) -> str:
+    return escape(str(value)) if value not in (None, "") else "-"
+
+
+def _date(value: Optional[str]) -> str:
+    if not value:
+        return "-"
+    try:
+        return datetime.fromisoformat(value.replace("Z", "+00:00")).strftime("%d %b %Y %H:%M")
+    except ValueError:
+        return _text(value)
+
+
+def _money(value) -> str:
+    return f"AED {float(value or 0):,.2f}"
+
+
+def _details(rows: List[Tuple[str, str]]) -> Table:
+    """Two-column label/value table"""
+    table = Table(
+        [[Paragraph(label, _styles["label"]), Paragraph(value, _styles["body"])] for label, value in rows],
+        colWidths=[45 * mm, None]
+    )
+    table.setStyle(TableStyle([
+        ("VALIGN", (0, 0), (-1, -1), "TOP"),
+        ("LINEBELOW", (0, 0), (-1, -1), 0.25, colors.lightgrey),
+        ("BOTTOMPADDING", (0, 0), (-1, -1), 3),
+    ]))
+    return table
+
+
+def _signature_image(path: Optional[str]):
+    if not path:
+        return ""
+    image = Image(path, width=75 * mm, height=22 * mm, kind="proportional")
+    image.hAlign = "LEFT"
+    return image
+
+
+def _signature_block(contract: dict, signatures: Dict[str, str]) -> Table:
+    cells = [
+        [Paragraph("Customer signature", _styles["label"]), Paragraph("Agency signature", _styles["label"])],
+        [_signature_image(signatures.get("customer")), _signature_image(signatures.get("agency"))],
+        [
+            Paragraph(f"Signed: {_date(contract.get('customer_signed_at'))}", _styles["body"]),
+            Paragraph(f"Signed: {_date(contract.get('agency_signed_at'))}", _styles["body"]),
+        ],
+    ]
+    table = Table(cells, colWidths=[85 * mm, 85 * mm], rowHeights=[None, 25 * mm, None])
+    table.setStyle(TableStyle([
+        ("LINEBELOW", (0, 1), (-1, 1), 0.5, colors.black),
+        ("VALIGN", (0, 1), (-1, 1), "BOTTOM"),
+    ]))
+    return table
+
+
+def render_contract(contract: dict, signatures: Optional[Dict[str, str]] = None) -> bytes:
+    """
+    Render a rental contract (runs in a worker process)
+
+    Args:
+        contract: Contract row with embedded bookings, vehicles, users and organizations
+        signatures: Local image paths of the "customer" and "agency" signatures
+
+    Returns:
+        bytes: PDF document
+    """
+    if _styles is None:
+        _init_worker(FONT_DIR)
+
+    booking = contract.get("bookings") or {}
+    vehicle = contract.get("vehicles") or {}
+    customer = contract.get("users") or {}
+    agency = contract.get("organizations") or {}
+
+    buffer = BytesIO()
+    document = SimpleDocTemplate(
+        buffer,
+        pagesize=A4,
+        title=f"Rental Agreement {contract['contract_number']}",
+        leftMargin=20 * mm, rightMargin=20 * mm, topMargin=18 * mm, bottomMargin=18 * mm,
+        invariant=True  # Same input, same bytes: no timestamp or random document ID
+    )
+
+    story = [
+        Paragraph("Vehicle Rental Agreement", _styles["title"]),
+        Paragraph(
+            f"Contract {_text(contract['contract_number'])} · issued {_date(contract.get('created_at'))}",
+            _styles["body"]
+        ),
+        Spacer(1, 6 * mm),
+        Paragraph("Parties", _styles["heading"]),
+        _details([
+            ("Agency", _text(agency.get("name"))),
+            ("Agency contact", f"{_text(agency.get('email'))}, {_text(agency.get('phone'))}"),
+            ("Agency address", _text(agency.get("address"))),
+            ("Customer", _text(customer.get("full_name"))),
+            ("Customer contact", f"{_text(customer.get('email'))}, {_text(customer.get('phone'))}"),
+        ]),
+        Paragraph("Vehicle", _styles["heading"]),
+        _details([
+            ("Vehicle", f"{_text(vehicle.get('make'))} {_text(vehicle.get('model'))} ({_text(vehicle.get('year'))})"),
+            ("Colour", _text(vehicle.get("color"))),
+            ("License plate", _text(vehicle.get("license_plate"))),
+        ]),
+        Paragraph("Rental", _styles["heading"]),
+        _details([
+            ("Pickup", f"{_date(contract.get('start_date'))}, {_text(booking.get('pickup_location'))}"),
+            ("Return", f"{_date(contract.get('end_date'))}, {_text(booking.get('return_location') or booking.get('pickup_location'))}"),
+            ("Rental type", _text(booking.get("rental_type"))),
+            ("With driver", "Yes" if booking.get("with_driver") else "No"),
+        ]),
+        Paragraph("Charges", _styles["heading"]),
+        _details([
+            ("Base price", _money(booking.get("base_price"))),
+            ("Surge multiplier", f"{float(booking.get('surge_multiplier') or 1):.2f}x"),
+            ("Driver fee", _money(booking.get("driver_fee"))),
+            ("Platform fee", _money(booking.get("platform_fee"))),
+            ("Total", f"<b>{_money(booking.get('total_price'))}</b>"),
+        ]),
+        Paragraph("Terms and conditions", _styles["heading"]),
+        Paragraph(_text(contract.get("terms_and_conditions") or DEFAULT_TERMS), _styles["body"]),
+    ]
+    if contract.get("special_conditions"):
+        story += [
+            Paragraph("Special conditions", _styles["heading"]),
+            Paragraph(_text(contract["special_conditions"]), _styles["body"]),
+        ]
+    story += [Spacer(1, 10 * mm), _signature_block(contract, signatures or {})]
+
+    document.build(story)
+    return buffer.getvalue()
+
+
+def load_contract(supabase, contract_id: str) -> Optional[dict]:
+    """Contract row with everything render_contract needs"""
+    response = supabase.table("contracts").select(CONTRACT_PDF_COLUMNS).eq("id", contract_id).execute()
+    return response.data[0] if response.data else None
+
+
+def store_contract_pdf(supabase, contract: dict, pdf: bytes) -> str:
+    """Upload a rendered contract (replacing an earlier render) and record its path"""
+    path = f"{contract['organization_id']}/{contract['contract_number']}.pdf"
+    storage.upload_bytes(CONTRACTS_BUCKET, path, pdf, "application/pdf", upsert=True)
+    signed_urls.forget(CONTRACTS_BUCKET, path)
+    supabase.table("contracts").update({
+        "pdf_url": path,
+        "pdf_attempts": 0,
+        "pdf_retry_at": None,
+        "updated_at": datetime.utcnow().isoformat(),
+    }).eq("id", contract["id"]).execute()
+    return path
+
+
+def store_signed_contract_pdf(supabase, contract: dict, pdf: bytes) -> str:
+    """Upload the signed contract and record its path and SHA-256"""
+    path = f"{contract['organization_id']}/{contract['contract_number']}-signed.pdf"
+    storage.upload_bytes(CONTRACTS_BUCKET, path, pdf, "application/pdf", upsert=True)
+    signed_urls.forget(CONTRACTS_BUCKET, path)
+    now = datetime.utcnow().isoformat()
+    supabase.table("contracts").update({
+        "signed_pdf_url": path,
+        "signed_pdf_sha256": hashlib.sha256(pdf).hexdigest(),
+        "signed_pdf_at": now,
+        "pdf_attempts": 0,
+        "pdf_retry_at": None,
+        "updated_at": now,
+    }).eq("id", contract["id"]).execute()
+    return path
+
+
+def render_and_store_inline(supabase, contract_id: str, signed: bool = False) -> Optional[str]:
+    """
+    Render and store a contract in the calling process (Celery workers)
+
+    Returns:
+        str: Storage path of the PDF, or None if the contract is gone (or, for
+        the signed PDF, not fully signed)
+    """
+    contract = load_contract(supabase, contract_id)
+    if not contract:
+        return None
+    if not signed:
+        return store_contract_pdf(supabase, contract, render_contract(contract))
+    if not (contract.get("customer_signature_url") and contract.get("agency_signature_url")):
+        return None
+    signatures = {
+        "customer": signature_images.fetch_sync(contract["customer_signature_url"]),
+        "agency": signature_images.fetch_sync(contract["agency_signature_url"]),
+    }
+    return store_signed_contract_pdf(supabase, contract, render_contract(contract, signatures))
+
+
+def record_render_failure(supabase, contract_id: str, attempts: int):
+    """Count a failed background render and back off before the next one"""
+    delay = timedelta(minutes=settings.CONTRACT_PDF_RETRY_MINUTES * 2 ** (attempts - 1))
+    supabase.table("contracts").update({
+        "pdf_attempts": attempts,
+        "pdf_retry_at": (datetime.utcnow() + delay).isoformat(),
+    }).eq("id", contract_id).execute()
+
+
+class ContractPdfService:
+    """Renders contracts in a process pool and stores them off the request path"""
+
+    def __init__(self):
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._tasks: Set[asyncio.Task] = set()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def start(self):
+        """Remember the API's event loop, so worker threads can schedule renders"""
+        self._loop = asyncio.get_running_loop()
+
+    @property
+    def pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(
+                max_workers=settings.CONTRACT_PDF_WORKERS,
+                initializer=_init_worker,
+                initargs=(settings.CONTRACT_FONT_DIR or FONT_DIR,)
+            )
+        return self._pool
+
+    async def render(self, contract: dict, signatures: Optional[Dict[str, str]] = None) -> bytes:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.pool, render_contract, contract, signatures)
+
+    async def render_and_store(self, contract_id: str) -> Optional[str]:
+        """
+        Render a contract and record where its PDF is stored
+
+        Returns:
+            str: Storage path in the contracts bucket, or None if the contract is gone
+        """
+        supabase = get_supabase_admin()
+        contract = await asyncio.to_thread(load_contract, supabase, contract_id)
+        if not contract:
+            return None
+        pdf = await self.render(contract)
+        return await asyncio.to_thread(store_contract_pdf, supabase, contract, pdf)
+
+    async def render_signed_and_store(self, contract_id: str) -> Optional[str]:
+        """
+        Render a contract with both signature images and store it as the signed PDF
+
+        Signature images come from the local cache, so only the first render
+        after signing downloads them.
+
+        Returns:
+            str: Storage path of the signed PDF, or None if the contract is gone or not fully signed
+        """
+        supabase = get_supabase_admin()
+        contract = await asyncio.to_thread(load_contract, supabase, contract_id)
+        if not contract or not (contract.get("customer_signature_url") and contract.get("agency_signature_url")):
+            return None
+        signatures = {
+            "customer": await signature_images.fetch(contract["customer_signature_url"]),
+            "agency": await signature_images.fetch(contract["agency_signature_url"]),
+        }
+        pdf = await self.render(contract, signatures)
+        return await asyncio.to_thread(store_signed_contract_pdf, supabase, contract, pdf)
+
+    def schedule(self, contract_id: str, signed: bool = False):
+        """
+        Render in the background; pdf_url (or signed_pdf_url) is filled in when the PDF is stored
+
+        Can also be called from worker threads (e.g. sync event handlers) once started.
+        """
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            # Worker thread: hand the render over to the API's loop
+            self._loop.call_soon_threadsafe(self.schedule, contract_id, signed)
+            return
+        task = asyncio.create_task(self._render_logged(contract_id, signed))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _render_logged(self, contract_id: str, signed: bool):
+        try:
+            if signed:
+                await self.render_signed_and_store(contract_id)
+            else:
+                await self.render_and_store(contract_id)
+        except Exception:
+            logger.exception("Rendering contract %s failed", contract_id)
+
+    async def close(self):
+        """Cancel pending renders and stop the worker processes"""
+        for task in list(self._tasks):
+            task.cancel()
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+
+# Create singleton instance
+contract_pdf_service = ContractPdfService()
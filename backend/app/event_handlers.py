@@ -0,0 +1,107 @@
+"""
+Outbox Subscribers
+Derived state that used to be updated inline (or not at all) by request
+handlers. Every handler receives a batch of events and must be idempotent,
+since the outbox delivers at least once. Broadcast handlers update this
+process's in-memory state and run in every API process.
+"""
+from app.events import subscribe
+from app.database import get_supabase_admin
+from app.availability import availability_cache
+from app.holds import hold_store
+from app.surge import surge_engine
+from app.leaderboard import loyalty_leaderboard
+from app.api.v1.contracts import create_contract_for_booking
+from app.api.v1.loyalty import credit_booking_points
+from app.models.booking import BookingStatus
+from app.models.loyalty import LoyaltyTransactionType
+from app.models.payment import PaymentStatus
+from config import settings
+from datetime import datetime
+from typing import List
+
+BOOKING_EVENTS = [f"booking.{s.value}" for s in BookingStatus] + ["booking.rescheduled"]
+
+
+def _bookings(events: List[dict]) -> List[dict]:
+    return [event["payload"]["booking"] for event in events]
+
+
+@subscribe(*BOOKING_EVENTS, broadcast=True)
+def invalidate_availability(events: List[dict]):
+    """Drop cached availability answers for vehicles whose bookings changed"""
+    for vehicle_id in {booking["vehicle_id"] for booking in _bookings(events)}:
+        availability_cache.invalidate(vehicle_id)
+
+
+@subscribe(*[f"booking.{s.value}" for s in BookingStatus if s != BookingStatus.PENDING])
+def refresh_total_bookings(events: List[dict]):
+    """Recount vehicles.total_bookings for every vehicle in the batch"""
+    vehicle_ids = list({booking["vehicle_id"] for booking in _bookings(events)})
+    get_supabase_admin().rpc("refresh_vehicle_total_bookings", {
+        "p_vehicle_ids": vehicle_ids
+    }).execute()
+
+
+@subscribe(*[f"booking.{s.value}" for s in BookingStatus if s != BookingStatus.PENDING], broadcast=True)
+def release_holds(events: List[dict]):
+    """Drop checkout holds once their booking is confirmed or abandoned"""
+    hold_store.release_bookings([booking["id"] for booking in _bookings(events)])
+
+
+@subscribe(*BOOKING_EVENTS, broadcast=True)
+def track_surge_occupancy(events: List[dict]):
+    """Apply booking changes to the surge histogram"""
+    for event in events:
+        surge_engine.on_booking_change(event["payload"].get("previous"), event["payload"]["booking"])
+
+
+@subscribe("loyalty.lifetime_points", broadcast=True)
+def update_leaderboard(events: List[dict]):
+    """Move members whose lifetime points changed in the leaderboard index"""
+    loyalty_leaderboard.apply([event["payload"] for event in events])
+
+
+@subscribe(f"payment.{PaymentStatus.COMPLETED.value}")
+def confirm_paid_bookings(events: List[dict]):
+    """Confirm the pending bookings whose payment succeeded"""
+    booking_ids = list({event["payload"]["payment"]["booking_id"] for event in events})
+    # The resulting booking.confirmed events update holds, surge and availability
+    get_supabase_admin().table("bookings").update({
+        "status": BookingStatus.CONFIRMED.value,
+        "updated_at": datetime.utcnow().isoformat()
+    }).in_("id", booking_ids).eq("status", BookingStatus.PENDING.value).execute()
+
+
+@subscribe(f"booking.{BookingStatus.CONFIRMED.value}")
+def create_contracts(events: List[dict]):
+    """Create a draft contract for newly confirmed bookings"""
+    supabase = get_supabase_admin()
+    bookings = {booking["id"]: booking for booking in _bookings(events)}
+
+    existing = supabase.table("contracts").select("booking_id").in_(
+        "booking_id", list(bookings)
+    ).execute()
+    for row in existing.data:
+        bookings.pop(row["booking_id"], None)
+
+    for booking in bookings.values():
+        create_contract_for_booking(supabase, booking)
+
+
+@subscribe(f"booking.{BookingStatus.COMPLETED.value}")
+def earn_loyalty_points(events: List[dict]):
+    """Credit loyalty points for completed bookings"""
+    supabase = get_supabase_admin()
+    bookings = {booking["id"]: booking for booking in _bookings(events)}
+
+    existing = supabase.table("loyalty_transactions").select("booking_id").in_(
+        "booking_id", list(bookings)
+    ).eq("transaction_type", LoyaltyTransactionType.EARNED.value).execute()
+    for row in existing.data:
+        bookings.pop(row["booking_id"], None)
+
+    for booking in bookings.values():
+        points = int(float(booking["total_price"]) * settings.LOYALTY_POINTS_PER_AED)
+        if points > 0:
+            credit_booking_points(supabase, booking["customer_id"], booking["id"], points)
@@ -0,0 +1,261 @@
+"""
+Booking/Payment Lifecycle Events
+Database triggers write status changes to the `outbox` table in the same
+transaction as the booking or payment update (see database/outbox.sql).
+The dispatcher below claims those rows in batches and hands them to
+in-process subscribers and, optionally, to Celery tasks.
+
+Claims lease each event to exactly one process, which suits side effects
+that must happen once (contracts, loyalty). State every process keeps in
+memory (availability cache, holds, surge histogram) is instead updated by
+broadcast subscribers, which every process feeds by tailing the outbox.
+"""
+from app.database import get_supabase_admin
+from config import settings
+from collections import defaultdict
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+import asyncio
+import inspect
+import logging
+import os
+import socket
+import time
+
+logger = logging.getLogger(__name__)
+
+# event_type -> handlers; "*" receives every event
+_subscribers: Dict[str, List[Callable]] = defaultdict(list)
+_broadcast_subscribers: Dict[str, List[Callable]] = defaultdict(list)
+
+# Ids further than this past the cursor are not tracked as gaps (sequence jumps)
+MAX_TRACKED_GAP = 1000
+
+
+def subscribe(*event_types: str, broadcast: bool = False):
+    """
+    Register a handler for one or more event types
+
+    Handlers receive the list of events of that type from one batch, so they
+    can aggregate work. Delivery is at-least-once: handlers must be idempotent.
+    Sync handlers run in a worker thread, async handlers on the event loop.
+
+    By default an event goes to one process. With broadcast=True the handler
+    runs in every process (for in-memory state); it is never retried.
+
+    Example:
+        @subscribe("booking.confirmed")
+        def on_confirmed(events: list): ...
+    """
+    subscribers = _broadcast_subscribers if broadcast else _subscribers
+
+    def decorator(handler: Callable) -> Callable:
+        for event_type in event_types:
+            subscribers[event_type].append(handler)
+        return handler
+    return decorator
+
+
+class OutboxDispatcher:
+    """Polls the outbox and dispatches claimed events in batches"""
+
+    def __init__(self):
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self._wake = asyncio.Event()
+        self._task = None
+
+    def notify(self):
+        """Wake the dispatcher early (call after writing a booking/payment)"""
+        self._wake.set()
+        outbox_broadcast.notify()
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                processed = await self.process_batch()
+            except Exception:
+                logger.exception("Outbox dispatch failed")
+                processed = 0
+
+            if processed < settings.OUTBOX_BATCH_SIZE:
+                try:
+                    await asyncio.wait_for(self._wake.wait(), settings.OUTBOX_POLL_INTERVAL_SECONDS)
+                except asyncio.TimeoutError:
+                    pass
+                self._wake.clear()
+
+    async def process_batch(self) -> int:
+        """Claim, dispatch and acknowledge one batch of events"""
+        supabase = get_supabase_admin()
+
+        claimed = await asyncio.to_thread(
+            lambda: supabase.rpc("claim_outbox_events", {
+                "p_worker": self.worker_id,
+                "p_limit": settings.OUTBOX_BATCH_SIZE,
+                "p_lease_seconds": settings.OUTBOX_LEASE_SECONDS,
+                "p_max_attempts": settings.OUTBOX_MAX_ATTEMPTS,
+            }).execute()
+        )
+        events = sorted(claimed.data or [], key=lambda event: event["id"])
+        if not events:
+            return 0
+
+        ids = [event["id"] for event in events]
+        try:
+            await dispatch(events)
+        except Exception as e:
+            logger.exception("Outbox subscriber failed for events %s", ids)
+            await asyncio.to_thread(
+                lambda: supabase.table("outbox").update({
+                    "claimed_at": None,
+                    "claimed_by": None,
+                    "last_error": str(e)[:1000],
+                }).in_("id", ids).execute()
+            )
+            return len(events)
+
+        await asyncio.to_thread(
+            lambda: supabase.table("outbox").update({
+                "processed_at": datetime.utcnow().isoformat(),
+            }).in_("id", ids).execute()
+        )
+        return len(events)
+
+
+class OutboxBroadcast:
+    """
+    Tails the outbox so every process sees every event
+
+    Nothing is claimed or acknowledged: each process keeps its own cursor,
+    starting at the newest event when it starts (in-memory state is loaded
+    fresh at startup). Ids are allocated before commit, so a lower id can
+    become visible after a higher one; ids skipped by the cursor are re-read
+    for OUTBOX_BROADCAST_GAP_SECONDS in case their transaction commits late.
+    """
+
+    def __init__(self):
+        self._cursor: Optional[int] = None
+        self._gaps: Dict[int, float] = {}
+        self._wake = asyncio.Event()
+        self._task = None
+
+    def notify(self):
+        self._wake.set()
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                received = await self.poll()
+            except Exception:
+                logger.exception("Outbox broadcast failed")
+                received = 0
+
+            if received < settings.OUTBOX_BATCH_SIZE:
+                try:
+                    await asyncio.wait_for(self._wake.wait(), settings.OUTBOX_BROADCAST_INTERVAL_SECONDS)
+                except asyncio.TimeoutError:
+                    pass
+                self._wake.clear()
+
+    async def poll(self) -> int:
+        """Read and dispatch the events after the cursor (and any late gaps)"""
+        supabase = get_supabase_admin()
+
+        if self._cursor is None:
+            latest = await asyncio.to_thread(
+                lambda: supabase.table("outbox").select("id").order("id", desc=True).limit(1).execute()
+            )
+            self._cursor = latest.data[0]["id"] if latest.data else 0
+            return 0
+
+        now = time.monotonic()
+        self._gaps = {
+            event_id: seen for event_id, seen in self._gaps.items()
+            if now - seen < settings.OUTBOX_BROADCAST_GAP_SECONDS
+        }
+
+        query = supabase.table("outbox").select("id, event_type, payload")
+        if self._gaps:
+            query = query.or_(f"id.gt.{self._cursor},id.in.({','.join(map(str, self._gaps))})")
+        else:
+            query = query.gt("id", self._cursor)
+        response = await asyncio.to_thread(
+            lambda: query.order("id").limit(settings.OUTBOX_BATCH_SIZE).execute()
+        )
+        events = response.data or []
+
+        for event in events:
+            event_id = event["id"]
+            if event_id > self._cursor:
+                if event_id - self._cursor <= MAX_TRACKED_GAP:
+                    for missing in range(self._cursor + 1, event_id):
+                        self._gaps[missing] = now
+                self._cursor = event_id
+            else:
+                self._gaps.pop(event_id, None)
+
+        if events:
+            await dispatch(events, broadcast=True)
+        return len(events)
+
+
+async def dispatch(events: List[dict], broadcast: bool = False):
+    """Deliver a batch of outbox events to subscribers (and Celery, unless broadcast)"""
+    subscribers = _broadcast_subscribers if broadcast else _subscribers
+    by_type: Dict[str, List[dict]] = defaultdict(list)
+    for event in events:
+        by_type[event["event_type"]].append(event)
+
+    for event_type, batch in by_type.items():
+        for handler in subscribers.get(event_type, []) + subscribers.get("*", []):
+            try:
+                if inspect.iscoroutinefunction(handler):
+                    await handler(batch)
+                else:
+                    await asyncio.to_thread(handler, batch)
+            except Exception:
+                if not broadcast:
+                    raise
+                # Broadcasts are not retried; don't let one handler starve the others
+                logger.exception("Broadcast subscriber %s failed", handler.__name__)
+
+        task_name = settings.OUTBOX_CELERY_TASKS.get(event_type)
+        if task_name and not broadcast:
+            await asyncio.to_thread(_send_to_celery, task_name, batch)
+
+
+def _send_to_celery(task_name: str, events: List[dict]):
+    # Celery is optional (needs Redis); imported lazily so the API runs without it
+    from app.workers.celery_app import celery_app
+    celery_app.send_task(task_name, args=[events])
+
+
+# Create singleton instances
+outbox_dispatcher = OutboxDispatcher()
+outbox_broadcast = OutboxBroadcast()
@@ -0,0 +1,166 @@
+"""
+Booking Holds
+Time-boxed, in-memory reservations of a vehicle interval while a customer is
+in checkout, so the car stays protected between the quote and the payment
+webhook and availability checks can consult holds without a DB query.
+
+The layout mirrors two Redis sorted sets: per-vehicle holds ordered by
+pickup time, and one global index ordered by expiry that is swept in bulk.
+"""
+from config import settings
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Set
+import bisect
+import threading
+import time
+import uuid
+
+
+def _ts(value: datetime) -> float:
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.timestamp()
+
+
+class HoldStore:
+    """
+    Vehicle interval holds with a fixed time-to-live
+
+    A customer holds at most one checkout interval per vehicle; placing a new
+    hold replaces their previous one, but never a hold tied to a booking.
+    Booking holds last as long as the pending booking (PENDING_BOOKING_EXPIRY_MINUTES).
+    A customer's own hold never blocks them.
+    """
+
+    def __init__(self):
+        self._holds: Dict[str, dict] = {}
+        # vehicle_id -> sorted [(start, hold_id)]
+        self._by_vehicle: Dict[str, List[tuple]] = {}
+        # sorted [(expires, hold_id)], may contain stale entries for refreshed holds
+        self._expiries: List[tuple] = []
+        self._lock = threading.Lock()
+
+    def _remove(self, hold_id: str):
+        hold = self._holds.pop(hold_id, None)
+        if hold is None:
+            return
+        entries = self._by_vehicle.get(hold["vehicle_id"], [])
+        index = bisect.bisect_left(entries, (hold["start"], hold_id))
+        if index < len(entries) and entries[index][1] == hold_id:
+            del entries[index]
+        if not entries:
+            self._by_vehicle.pop(hold["vehicle_id"], None)
+
+    def _sweep(self, now: float) -> int:
+        # Everything with expires <= now sits at the front of the index
+        cut = bisect.bisect_right(self._expiries, now, key=lambda entry: entry[0])
+        expired = self._expiries[:cut]
+        del self._expiries[:cut]
+        removed = 0
+        for expires, hold_id in expired:
+            hold = self._holds.get(hold_id)
+            if hold is not None and hold["expires"] == expires:
+                self._remove(hold_id)
+                removed += 1
+        return removed
+
+    def sweep(self) -> int:
+        """Drop every expired hold, returning how many were removed"""
+        with self._lock:
+            return self._sweep(time.time())
+
+    def _overlapping(self, vehicle_id: str, start: float, end: float, exclude_user: Optional[str]) -> List[dict]:
+        entries = self._by_vehicle.get(vehicle_id, [])
+        # Only holds starting before `end` can overlap
+        stop = bisect.bisect_left(entries, (end,))
+        holds = (self._holds[hold_id] for _, hold_id in entries[:stop])
+        return [h for h in holds if h["end"] > start and h["user_id"] != exclude_user]
+
+    def place(
+        self,
+        vehicle_id: str,
+        user_id: str,
+        start_date: datetime,
+        end_date: datetime,
+        booking_id: Optional[str] = None
+    ) -> Optional[dict]:
+        """
+        Hold a vehicle interval for HOLD_TTL_MINUTES (or, with a booking_id,
+        until the pending booking expires)
+
+        Returns:
+            dict: The hold, or None if another customer holds an overlapping interval
+        """
+        start, end = _ts(start_date), _ts(end_date)
+        now = time.time()
+        with self._lock:
+            self._sweep(now)
+            if self._overlapping(vehicle_id, start, end, user_id):
+                return None
+
+            for _, hold_id in list(self._by_vehicle.get(vehicle_id, [])):
+                held = self._holds[hold_id]
+                if held["user_id"] == user_id and held["booking_id"] is None:
+                    self._remove(hold_id)
+
+            ttl_minutes = settings.PENDING_BOOKING_EXPIRY_MINUTES if booking_id else settings.HOLD_TTL_MINUTES
+
+            hold_id = uuid.uuid4().hex
+            hold = {
+                "id": hold_id,
+                "vehicle_id": vehicle_id,
+                "user_id": user_id,
+                "booking_id": booking_id,
+                "start": start,
+                "end": end,
+                "expires": now + ttl_minutes * 60,
+            }
+            self._holds[hold_id] = hold
+            bisect.insort(self._by_vehicle.setdefault(vehicle_id, []), (start, hold_id))
+            bisect.insort(self._expiries, (hold["expires"], hold_id))
+            return {**hold, "expires_at": datetime.utcfromtimestamp(hold["expires"])}
+
+    def conflicts(
+        self,
+        vehicle_id: str,
+        start_date: datetime,
+        end_date: datetime,
+        exclude_user: Optional[str] = None
+    ) -> int:
+        """Number of live holds by other customers overlapping the interval"""
+        with self._lock:
+            self._sweep(time.time())
+            return len(self._overlapping(vehicle_id, _ts(start_date), _ts(end_date), exclude_user))
+
+    def held_vehicles(self, start_date: datetime, end_date: datetime, exclude_user: Optional[str] = None) -> Set[str]:
+        """Vehicles with a live hold by another customer overlapping the interval"""
+        start, end = _ts(start_date), _ts(end_date)
+        with self._lock:
+            self._sweep(time.time())
+            return {
+                vehicle_id for vehicle_id in self._by_vehicle
+                if self._overlapping(vehicle_id, start, end, exclude_user)
+            }
+
+    def checkout_holds(self, user_id: str, exclude_vehicle: Optional[str] = None) -> int:
+        """Number of live holds a customer has without a booking (other than on exclude_vehicle)"""
+        with self._lock:
+            self._sweep(time.time())
+            return sum(
+                1 for hold in self._holds.values()
+                if hold["user_id"] == user_id and hold["booking_id"] is None
+                and hold["vehicle_id"] != exclude_vehicle
+            )
+
+    def release_bookings(self, booking_ids: List[str]) -> int:
+        """Release the holds attached to the given bookings"""
+        booking_ids = set(booking_ids)
+        with self._lock:
+            held = [h["id"] for h in self._holds.values() if h["booking_id"] in booking_ids]
+            for hold_id in held:
+                self._remove(hold_id)
+            return len(held)
+
+
+# Create singleton instance
+hold_store = HoldStore()
@@ -0,0 +1,191 @@
+"""
+Idempotency-Key Support
+Stores the response of a create request under (user, scope, key) so retried
+requests replay it instead of redoing the work. Completed responses are
+kept in the `idempotency_keys` table (see database/idempotency.sql) with an
+in-process TTL cache in front; duplicates that arrive while the first request
+is still running wait for its result.
+"""
+from fastapi import HTTPException, status
+from fastapi.encoders import jsonable_encoder
+from app.cache import TTLCache
+from app.database import get_supabase_admin
+from config import settings
+from datetime import datetime, timedelta, timezone
+from typing import Any, Awaitable, Callable, Dict, Optional
+import asyncio
+import hashlib
+import json
+
+IN_PROGRESS = "in_progress"
+COMPLETED = "completed"
+
+_responses = TTLCache(
+    maxsize=settings.IDEMPOTENCY_CACHE_SIZE,
+    ttl=settings.IDEMPOTENCY_TTL_HOURS * 3600
+)
+_inflight: Dict[tuple, asyncio.Future] = {}
+
+
+def request_hash(payload: Any) -> str:
+    """Stable hash of the request body"""
+    body = json.dumps(jsonable_encoder(payload), sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(body.encode()).hexdigest()
+
+
+def _replay(entry: dict, hashed: str) -> Any:
+    if entry["request_hash"] != hashed:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail="Idempotency-Key was already used with a different request"
+        )
+    return entry["response_body"]
+
+
+def _expired(timestamp: str) -> bool:
+    parsed = datetime.fromisoformat(timestamp.replace("Z", "+00:00"))
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed < datetime.now(timezone.utc)
+
+
+def _claim(supabase, user_id: str, scope: str, key: str, hashed: str) -> Optional[dict]:
+    """
+    Try to take ownership of a key
+
+    Returns None if this request now owns the key, otherwise the existing row.
+    """
+    now = datetime.utcnow()
+    row = {
+        "user_id": user_id,
+        "scope": scope,
+        "key": key,
+        "request_hash": hashed,
+        "status": IN_PROGRESS,
+        "locked_until": (now + timedelta(seconds=settings.IDEMPOTENCY_LOCK_SECONDS)).isoformat(),
+        "expires_at": (now + timedelta(hours=settings.IDEMPOTENCY_TTL_HOURS)).isoformat(),
+        "created_at": now.isoformat(),
+    }
+    try:
+        supabase.table("idempotency_keys").insert(row).execute()
+        return None
+    except Exception as e:
+        if getattr(e, "code", None) != "23505":  # unique_violation
+            raise
+
+    existing = supabase.table("idempotency_keys").select("*").eq("user_id", user_id).eq(
+        "scope", scope
+    ).eq("key", key).execute()
+    if not existing.data:
+        return _claim(supabase, user_id, scope, key, hashed)
+    entry = existing.data[0]
+
+    # Take over keys that expired, or whose owner died mid-request
+    stale = _expired(entry["expires_at"]) or (
+        entry["status"] == IN_PROGRESS and _expired(entry["locked_until"])
+    )
+    if stale:
+        taken = supabase.table("idempotency_keys").update(row).eq("user_id", user_id).eq(
+            "scope", scope
+        ).eq("key", key).eq("locked_until", entry["locked_until"]).execute()
+        if taken.data:
+            return None
+    return entry
+
+
+async def _wait_for_completion(supabase, user_id: str, scope: str, key: str) -> Optional[dict]:
+    """Poll until another worker finishes the request holding the key"""
+    deadline = asyncio.get_running_loop().time() + settings.IDEMPOTENCY_WAIT_SECONDS
+    while asyncio.get_running_loop().time() < deadline:
+        await asyncio.sleep(0.2)
+        existing = supabase.table("idempotency_keys").select("*").eq("user_id", user_id).eq(
+            "scope", scope
+        ).eq("key", key).execute()
+        if not existing.data:
+            return None
+        if existing.data[0]["status"] == COMPLETED:
+            return existing.data[0]
+    return None
+
+
+async def run_idempotent(
+    key: Optional[str],
+    user_id: str,
+    scope: str,
+    payload: Any,
+    handler: Callable[[], Awaitable[Any]]
+) -> Any:
+    """
+    Run handler at most once per (user, scope, Idempotency-Key)
+
+    Args:
+        key: Value of the Idempotency-Key header (None disables idempotency)
+        user_id: Caller, so keys never collide across users
+        scope: Operation name, e.g. "bookings.create"
+        payload: Request body, hashed to reject key reuse with another body
+        handler: Coroutine factory doing the real work
+
+    Returns:
+        The handler's response, or the stored response of the first request
+    """
+    if not key:
+        return await handler()
+
+    hashed = request_hash(payload)
+    cache_key = (user_id, scope, key)
+
+    cached = _responses.get(cache_key)
+    if cached is not None:
+        return _replay(cached, hashed)
+
+    # Same-process duplicate: share the first request's result
+    inflight = _inflight.get(cache_key)
+    if inflight is not None:
+        entry = await asyncio.shield(inflight)
+        return _replay(entry, hashed)
+
+    future = asyncio.get_running_loop().create_future()
+    _inflight[cache_key] = future
+    try:
+        supabase = get_supabase_admin()
+        existing = _claim(supabase, user_id, scope, key, hashed)
+
+        if existing is not None:
+            if existing["status"] != COMPLETED:
+                existing = await _wait_for_completion(supabase, user_id, scope, key)
+                if existing is None:
+                    raise HTTPException(
+                        status_code=status.HTTP_409_CONFLICT,
+                        detail="A request with this Idempotency-Key is still in progress"
+                    )
+            entry = {"request_hash": existing["request_hash"], "response_body": existing["response_body"]}
+        else:
+            try:
+                response = await handler()
+            except Exception:
+                # Let the client retry with the same key
+                supabase.table("idempotency_keys").delete().eq("user_id", user_id).eq(
+                    "scope", scope
+                ).eq("key", key).execute()
+                raise
+
+            entry = {"request_hash": hashed, "response_body": jsonable_encoder(response)}
+            supabase.table("idempotency_keys").update({
+                "status": COMPLETED,
+                "response_body": entry["response_body"],
+            }).eq("user_id", user_id).eq("scope", scope).eq("key", key).execute()
+
+        _responses.set(cache_key, entry)
+        future.set_result(entry)
+        return _replay(entry, hashed)
+    except asyncio.CancelledError:
+        future.cancel()
+        raise
+    except Exception as e:
+        if not future.done():
+            future.set_exception(e)
+            # Mark retrieved so failures without waiters do not log warnings
+            future.exception()
+        raise
+    finally:
+        _inflight.pop(cache_key, None)
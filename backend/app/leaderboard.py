@@ -0,0 +1,194 @@
+"""
+Loyalty Tiers and Leaderboard
+Keeps every member's lifetime points in an in-memory ordered index (a
+SortedList) so updates, tier, rank and leaderboard lookups are O(log n)
+instead of sorting loyalty_points per request. Every lifetime_points change
+is written to the outbox (database/loyalty_leaderboard.sql) and applied by a
+broadcast subscriber in each API process. A background task loads the index
+at startup and resyncs rows whose updated_at moved past the last sync every
+LEADERBOARD_REFRESH_SECONDS, in case an event was missed; the database reads
+run in a worker thread, never on a request.
+"""
+from app.database import get_supabase_admin
+from config import settings
+from datetime import datetime, timedelta
+from sortedcontainers import SortedList
+from typing import Dict, List, Optional, Tuple
+import asyncio
+import bisect
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+PAGE_SIZE = 1000
+
+# Rows committed slightly out of updated_at order are caught by re-reading this window
+SYNC_OVERLAP = timedelta(seconds=5)
+
+
+def parse_tiers(spec: str) -> List[Tuple[int, str]]:
+    """
+    Parse tier thresholds
+
+    Args:
+        spec: Comma separated "name:min_lifetime_points", e.g. "bronze:0,silver:1000"
+
+    Returns:
+        list: (min_points, name) sorted by min_points
+    """
+    tiers = []
+    for part in spec.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        name, min_points = part.split(":")
+        tiers.append((int(min_points), name.strip()))
+    if not tiers:
+        tiers = [(0, "member")]
+    return sorted(tiers)
+
+
+class LoyaltyLeaderboard:
+    """
+    Ordered (-lifetime_points, user_id) index with per-user lookups
+
+    Ties share a rank: a member's rank is 1 + the number of members with
+    strictly more lifetime points.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = SortedList()  # (-lifetime_points, user_id)
+        self._points: Dict[str, int] = {}
+        # user_id -> monotonic time an outbox event last set their points
+        self._touched: Dict[str, float] = {}
+        self._synced_at: Optional[str] = None
+        self._tiers = parse_tiers(settings.LOYALTY_TIERS)
+        self._ready = asyncio.Event()
+        self._task = None
+
+    def _set(self, user_id: str, points: int):
+        old = self._points.get(user_id)
+        if old == points:
+            return
+        if old is not None:
+            self._entries.remove((-old, user_id))
+        self._entries.add((-points, user_id))
+        self._points[user_id] = points
+
+    def apply(self, changes: List[dict]):
+        """Apply lifetime point changes from outbox events ({"user_id", "lifetime_points"})"""
+        now = time.monotonic()
+        with self._lock:
+            for change in changes:
+                self._set(change["user_id"], change["lifetime_points"] or 0)
+                self._touched[change["user_id"]] = now
+
+    def start(self):
+        """Load and keep refreshing the index in the background"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.to_thread(self.refresh)
+                self._ready.set()
+            except Exception:
+                logger.exception("Refreshing the loyalty leaderboard failed")
+            await asyncio.sleep(settings.LEADERBOARD_REFRESH_SECONDS)
+
+    async def wait_ready(self, timeout: float) -> bool:
+        """Wait for the first load; False if it did not finish in time"""
+        try:
+            await asyncio.wait_for(self._ready.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    @staticmethod
+    def _changed_since(since: Optional[str]) -> List[dict]:
+        """loyalty_points rows with updated_at >= since, paged by (updated_at, user_id)"""
+        supabase = get_supabase_admin()
+        rows: List[dict] = []
+        last: Optional[dict] = None
+        while True:
+            query = supabase.table("loyalty_points").select("user_id, lifetime_points, updated_at")
+            if last:
+                # Keyset pagination: rows updated mid-scan can't shift later pages
+                query = query.or_(
+                    f'updated_at.gt."{last["updated_at"]}",'
+                    f'and(updated_at.eq."{last["updated_at"]}",user_id.gt.{last["user_id"]})'
+                )
+            elif since:
+                query = query.gte("updated_at", since)
+            page = query.order("updated_at").order("user_id").limit(PAGE_SIZE).execute()
+            rows += page.data
+            if len(page.data) < PAGE_SIZE:
+                return rows
+            last = page.data[-1]
+
+    def refresh(self):
+        """Apply loyalty_points rows changed since the last sync (blocking; run in a thread)"""
+        started, started_monotonic = datetime.utcnow(), time.monotonic()
+        rows = self._changed_since(self._synced_at)
+        with self._lock:
+            for row in rows:
+                # An event applied while this read ran carries a newer value
+                if self._touched.get(row["user_id"], 0) < started_monotonic:
+                    self._set(row["user_id"], row["lifetime_points"] or 0)
+            self._touched = {user_id: at for user_id, at in self._touched.items() if at >= started_monotonic}
+        self._synced_at = (started - SYNC_OVERLAP).isoformat()
+
+    def tier_for(self, points: int) -> dict:
+        """Tier for a lifetime point total, with the gap to the next tier"""
+        index = bisect.bisect_right(self._tiers, points, key=lambda tier: tier[0]) - 1
+        min_points, name = self._tiers[max(index, 0)]
+        upcoming = self._tiers[index + 1] if index + 1 < len(self._tiers) else None
+        return {
+            "tier": name,
+            "tier_min_points": min_points,
+            "next_tier": upcoming[1] if upcoming else None,
+            "points_to_next_tier": upcoming[0] - points if upcoming else None,
+        }
+
+    def standing(self, user_id: str) -> dict:
+        """Lifetime points, rank and tier of one member"""
+        with self._lock:
+            points = self._points.get(user_id, 0)
+            rank = self._entries.bisect_left((-points,)) + 1
+            return {
+                "lifetime_points": points,
+                "rank": rank,
+                "total_members": len(self._entries),
+                **self.tier_for(points),
+            }
+
+    def top(self, limit: int, offset: int = 0) -> List[dict]:
+        """Leaderboard slice, best first"""
+        with self._lock:
+            entries = self._entries.islice(offset, offset + limit)
+            ranked = []
+            for negative_points, user_id in entries:
+                ranked.append({
+                    "user_id": user_id,
+                    "lifetime_points": -negative_points,
+                    "rank": self._entries.bisect_left((negative_points,)) + 1,
+                    "tier": self.tier_for(-negative_points)["tier"],
+                })
+            return ranked
+
+
+# Create singleton instance
+loyalty_leaderboard = LoyaltyLeaderboard()
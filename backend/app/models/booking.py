@@ -69,6 +69,31 @@ class BookingCreate(BaseModel):
     with_driver: bool = False
     customer_gender: Optional[str] = None
     special_requests: Optional[str] = None
+    quote_id: Optional[str] = None  # From POST /bookings/quote
+
+
+class BookingQuoteRequest(BaseModel):
+    vehicle_id: str
+    pickup_date: datetime
+    return_date: datetime
+    rental_type: RentalType
+    with_driver: bool = False
+
+
+class BookingQuote(BaseModel):
+    quote_id: str
+    vehicle_id: str
+    pickup_date: datetime
+    return_date: datetime
+    rental_type: RentalType
+    with_driver: bool
+    base_price: float
+    surge_multiplier: float
+    driver_fee: float
+    platform_fee: float
+    total_price: float
+    expires_at: datetime
+    hold_expires_at: datetime
 
 
 class BookingUpdate(BaseModel):
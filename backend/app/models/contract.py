@@ -36,6 +36,9 @@ class Contract(BaseModel):
     
     # PDF
     pdf_url: Optional[str] = None
+    signed_pdf_url: Optional[str] = None  # Rendered with both signatures
+    signed_pdf_sha256: Optional[str] = None
+    signed_pdf_at: Optional[datetime] = None
     
     # Status
     status: ContractStatus = ContractStatus.DRAFT
@@ -1,5 +1,5 @@
 from pydantic import BaseModel
-from typing import Optional
+from typing import List, Optional
 from datetime import datetime
 from enum import Enum
 
@@ -48,6 +48,10 @@ class KYC(BaseModel):
     reviewed_by: Optional[str] = None
     reviewed_at: Optional[datetime] = None
     
+    # Review queue lease
+    claimed_by: Optional[str] = None
+    claimed_at: Optional[datetime] = None
+    
     created_at: datetime
     updated_at: datetime
     
@@ -79,4 +83,6 @@ class KYCUpdate(BaseModel):
     rejection_reason: Optional[str] = None
 
 
-
+class KYCQueuePage(BaseModel):
+    items: List[KYC]
+    next_cursor: Optional[str] = None  # Pass as ?cursor= for the next page
@@ -17,6 +17,8 @@ class LoyaltyPoints(BaseModel):
     total_points: int = 0
     available_points: int = 0
     lifetime_points: int = 0
+    next_expiry_at: Optional[datetime] = None
+    next_expiry_points: int = 0
     updated_at: datetime
     
     class Config:
@@ -42,9 +44,19 @@ class LoyaltyEarnRequest(BaseModel):
     points: int  # Usually 1 mile = 1 point
 
 
-class LoyaltyRedeemRequest(BaseModel):
-    points: int
-    booking_id: Optional[str] = None
-
+class LoyaltyTier(BaseModel):
+    tier: str
+    tier_min_points: int
+    next_tier: Optional[str] = None
+    points_to_next_tier: Optional[int] = None
+    lifetime_points: int
+    rank: int
+    total_members: int
 
 
+class LeaderboardEntry(BaseModel):
+    rank: int
+    user_id: str
+    display_name: Optional[str] = None
+    lifetime_points: int
+    tier: str
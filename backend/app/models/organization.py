@@ -0,0 +1,28 @@
+from pydantic import BaseModel
+from typing import Optional
+from datetime import date
+
+
+class OrganizationDashboard(BaseModel):
+    organization_id: str
+    from_date: date
+    to_date: date
+    
+    # Revenue (AED)
+    revenue: float = 0.0
+    refunds: float = 0.0
+    net_revenue: float = 0.0
+    
+    # Fleet utilization
+    fleet_size: int = 0
+    booked_hours: float = 0.0
+    utilization: float = 0.0  # booked hours / available fleet hours (0-1)
+    bookings_confirmed: int = 0
+    bookings_cancelled: int = 0
+    
+    # Current state
+    active_rentals: int = 0
+    
+    # Reviews written in the window
+    average_rating: Optional[float] = None
+    total_reviews: int = 0
@@ -1,5 +1,5 @@
 from pydantic import BaseModel
-from typing import Optional
+from typing import Dict, Optional
 from datetime import datetime
 
 
@@ -41,4 +41,14 @@ class ReviewUpdate(BaseModel):
     value_rating: Optional[float] = None
 
 
+class VehicleRatingSummary(BaseModel):
+    vehicle_id: str
+    average_rating: float = 0.0
+    total_reviews: int = 0
+    histogram: Dict[int, int] = {}  # stars (1-5) -> number of reviews
+    
+    # Category averages (None until someone rated the category)
+    cleanliness_rating: Optional[float] = None
+    comfort_rating: Optional[float] = None
+    value_rating: Optional[float] = None
 
@@ -0,0 +1,37 @@
+from pydantic import BaseModel
+from typing import Optional
+from datetime import datetime
+from enum import Enum
+from app.models.kyc import DocumentType
+
+
+class UploadTarget(str, Enum):
+    AVATAR = "avatar"
+    VEHICLE_IMAGE = "vehicle_image"
+    KYC_DOCUMENT = "kyc_document"
+    KYC_SIGNATURE = "kyc_signature"
+    CONTRACT_SIGNATURE = "contract_signature"  # Signature for POST /contracts/{id}/sign (no KYC needed)
+
+
+class UploadTargetParams(BaseModel):
+    target: UploadTarget
+    vehicle_id: Optional[str] = None  # vehicle_image
+    document_type: Optional[DocumentType] = None  # kyc_document
+    side: Optional[str] = None  # kyc_document: front, back
+
+
+class SignedUploadRequest(UploadTargetParams):
+    file_name: str  # Original file name (extension is kept)
+    content_type: str
+
+
+class SignedUpload(BaseModel):
+    bucket: str
+    path: str
+    signed_url: str  # PUT the file here with the same Content-Type
+    token: str
+    expires_at: datetime
+
+
+class UploadComplete(UploadTargetParams):
+    path: str  # As returned by /uploads/sign
@@ -1,7 +1,8 @@
 from pydantic import BaseModel
 from typing import Optional, List
-from datetime import datetime
+from datetime import datetime, date
 from enum import Enum
+from app.models.review import VehicleRatingSummary
 
 
 class VehicleStatus(str, Enum):
@@ -59,6 +60,9 @@ class Vehicle(BaseModel):
     total_reviews: int = 0
     total_bookings: int = 0
     
+    # Only filled when requested (GET /vehicles/{id}?include_rating_summary=true)
+    rating_summary: Optional[VehicleRatingSummary] = None
+    
     created_at: datetime
     updated_at: datetime
     
@@ -129,4 +133,19 @@ class VehicleSearchParams(BaseModel):
     limit: int = 20
 
 
+class VehicleUtilizationDay(BaseModel):
+    day: date
+    booked_hours: float = 0.0
+    revenue: float = 0.0
+    idle: bool = True
+
 
+class VehicleUtilization(BaseModel):
+    vehicle_id: str
+    from_date: date
+    to_date: date
+    booked_hours: float = 0.0
+    revenue: float = 0.0
+    idle_days: int = 0
+    utilization: float = 0.0  # booked hours / hours in range (0-1)
+    days: List[VehicleUtilizationDay] = []
@@ -0,0 +1,113 @@
+"""
+Booking Price Quotes
+Issues signed, short-lived quote ids and keeps the priced quote in a bounded
+TTL cache so a booking can reuse it instead of re-fetching and re-pricing
+"""
+from app.cache import TTLCache
+from config import settings
+from datetime import datetime, timedelta
+from typing import Optional
+import hashlib
+import hmac
+import time
+import uuid
+
+
+class QuoteStore:
+    """
+    Signed quote ids backed by an in-process TTL cache
+
+    A quote id has the form "<key>.<expires>.<signature>", where the signature
+    binds the key and expiry to the user the quote was issued for.
+    """
+
+    def __init__(self):
+        self._cache = TTLCache(
+            maxsize=settings.QUOTE_CACHE_SIZE,
+            ttl=settings.QUOTE_TTL_MINUTES * 60
+        )
+
+    @staticmethod
+    def _sign(key: str, expires: int, user_id: str) -> str:
+        message = f"{key}.{expires}.{user_id}".encode()
+        return hmac.new(settings.SECRET_KEY.encode(), message, hashlib.sha256).hexdigest()[:32]
+
+    def issue(self, user_id: str, vehicle: dict, request, pricing: dict) -> dict:
+        """
+        Cache a priced quote and return it with its signed id
+
+        Args:
+            user_id: Customer the quote is issued to
+            vehicle: Vehicle row the price was computed for
+            request: BookingQuoteRequest (or BookingCreate) with the rental terms
+            pricing: Output of calculate_booking_price
+
+        Returns:
+            dict: Quote fields, including quote_id and expires_at
+        """
+        ttl = settings.QUOTE_TTL_MINUTES * 60
+        expires = int(time.time()) + ttl
+        key = uuid.uuid4().hex
+        quote_id = f"{key}.{expires}.{self._sign(key, expires, user_id)}"
+
+        quote = {
+            "quote_id": quote_id,
+            "vehicle_id": request.vehicle_id,
+            "pickup_date": request.pickup_date,
+            "return_date": request.return_date,
+            "rental_type": request.rental_type,
+            "with_driver": request.with_driver,
+            **pricing,
+            "expires_at": datetime.utcnow() + timedelta(seconds=ttl),
+        }
+        self._cache.set(key, {"user_id": user_id, "vehicle": vehicle, "quote": quote}, ttl)
+        return quote
+
+    def redeem(self, quote_id: str, user_id: str, booking_data) -> Optional[dict]:
+        """
+        Look up a still-valid quote matching the booking request
+
+        Returns None if the id is forged, expired, evicted, issued to another
+        user, or was priced for different rental terms.
+
+        Returns:
+            dict: {'vehicle': dict, 'pricing': dict}
+        """
+        try:
+            key, expires, signature = quote_id.split(".")
+            expires = int(expires)
+        except ValueError:
+            return None
+
+        if expires <= time.time():
+            return None
+        if not hmac.compare_digest(signature, self._sign(key, expires, user_id)):
+            return None
+
+        entry = self._cache.get(key)
+        if entry is None or entry["user_id"] != user_id:
+            return None
+
+        quote = entry["quote"]
+        if (
+            quote["vehicle_id"] != booking_data.vehicle_id
+            or quote["pickup_date"] != booking_data.pickup_date
+            or quote["return_date"] != booking_data.return_date
+            or quote["rental_type"] != booking_data.rental_type
+            or quote["with_driver"] != booking_data.with_driver
+        ):
+            return None
+
+        pricing = {
+            field: quote[field]
+            for field in ("base_price", "surge_multiplier", "driver_fee", "platform_fee", "total_price")
+        }
+        return {"vehicle": entry["vehicle"], "pricing": pricing}
+
+    def invalidate(self, quote_id: str):
+        """Drop a quote once it has been used for a booking"""
+        self._cache.pop(quote_id.split(".")[0])
+
+
+# Create singleton instance
+quote_store = QuoteStore()
@@ -0,0 +1,26 @@
+"""
+Vehicle Rating Summaries
+Builds the public rating summary of a vehicle from its vehicle_rating_stats
+row (kept up to date by the trigger in database/vehicle_ratings.sql).
+"""
+from app.models.review import VehicleRatingSummary
+from typing import Optional
+
+
+def _average(total, count) -> Optional[float]:
+    return round(float(total) / count, 2) if count else None
+
+
+def build_rating_summary(vehicle_id: str, stats: Optional[dict]) -> VehicleRatingSummary:
+    """Rating summary from a vehicle_rating_stats row (None if the vehicle has no reviews yet)"""
+    stats = stats or {}
+    count = stats.get("rating_count") or 0
+    return VehicleRatingSummary(
+        vehicle_id=vehicle_id,
+        average_rating=_average(stats.get("rating_sum"), count) or 0.0,
+        total_reviews=count,
+        histogram={stars: stats.get(f"stars_{stars}") or 0 for stars in range(1, 6)},
+        cleanliness_rating=_average(stats.get("cleanliness_sum"), stats.get("cleanliness_count")),
+        comfort_rating=_average(stats.get("comfort_sum"), stats.get("comfort_count")),
+        value_rating=_average(stats.get("value_sum"), stats.get("value_count")),
+    )
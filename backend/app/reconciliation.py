@@ -0,0 +1,99 @@
+"""
+Stripe Reconciliation Job
+Finds payments whose status drifted from Stripe (e.g. a lost webhook) by
+paging through PaymentIntents created since the last watermark and fixing
+mismatches in bulk. Memory stays bounded to one page of intents.
+"""
+from app.models.payment import PaymentStatus
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List
+
+JOB_NAME = "stripe_reconciliation"
+
+# PaymentIntent status -> payments.status; other intent states are left alone
+INTENT_STATUSES = {
+    "succeeded": PaymentStatus.COMPLETED.value,
+    "processing": PaymentStatus.PROCESSING.value,
+    "canceled": PaymentStatus.FAILED.value,
+}
+
+
+def reconcile_page(supabase, intents: List[dict]) -> List[dict]:
+    """
+    Compare one page of intents with their payments rows
+
+    Returns:
+        list: apply_payment_updates rows for payments whose status differs
+    """
+    by_id: Dict[str, dict] = {intent["id"]: intent for intent in intents}
+    payments = supabase.table("payments").select("stripe_payment_intent_id, status").in_(
+        "stripe_payment_intent_id", list(by_id)
+    ).execute()
+
+    updates = []
+    for payment in payments.data:
+        intent = by_id[payment["stripe_payment_intent_id"]]
+        expected = INTENT_STATUSES.get(intent["status"])
+        if expected and expected != payment["status"]:
+            updates.append({
+                "intent_id": intent["id"],
+                "status": expected,
+                "charge_id": intent.get("latest_charge"),
+                "failure_reason": (
+                    intent.get("cancellation_reason") if intent["status"] == "canceled" else None
+                ),
+            })
+    return updates
+
+
+def run_reconciliation(supabase, stripe_client, page_size: int = 100, lookback_hours: int = 72) -> dict:
+    """
+    Reconcile every PaymentIntent created since the stored watermark
+
+    Stripe cannot filter intents by last update, so each run re-reads intents
+    created within `lookback_hours` before the previous run started; intents
+    that settle later than that are expected to arrive by webhook.
+    """
+    started = datetime.now(timezone.utc)
+    watermark = supabase.table("job_watermarks").select("watermark_at").eq("job_name", JOB_NAME).execute()
+    since = started - timedelta(hours=lookback_hours)
+    if watermark.data and watermark.data[0]["watermark_at"]:
+        previous = datetime.fromisoformat(watermark.data[0]["watermark_at"].replace("Z", "+00:00"))
+        since = previous - timedelta(hours=lookback_hours)
+
+    intents = stripe_client.payment_intents.list(params={
+        "created": {"gte": int(since.timestamp())},
+        "limit": page_size,
+    })
+
+    scanned, fixed = 0, 0
+    page: List[dict] = []
+
+    def flush():
+        nonlocal fixed
+        updates = reconcile_page(supabase, page)
+        if updates:
+            result = supabase.rpc("apply_payment_updates", {"p_updates": updates}).execute()
+            fixed += result.data or 0
+        page.clear()
+
+    for intent in intents.auto_paging_iter():
+        page.append({
+            "id": intent["id"],
+            "status": intent["status"],
+            "latest_charge": intent.get("latest_charge"),
+            "cancellation_reason": intent.get("cancellation_reason"),
+        })
+        scanned += 1
+        if len(page) >= page_size:
+            flush()
+    if page:
+        flush()
+
+    supabase.table("job_watermarks").upsert({
+        "job_name": JOB_NAME,
+        "watermark_at": started.isoformat(),
+        "updated_at": started.isoformat(),
+    }).execute()
+
+    return {"scanned": scanned, "fixed": fixed, "since": since.isoformat()}
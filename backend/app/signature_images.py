@@ -0,0 +1,123 @@
+"""
+Signature Image Cache
+Local disk copies of signature images, keyed by the storage path stored on
+the contract, so re-rendering a signed contract never downloads them again.
+Only images held in our own Supabase Storage are fetched (older contracts
+stored a Storage URL instead of a path).
+"""
+from app.signed_urls import signed_urls
+from config import settings
+from typing import Optional, Tuple
+import asyncio
+import hashlib
+import httpx
+import os
+import tempfile
+
+# Bare paths live in this bucket, under {user_id}/signatures
+SIGNATURE_BUCKET = "kyc-documents"
+
+
+def signature_folder(user_id: str) -> str:
+    """Folder a user's signature images are uploaded to"""
+    return f"{user_id}/signatures"
+
+
+def is_storage_reference(reference: str) -> bool:
+    """True for a storage path or a URL served by our Supabase project"""
+    return "://" not in reference or reference.startswith(f"{settings.SUPABASE_URL}/storage/")
+
+
+class SignatureImageCache:
+    """Downloads signature images once and serves them from disk afterwards"""
+
+    def __init__(self):
+        self.directory = settings.SIGNATURE_CACHE_DIR or os.path.join(tempfile.gettempdir(), "signature-images")
+        self._http: Optional[httpx.AsyncClient] = None
+
+    @property
+    def http(self) -> httpx.AsyncClient:
+        if self._http is None:
+            self._http = httpx.AsyncClient(timeout=settings.UPLOAD_TIMEOUT_SECONDS)
+        return self._http
+
+    async def close(self):
+        if self._http is not None:
+            await self._http.aclose()
+            self._http = None
+
+    def _local_path(self, reference: str) -> str:
+        return os.path.join(self.directory, hashlib.sha256(reference.encode()).hexdigest())
+
+    def _locate(self, reference: str) -> Tuple[str, Optional[str]]:
+        """Cache path for a reference, and the URL to download it from when it is not cached yet"""
+        if not is_storage_reference(reference):
+            raise ValueError("Signature images must be stored in Supabase Storage")
+
+        local_path = self._local_path(reference)
+        if os.path.exists(local_path):
+            os.utime(local_path)  # Keep recently used images when pruning
+            return local_path, None
+
+        url = reference
+        if "://" not in reference:
+            url = signed_urls.sign(SIGNATURE_BUCKET, [reference]).get(reference)
+            if not url:
+                raise ValueError(f"Signature image {reference} not found")
+        return local_path, url
+
+    async def fetch(self, reference: str) -> str:
+        """
+        Local file path of a signature image
+
+        Args:
+            reference: Storage path or Supabase Storage URL of the image
+
+        Returns:
+            str: Path of the cached copy
+
+        Raises:
+            ValueError: If the reference points outside our storage or the image is too large
+        """
+        local_path, url = self._locate(reference)
+        if url:
+            response = await self.http.get(url)
+            response.raise_for_status()
+            await asyncio.to_thread(self._write, local_path, response.content)
+        return local_path
+
+    def fetch_sync(self, reference: str) -> str:
+        """Blocking version of fetch for Celery workers"""
+        local_path, url = self._locate(reference)
+        if url:
+            response = httpx.get(url, timeout=settings.UPLOAD_TIMEOUT_SECONDS)
+            response.raise_for_status()
+            self._write(local_path, response.content)
+        return local_path
+
+    def _write(self, local_path: str, content: bytes):
+        if len(content) > settings.SIGNATURE_MAX_BYTES:
+            raise ValueError("Signature image is too large")
+        os.makedirs(self.directory, exist_ok=True)
+        # Write then rename, so a concurrent render never reads a partial file
+        descriptor, temp_path = tempfile.mkstemp(dir=self.directory)
+        with os.fdopen(descriptor, "wb") as target:
+            target.write(content)
+        os.replace(temp_path, local_path)
+        self._prune()
+
+    def _prune(self):
+        """Drop the least recently used images beyond SIGNATURE_CACHE_MAX_FILES"""
+        entries = [entry for entry in os.scandir(self.directory) if entry.is_file()]
+        if len(entries) <= settings.SIGNATURE_CACHE_MAX_FILES:
+            return
+        entries.sort(key=lambda entry: entry.stat().st_mtime)
+        for entry in entries[:len(entries) - settings.SIGNATURE_CACHE_MAX_FILES]:
+            try:
+                os.remove(entry.path)
+            except FileNotFoundError:
+                pass
+
+
+# Create singleton instance
+signature_images = SignatureImageCache()
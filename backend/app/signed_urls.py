@@ -0,0 +1,93 @@
+"""
+Signed Download URLs
+Short-lived signed URLs for private storage objects (KYC documents), cached
+per (bucket, path) so repeated reads don't cost a storage round trip each.
+Missing URLs for many objects are signed with a single storage call.
+"""
+from app.cache import TTLCache
+from app.database import get_supabase_admin
+from config import settings
+from typing import Dict, Iterable, List, Optional
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def storage_path(bucket: str, value: Optional[str]) -> Optional[str]:
+    """
+    Object path for a stored file reference
+
+    Accepts a bare path or a public/signed URL of an object in the bucket
+    (older rows stored public URLs).
+    """
+    if not value:
+        return None
+    if "://" not in value:
+        return value
+    parts = value.split(f"/{bucket}/", 1)
+    if len(parts) < 2:
+        return None
+    return parts[1].split("?")[0]
+
+
+class SignedUrlService:
+    """
+    TTL cache of signed URLs
+
+    Entries expire SIGNED_URL_REFRESH_SECONDS before the URL itself, so a
+    URL handed out always has at least that long left and is re-signed
+    ahead of its expiry.
+    """
+
+    def __init__(self):
+        self._cache = TTLCache(
+            maxsize=settings.SIGNED_URL_CACHE_SIZE,
+            ttl=settings.SIGNED_URL_TTL_SECONDS - settings.SIGNED_URL_REFRESH_SECONDS
+        )
+
+    def sign(self, bucket: str, paths: Iterable[str]) -> Dict[str, str]:
+        """
+        Signed URLs for objects in one bucket
+
+        Args:
+            bucket: Storage bucket name
+            paths: Object paths
+
+        Returns:
+            dict: path -> signed URL (paths that could not be signed, including
+            all uncached ones when storage is unreachable, are left out)
+        """
+        urls: Dict[str, str] = {}
+        missing: List[str] = []
+        for path in dict.fromkeys(paths):
+            url = self._cache.get((bucket, path))
+            if url:
+                urls[path] = url
+            else:
+                missing.append(path)
+        if not missing:
+            return urls
+
+        try:
+            supabase = get_supabase_admin()
+            signed = supabase.storage.from_(bucket).create_signed_urls(missing, settings.SIGNED_URL_TTL_SECONDS)
+        except Exception:
+            # Storage outage: serve what the cache has, the rest stays unsigned
+            logger.exception("Could not sign %d objects in %s", len(missing), bucket)
+            return urls
+        for item in signed:
+            url = item.get("signedURL") or item.get("signedUrl")
+            if item.get("error") or not url:
+                logger.warning("Could not sign %s/%s: %s", bucket, item.get("path"), item.get("error"))
+                continue
+            self._cache.set((bucket, item["path"]), url)
+            urls[item["path"]] = url
+        return urls
+
+    def forget(self, bucket: str, path: str):
+        """Drop a cached URL (e.g. after the object was replaced or deleted)"""
+        self._cache.pop((bucket, path))
+
+
+# Create singleton instance
+signed_urls = SignedUrlService()
@@ -3,17 +3,130 @@ Supabase Storage Service
 Handles file uploads/downloads using Supabase Storage instead of AWS S3
 """
 from fastapi import UploadFile, HTTPException, status
-from app.database import get_supabase
-from typing import Optional
+from app.database import get_supabase, get_supabase_admin
+from config import settings
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+from typing import AsyncIterator, Optional
+from urllib.parse import quote
+from PIL import Image, ImageOps
+import asyncio
+import httpx
+import os
+import tempfile
 import uuid
 import mimetypes
 
+# Signed upload URLs issued by Supabase Storage are valid for two hours
+SIGNED_UPLOAD_TTL = timedelta(hours=2)
+
+# Photos in these formats are re-encoded when larger than UPLOAD_IMAGE_MAX_DIMENSION
+RESIZABLE_IMAGE_TYPES = {"image/jpeg", "image/png", "image/webp"}
+
+
+def _downscale_image(source: str, target: str, max_dimension: int, quality: int) -> bool:
+    """
+    Shrink an image file so its longest side is at most max_dimension
+
+    Runs in a worker process. The format is kept (PNG signatures keep their
+    transparency); EXIF orientation is applied and metadata is dropped.
+
+    Returns:
+        bool: True if target was written, False if the image was small enough
+    """
+    with Image.open(source) as image:
+        if max(image.size) <= max_dimension:
+            return False
+        image_format = image.format
+        # JPEGs are decoded at a reduced scale, so full-size pixels never hit memory
+        image.draft(image.mode, (max_dimension, max_dimension))
+        resized = ImageOps.exif_transpose(image)
+        resized.thumbnail((max_dimension, max_dimension))
+        options = {"quality": quality} if image_format in ("JPEG", "WEBP") else {"optimize": True}
+        resized.save(target, format=image_format, **options)
+    return True
+
 
 class SupabaseStorage:
     """
     Supabase Storage wrapper for file operations
     """
     
+    def __init__(self):
+        self._http: Optional[httpx.AsyncClient] = None
+        self._image_pool: Optional[ProcessPoolExecutor] = None
+    
+    @property
+    def http(self) -> httpx.AsyncClient:
+        """Pooled client for streaming requests to the Storage API"""
+        if self._http is None:
+            self._http = httpx.AsyncClient(
+                base_url=f"{settings.SUPABASE_URL}/storage/v1",
+                headers={
+                    "apikey": settings.SUPABASE_KEY,
+                    "Authorization": f"Bearer {settings.SUPABASE_KEY}",
+                },
+                timeout=settings.UPLOAD_TIMEOUT_SECONDS
+            )
+        return self._http
+    
+    @property
+    def image_pool(self) -> ProcessPoolExecutor:
+        if self._image_pool is None:
+            self._image_pool = ProcessPoolExecutor(max_workers=settings.UPLOAD_IMAGE_WORKERS)
+        return self._image_pool
+    
+    async def close(self):
+        """Release the HTTP connections and image worker processes"""
+        if self._http is not None:
+            await self._http.aclose()
+            self._http = None
+        if self._image_pool is not None:
+            self._image_pool.shutdown(wait=False, cancel_futures=True)
+            self._image_pool = None
+    
+    @staticmethod
+    def build_path(folder: str, original_name: str, file_name: Optional[str] = None) -> str:
+        """
+        Path of an upload within its bucket
+        
+        Args:
+            folder: Folder path within bucket
+            original_name: Client file name (only its extension is kept)
+            file_name: Optional custom file name (will generate UUID if not provided)
+        
+        Returns:
+            str: folder/file_name
+        """
+        if not file_name:
+            extension = original_name.split('.')[-1] if '.' in original_name else ''
+            file_name = f"{uuid.uuid4()}.{extension}" if extension else str(uuid.uuid4())
+        return f"{folder}/{file_name}" if folder else file_name
+    
+    @staticmethod
+    def _upload_error(bucket: str, error_message: str) -> HTTPException:
+        """Map a Storage error message to an HTTPException"""
+        if "already exists" in error_message.lower() or "duplicate" in error_message.lower():
+            return HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail="File with this name already exists"
+            )
+        elif "bucket not found" in error_message.lower():
+            return HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail=f"Storage bucket '{bucket}' not found. Please create it in Supabase dashboard."
+            )
+        elif "not allowed" in error_message.lower() or "unauthorized" in error_message.lower():
+            return HTTPException(
+                status_code=status.HTTP_403_FORBIDDEN,
+                detail="File upload not allowed. Check bucket policies in Supabase."
+            )
+        else:
+            return HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail=f"Failed to upload file: {error_message}"
+            )
+    
     @staticmethod
     async def upload_file(
         file: UploadFile,
@@ -43,13 +156,8 @@ class SupabaseStorage:
         try:
             supabase = get_supabase()
             
-            # Generate unique file name if not provided
-            if not file_name:
-                extension = file.filename.split('.')[-1] if '.' in file.filename else ''
-                file_name = f"{uuid.uuid4()}.{extension}" if extension else str(uuid.uuid4())
-            
-            # Build full path
-            file_path = f"{folder}/{file_name}" if folder else file_name
+            # Build full path (unique file name if not provided)
+            file_path = SupabaseStorage.build_path(folder, file.filename, file_name)
             
             # Read file content
             file_content = await file.read()
@@ -82,33 +190,218 @@ class SupabaseStorage:
             }
             
         except Exception as e:
-            error_message = str(e)
-            
             # Handle specific Supabase errors
-            if "already exists" in error_message.lower():
-                raise HTTPException(
-                    status_code=status.HTTP_409_CONFLICT,
-                    detail="File with this name already exists"
-                )
-            elif "bucket not found" in error_message.lower():
-                raise HTTPException(
-                    status_code=status.HTTP_404_NOT_FOUND,
-                    detail=f"Storage bucket '{bucket}' not found. Please create it in Supabase dashboard."
-                )
-            elif "not allowed" in error_message.lower() or "unauthorized" in error_message.lower():
-                raise HTTPException(
-                    status_code=status.HTTP_403_FORBIDDEN,
-                    detail="File upload not allowed. Check bucket policies in Supabase."
-                )
-            else:
-                raise HTTPException(
-                    status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                    detail=f"Failed to upload file: {error_message}"
-                )
+            raise SupabaseStorage._upload_error(bucket, str(e))
         finally:
             # Reset file pointer
             await file.seek(0)
     
+    async def upload_file_streaming(
+        self,
+        file: UploadFile,
+        bucket: str,
+        folder: str = "",
+        file_name: Optional[str] = None,
+        max_bytes: Optional[int] = None
+    ) -> dict:
+        """
+        Upload a file without holding it in memory
+        
+        The upload is copied to a temporary file in chunks (rejecting it as
+        soon as it exceeds max_bytes), oversized photos are downscaled in a
+        worker process, and the result is streamed to Storage.
+        
+        Args:
+            file: FastAPI UploadFile object
+            bucket: Supabase storage bucket name
+            folder: Optional folder path within bucket
+            file_name: Optional custom file name (will generate UUID if not provided)
+            max_bytes: Size limit (defaults to UPLOAD_MAX_BYTES)
+        
+        Returns:
+            dict: Same keys as upload_file
+        
+        Raises:
+            HTTPException: 413 if the file is too large, 400 if an image cannot be decoded
+        """
+        max_bytes = max_bytes or settings.UPLOAD_MAX_BYTES
+        if file.size is not None and file.size > max_bytes:
+            raise HTTPException(
+                status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                detail=f"File exceeds the {max_bytes // (1024 * 1024)} MB limit"
+            )
+        
+        file_path = self.build_path(folder, file.filename, file_name)
+        
+        content_type = file.content_type
+        if not content_type:
+            content_type, _ = mimetypes.guess_type(file.filename)
+            content_type = content_type or 'application/octet-stream'
+        
+        spooled = await self._spool(file, max_bytes)
+        resized = f"{spooled}.resized"
+        try:
+            upload_path = spooled
+            if content_type in RESIZABLE_IMAGE_TYPES:
+                try:
+                    loop = asyncio.get_running_loop()
+                    if await loop.run_in_executor(
+                        self.image_pool, _downscale_image, spooled, resized,
+                        settings.UPLOAD_IMAGE_MAX_DIMENSION, settings.UPLOAD_IMAGE_QUALITY
+                    ):
+                        upload_path = resized
+                except (OSError, Image.DecompressionBombError):
+                    raise HTTPException(
+                        status_code=status.HTTP_400_BAD_REQUEST,
+                        detail="File is not a valid image"
+                    )
+            
+            size = os.path.getsize(upload_path)
+            try:
+                response = await self.http.post(
+                    f"/object/{bucket}/{quote(file_path)}",
+                    content=self._read_chunks(upload_path),
+                    headers={
+                        "Content-Type": content_type,
+                        "Content-Length": str(size),
+                        "x-upsert": "false",  # Don't overwrite existing files
+                    }
+                )
+            except httpx.HTTPError as e:
+                raise self._upload_error(bucket, str(e))
+            if response.status_code >= 400:
+                raise self._upload_error(bucket, response.text)
+            
+            return {
+                'path': file_path,
+                'public_url': get_supabase().storage.from_(bucket).get_public_url(file_path),
+                'bucket': bucket,
+                'size': size,
+                'content_type': content_type
+            }
+        finally:
+            for path in (spooled, resized):
+                if os.path.exists(path):
+                    os.remove(path)
+    
+    @staticmethod
+    async def _spool(file: UploadFile, max_bytes: int) -> str:
+        """Copy an upload to a temporary file chunk by chunk, enforcing max_bytes"""
+        descriptor, path = tempfile.mkstemp(prefix="upload-")
+        size = 0
+        try:
+            with os.fdopen(descriptor, "wb") as target:
+                while chunk := await file.read(settings.UPLOAD_CHUNK_BYTES):
+                    size += len(chunk)
+                    if size > max_bytes:
+                        raise HTTPException(
+                            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                            detail=f"File exceeds the {max_bytes // (1024 * 1024)} MB limit"
+                        )
+                    await asyncio.to_thread(target.write, chunk)
+        except BaseException:
+            os.remove(path)
+            raise
+        return path
+    
+    @staticmethod
+    async def _read_chunks(path: str) -> AsyncIterator[bytes]:
+        with open(path, "rb") as source:
+            while chunk := await asyncio.to_thread(source.read, settings.UPLOAD_CHUNK_BYTES):
+                yield chunk
+    
+    @staticmethod
+    def upload_bytes(
+        bucket: str,
+        file_path: str,
+        content: bytes,
+        content_type: str,
+        upsert: bool = False
+    ) -> str:
+        """
+        Upload content generated by the server (e.g. rendered PDFs)
+        
+        Args:
+            bucket: Storage bucket name
+            file_path: File path in bucket
+            content: File content
+            content_type: MIME type
+            upsert: Replace an existing object at file_path
+        
+        Returns:
+            str: The file path
+        """
+        try:
+            supabase = get_supabase_admin()
+            supabase.storage.from_(bucket).upload(
+                path=file_path,
+                file=content,
+                file_options={
+                    "content-type": content_type,
+                    "upsert": "true" if upsert else "false"
+                }
+            )
+        except Exception as e:
+            raise SupabaseStorage._upload_error(bucket, str(e))
+        return file_path
+    
+    @staticmethod
+    def create_signed_upload(bucket: str, file_path: str) -> dict:
+        """
+        Issue a signed URL the client can upload one object to directly
+        
+        Args:
+            bucket: Storage bucket name
+            file_path: File path in bucket (must not exist yet)
+        
+        Returns:
+            dict: {
+                'signed_url': str,  # PUT the file body here
+                'token': str,  # Upload token embedded in signed_url
+                'expires_at': datetime
+            }
+        """
+        try:
+            supabase = get_supabase_admin()
+            signed = supabase.storage.from_(bucket).create_signed_upload_url(file_path)
+        except Exception as e:
+            raise SupabaseStorage._upload_error(bucket, str(e))
+        return {
+            'signed_url': signed['signed_url'],
+            'token': signed['token'],
+            'expires_at': datetime.utcnow() + SIGNED_UPLOAD_TTL,
+        }
+    
+    @staticmethod
+    def get_object_info(bucket: str, file_path: str) -> Optional[dict]:
+        """
+        Look up an object's metadata without downloading it
+        
+        Args:
+            bucket: Storage bucket name
+            file_path: File path in bucket
+        
+        Returns:
+            dict: {'size': int, 'content_type': str}, or None if the object does not exist
+        """
+        folder, _, name = file_path.rpartition('/')
+        try:
+            supabase = get_supabase_admin()
+            objects = supabase.storage.from_(bucket).list(folder, {"search": name, "limit": 10})
+        except Exception as e:
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail=f"Failed to look up file: {str(e)}"
+            )
+        for item in objects or []:
+            if item.get("name") == name:
+                metadata = item.get("metadata") or {}
+                return {
+                    'size': metadata.get("size") or metadata.get("contentLength") or 0,
+                    'content_type': metadata.get("mimetype") or 'application/octet-stream',
+                }
+        return None
+    
     @staticmethod
     def get_public_url(bucket: str, file_path: str) -> str:
         """
@@ -217,3 +510,20 @@ async def upload_file(
     result = await storage.upload_file(file, bucket, folder, file_name)
     return result['public_url']
 
+
+async def upload_file_streaming(
+    file: UploadFile,
+    bucket: str,
+    folder: str = "",
+    file_name: Optional[str] = None,
+    max_bytes: Optional[int] = None
+) -> str:
+    """
+    Streaming upload (size limited, photos downscaled) that returns just the public URL
+    
+    Returns:
+        str: Public URL of uploaded file
+    """
+    result = await storage.upload_file_streaming(file, bucket, folder, file_name, max_bytes)
+    return result['public_url']
+
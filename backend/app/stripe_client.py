@@ -0,0 +1,64 @@
+"""
+Stripe Client
+Shared, non-blocking Stripe access. One StripeClient per process keeps a
+pooled httpx connection (keep-alive) to the Stripe API; async calls never
+block the event loop and are bounded by a semaphore.
+"""
+from config import settings
+from typing import Optional
+import asyncio
+import stripe
+
+
+class StripeService:
+    """
+    Lazily built StripeClient with explicit timeouts and retries
+
+    Network errors, 409s and 5xx responses are retried by the Stripe library
+    with exponential backoff and jitter (0.5-1x of each delay). POST retries
+    reuse one idempotency key, so they never create duplicate objects.
+    """
+
+    def __init__(self):
+        self._client: Optional[stripe.StripeClient] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+    @property
+    def client(self) -> stripe.StripeClient:
+        """The shared client (sync methods are allowed for Celery tasks)"""
+        if self._client is None:
+            self._client = stripe.StripeClient(
+                settings.STRIPE_SECRET_KEY,
+                base_addresses={"api": settings.STRIPE_API_BASE} if settings.STRIPE_API_BASE else {},
+                http_client=stripe.HTTPXClient(
+                    timeout=settings.STRIPE_TIMEOUT_SECONDS,
+                    allow_sync_methods=True
+                ),
+                max_network_retries=settings.STRIPE_MAX_RETRIES
+            )
+        return self._client
+
+    @property
+    def semaphore(self) -> asyncio.Semaphore:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(settings.STRIPE_MAX_CONCURRENCY)
+        return self._semaphore
+
+    async def create_payment_intent(self, params: dict, idempotency_key: Optional[str] = None) -> stripe.PaymentIntent:
+        """
+        Create a PaymentIntent without blocking the event loop
+
+        Args:
+            params: PaymentIntent create parameters
+            idempotency_key: Optional Stripe idempotency key
+
+        Returns:
+            stripe.PaymentIntent
+        """
+        options = {"idempotency_key": idempotency_key} if idempotency_key else {}
+        async with self.semaphore:
+            return await self.client.payment_intents.create_async(params=params, options=options)
+
+
+# Create singleton instance
+stripe_service = StripeService()
@@ -0,0 +1,194 @@
+"""
+Stripe Webhook Inbox Consumer
+The webhook stores verified events in the `stripe_events` table and returns
+immediately (see database/stripe_events.sql). This consumer claims them in
+batches and applies the resulting payment updates with a single RPC; booking
+confirmation then follows from the payment.completed outbox event.
+"""
+from app.database import get_supabase_admin
+from app.events import outbox_dispatcher
+from app.models.payment import PaymentStatus
+from config import settings
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+import asyncio
+import logging
+import os
+import socket
+
+logger = logging.getLogger(__name__)
+
+# When one batch has several events for an intent, the highest rank wins and
+# `created` (whole seconds) only breaks ties. A payment can fail and then
+# succeed on retry, but never leaves completed.
+STATUS_RANK = {
+    PaymentStatus.PROCESSING.value: 0,
+    PaymentStatus.FAILED.value: 1,
+    PaymentStatus.COMPLETED.value: 2,
+}
+
+
+def _payment_update(event: dict) -> Optional[dict]:
+    """Map a payment_intent.* event to a payments row update, or None"""
+    intent = event["payload"]["data"]["object"]
+    if event["type"] == "payment_intent.processing":
+        return {
+            "intent_id": intent["id"],
+            "status": PaymentStatus.PROCESSING.value,
+            "charge_id": None,
+            "failure_reason": None,
+        }
+    if event["type"] == "payment_intent.succeeded":
+        charges = (intent.get("charges") or {}).get("data") or [{}]
+        return {
+            "intent_id": intent["id"],
+            "status": PaymentStatus.COMPLETED.value,
+            "charge_id": intent.get("latest_charge") or charges[0].get("id"),
+            "failure_reason": None,
+        }
+    if event["type"] == "payment_intent.payment_failed":
+        return {
+            "intent_id": intent["id"],
+            "status": PaymentStatus.FAILED.value,
+            "charge_id": None,
+            "failure_reason": (intent.get("last_payment_error") or {}).get("message"),
+        }
+    return None
+
+
+def build_payment_updates(events: List[dict]) -> List[dict]:
+    """One update per PaymentIntent: the highest-ranked status, latest first among equals"""
+    latest: Dict[str, dict] = {}
+    for event in sorted(events, key=lambda e: e["payload"].get("created", 0)):
+        update = _payment_update(event)
+        if not update:
+            continue
+        current = latest.get(update["intent_id"])
+        if current is None or STATUS_RANK[update["status"]] >= STATUS_RANK[current["status"]]:
+            latest[update["intent_id"]] = update
+    return list(latest.values())
+
+
+def _intent_id(event: dict) -> Optional[str]:
+    update = _payment_update(event)
+    return update["intent_id"] if update else None
+
+
+def _parse(timestamp: str) -> datetime:
+    parsed = datetime.fromisoformat(timestamp.replace("Z", "+00:00"))
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed
+
+
+class StripeEventConsumer:
+    """Polls the stripe_events inbox and applies claimed events in batches"""
+
+    def __init__(self):
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self._wake = asyncio.Event()
+        self._task = None
+
+    def notify(self):
+        """Wake the consumer early (called by the webhook)"""
+        self._wake.set()
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                processed = await self.process_batch()
+            except Exception:
+                logger.exception("Stripe event processing failed")
+                processed = 0
+
+            if processed < settings.STRIPE_EVENTS_BATCH_SIZE:
+                try:
+                    await asyncio.wait_for(self._wake.wait(), settings.OUTBOX_POLL_INTERVAL_SECONDS)
+                except asyncio.TimeoutError:
+                    pass
+                self._wake.clear()
+
+    async def process_batch(self) -> int:
+        """Claim, apply and acknowledge one batch of Stripe events"""
+        supabase = get_supabase_admin()
+
+        claimed = await asyncio.to_thread(
+            lambda: supabase.rpc("claim_stripe_events", {
+                "p_worker": self.worker_id,
+                "p_limit": settings.STRIPE_EVENTS_BATCH_SIZE,
+                "p_lease_seconds": settings.OUTBOX_LEASE_SECONDS,
+                "p_max_attempts": settings.OUTBOX_MAX_ATTEMPTS,
+            }).execute()
+        )
+        events = claimed.data or []
+        if not events:
+            return 0
+
+        ids = [event["id"] for event in events]
+        updates = build_payment_updates(events)
+        try:
+            known = set()
+            if updates:
+                result = await asyncio.to_thread(
+                    lambda: supabase.rpc("apply_payment_events", {"p_updates": updates}).execute()
+                )
+                known = set(result.data or [])
+        except Exception as e:
+            logger.exception("Applying Stripe events %s failed", ids)
+            await asyncio.to_thread(
+                lambda: supabase.table("stripe_events").update({
+                    "claimed_at": None,
+                    "claimed_by": None,
+                    "last_error": str(e)[:1000],
+                }).in_("id", ids).execute()
+            )
+            return len(events)
+
+        # Payment status changes reach bookings through the outbox
+        outbox_dispatcher.notify()
+
+        # The webhook can beat the insert of the payments row: release those
+        # events so a later claim retries them (up to OUTBOX_MAX_ATTEMPTS)
+        waiting_ids = [event["id"] for event in events if _intent_id(event) not in known | {None}]
+        if waiting_ids:
+            await asyncio.to_thread(
+                lambda: supabase.table("stripe_events").update({
+                    "claimed_at": None,
+                    "claimed_by": None,
+                    "last_error": "payment not found",
+                }).in_("id", waiting_ids).execute()
+            )
+        done = [event for event in events if event["id"] not in waiting_ids]
+        if not done:
+            return len(events)
+
+        # latency_ms is derived from processed_at by the table
+        now = datetime.now(timezone.utc)
+        await asyncio.to_thread(
+            lambda: supabase.table("stripe_events").update({
+                "processed_at": now.isoformat(),
+            }).in_("id", [event["id"] for event in done]).execute()
+        )
+        latencies = [int((now - _parse(event["received_at"])).total_seconds() * 1000) for event in done]
+        logger.info(
+            "Applied %d Stripe events (%d payment updates, %d waiting for their payment), max latency %d ms",
+            len(done), len(updates), len(waiting_ids), max(latencies)
+        )
+        return len(events)
+
+
+# Create singleton instance
+stripe_event_consumer = StripeEventConsumer()
@@ -0,0 +1,257 @@
+"""
+Demand-based surge pricing
+Keeps an in-memory occupancy histogram per (location, category, hour) so
+price lookups never have to query the bookings table. The histogram is
+loaded in a worker thread at startup; until then no surge is applied.
+"""
+from app.database import get_supabase_admin
+from config import settings
+from collections import defaultdict
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+import asyncio
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Booking statuses that occupy a vehicle
+ACTIVE_STATUSES = ("confirmed", "in_progress")
+
+HOUR = 3600
+PAGE_SIZE = 1000
+WARM_RETRY_SECONDS = 30
+
+
+def hour_bucket(value) -> int:
+    """Convert a datetime (or ISO string) to an absolute UTC hour bucket"""
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return int(value.timestamp() // HOUR)
+
+
+def parse_curve(spec: str) -> List[Tuple[float, float]]:
+    """
+    Parse a surge curve definition
+
+    Args:
+        spec: Comma separated "occupancy:multiplier" points, e.g. "0.5:1.0,0.8:1.5"
+
+    Returns:
+        list: (occupancy, multiplier) points sorted by occupancy
+    """
+    points = []
+    for part in spec.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        occupancy, multiplier = part.split(":")
+        points.append((float(occupancy), float(multiplier)))
+    if not points:
+        points = [(0.0, 1.0)]
+    return sorted(points)
+
+
+def apply_curve(curve: List[Tuple[float, float]], occupancy: float) -> float:
+    """Linearly interpolate a multiplier for the given occupancy ratio"""
+    if occupancy <= curve[0][0]:
+        return curve[0][1]
+    for (x0, y0), (x1, y1) in zip(curve, curve[1:]):
+        if occupancy <= x1:
+            return y0 + (y1 - y0) * (occupancy - x0) / (x1 - x0)
+    return curve[-1][1]
+
+
+class SurgeEngine:
+    """
+    Occupancy histogram and surge multiplier lookup
+
+    Booked vehicle counts are kept per (location, category, hour bucket) and
+    fleet sizes per (location, category). Both are loaded once from the
+    database and then updated incrementally on booking and vehicle changes.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._warm = False
+        self._booked: Dict[Tuple[str, str, int], int] = defaultdict(int)
+        self._fleet: Dict[Tuple[str, str], int] = defaultdict(int)
+        self._vehicle_keys: Dict[str, Tuple[str, str]] = {}
+        self._last_prune = 0.0
+        self._task: Optional[asyncio.Task] = None
+        self._default_curve = parse_curve(settings.SURGE_CURVE)
+        self._category_curves = {
+            category: parse_curve(spec)
+            for category, spec in settings.SURGE_CATEGORY_CURVES.items()
+        }
+
+    @staticmethod
+    def _key(vehicle: dict) -> Tuple[str, str]:
+        return (
+            (vehicle.get("location") or "").strip().lower(),
+            vehicle.get("category") or "",
+        )
+
+    def start(self):
+        """Load the histogram in the background (call once at startup)"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._warm_up())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _warm_up(self):
+        while not self._warm:
+            try:
+                await asyncio.to_thread(self.warm)
+            except Exception:
+                logger.exception("Loading the surge histogram failed, retrying")
+                await asyncio.sleep(WARM_RETRY_SECONDS)
+
+    def warm(self):
+        """Load the histogram from the database (blocking; run in a thread)"""
+        with self._lock:
+            if self._warm:
+                return
+            self._booked.clear()
+            self._fleet.clear()
+            self._vehicle_keys.clear()
+            self._load()
+            self._warm = True
+
+    def _load(self):
+        """Load fleet sizes and active future bookings from the database"""
+        supabase = get_supabase_admin()
+
+        # Keyset pagination on id: rows changing mid-scan can't shift pages
+        last_id = None
+        while True:
+            query = supabase.table("vehicles").select("id, location, category, status")
+            if last_id:
+                query = query.gt("id", last_id)
+            page = query.order("id").limit(PAGE_SIZE).execute()
+            for vehicle in page.data:
+                self._track(vehicle)
+            if len(page.data) < PAGE_SIZE:
+                break
+            last_id = page.data[-1]["id"]
+
+        now = datetime.utcnow().isoformat()
+        last_id = None
+        while True:
+            query = supabase.table("bookings").select(
+                "id, vehicle_id, pickup_date, return_date"
+            ).in_("status", list(ACTIVE_STATUSES)).gte("return_date", now)
+            if last_id:
+                query = query.gt("id", last_id)
+            page = query.order("id").limit(PAGE_SIZE).execute()
+            for booking in page.data:
+                self._apply(booking, 1)
+            if len(page.data) < PAGE_SIZE:
+                break
+            last_id = page.data[-1]["id"]
+
+    def _track(self, vehicle: dict):
+        if vehicle.get("status") in ("maintenance", "unavailable"):
+            return
+        key = self._key(vehicle)
+        self._vehicle_keys[vehicle["id"]] = key
+        self._fleet[key] += 1
+
+    def _untrack(self, vehicle_id: str):
+        key = self._vehicle_keys.pop(vehicle_id, None)
+        if key is not None:
+            self._fleet[key] = max(0, self._fleet[key] - 1)
+
+    def _apply(self, booking: dict, delta: int):
+        key = self._vehicle_keys.get(booking.get("vehicle_id"))
+        if key is None:
+            return
+        now = int(time.time() // HOUR)
+        start = max(hour_bucket(booking["pickup_date"]), now)
+        end = hour_bucket(booking["return_date"])
+        for bucket in range(start, end + 1):
+            slot = (key[0], key[1], bucket)
+            count = self._booked[slot] + delta
+            if count > 0:
+                self._booked[slot] = count
+            else:
+                self._booked.pop(slot, None)
+
+    def _prune(self):
+        """Drop buckets that are already in the past (at most once an hour)"""
+        if time.time() - self._last_prune < HOUR:
+            return
+        now = int(time.time() // HOUR)
+        for slot in [slot for slot in self._booked if slot[2] < now]:
+            del self._booked[slot]
+        self._last_prune = time.time()
+
+    def track_vehicle(self, vehicle: dict):
+        """Register a new or updated vehicle in the fleet counts"""
+        if not self._warm:
+            return
+        with self._lock:
+            self._untrack(vehicle["id"])
+            self._track(vehicle)
+
+    def untrack_vehicle(self, vehicle_id: str):
+        """Remove a vehicle from the fleet counts"""
+        if not self._warm:
+            return
+        with self._lock:
+            self._untrack(vehicle_id)
+
+    def on_booking_change(self, old: Optional[dict], new: Optional[dict]):
+        """
+        Update occupancy for a booking state change
+
+        Args:
+            old: Booking row before the change (None for inserts)
+            new: Booking row after the change (None for deletes)
+        """
+        if not self._warm:
+            return
+        with self._lock:
+            if old and old.get("status") in ACTIVE_STATUSES:
+                self._apply(old, -1)
+            if new and new.get("status") in ACTIVE_STATUSES:
+                self._apply(new, 1)
+
+    def occupancy(self, vehicle: dict, pickup_date: datetime, return_date: datetime) -> float:
+        """Average occupancy ratio of the vehicle's segment over the rental window"""
+        if not self._warm:
+            return 0.0
+        location, category = self._key(vehicle)
+        fleet = self._fleet.get((location, category), 0)
+        if fleet <= 0:
+            return 0.0
+
+        start = hour_bucket(pickup_date)
+        end = min(hour_bucket(return_date), start + settings.SURGE_WINDOW_HOURS - 1)
+        buckets = range(start, max(start, end) + 1)
+        booked = sum(self._booked.get((location, category, b), 0) for b in buckets)
+        return min(1.0, booked / (fleet * len(buckets)))
+
+    def multiplier(self, vehicle: dict, pickup_date: datetime, return_date: datetime) -> float:
+        """Surge multiplier for renting the vehicle over the given window"""
+        if not settings.SURGE_ENABLED or not self._warm:
+            return 1.0
+        with self._lock:
+            self._prune()
+        occupancy = self.occupancy(vehicle, pickup_date, return_date)
+        curve = self._category_curves.get(vehicle.get("category"), self._default_curve)
+        return round(apply_curve(curve, occupancy), 2)
+
+
+# Create singleton instance
+surge_engine = SurgeEngine()
@@ -0,0 +1,194 @@
+"""
+Vehicle Utilization Job
+Incrementally maintains the daily `vehicle_utilization` table from bookings
+changed since the last watermark (see database/vehicle_utilization.sql)
+"""
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Tuple
+import numpy as np
+
+JOB_NAME = "vehicle_utilization"
+DAY = 86400
+
+# Booking statuses that count as the vehicle earning money
+COUNTED_STATUSES = ("confirmed", "in_progress", "completed")
+
+
+def _epoch(value: str) -> float:
+    parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.timestamp()
+
+
+def clip_to_days(
+    vehicle_ids: List[str],
+    starts: np.ndarray,
+    ends: np.ndarray,
+    revenues: np.ndarray,
+    signs: np.ndarray
+) -> Dict[Tuple[str, int], Tuple[float, float]]:
+    """
+    Split booking intervals into per-day (hours, revenue) contributions
+
+    All bookings are expanded to one row per UTC day they touch, clipped to
+    that day's boundaries and summed per (vehicle, day) without a Python loop
+    over days. Revenue is spread in proportion to the hours in each day.
+
+    Args:
+        vehicle_ids: Vehicle id of each interval
+        starts: Interval starts (epoch seconds)
+        ends: Interval ends (epoch seconds)
+        revenues: Revenue of each interval
+        signs: +1 to add an interval, -1 to remove a previously applied one
+
+    Returns:
+        dict: (vehicle_id, day ordinal since epoch) -> (hours, revenue)
+    """
+    if len(vehicle_ids) == 0:
+        return {}
+
+    durations = ends - starts
+    first_day = np.floor(starts / DAY).astype(np.int64)
+    last_day = np.ceil(ends / DAY).astype(np.int64) - 1
+    n_days = np.where(durations > 0, last_day - first_day + 1, 0)
+    if n_days.sum() == 0:
+        return {}
+
+    # One row per (interval, day)
+    rows = np.repeat(np.arange(len(starts)), n_days)
+    offsets = np.arange(n_days.sum()) - np.repeat(np.cumsum(n_days) - n_days, n_days)
+    days = first_day[rows] + offsets
+    day_starts = days * DAY
+
+    seconds = np.minimum(ends[rows], day_starts + DAY) - np.maximum(starts[rows], day_starts)
+    hours = signs[rows] * seconds / 3600
+    revenue = signs[rows] * revenues[rows] * seconds / durations[rows]
+
+    # Group by (vehicle, day)
+    vehicles, vehicle_codes = np.unique(np.asarray(vehicle_ids, dtype=object), return_inverse=True)
+    base = int(days.min())
+    span = int(days.max()) - base + 1
+    keys = vehicle_codes[rows].astype(np.int64) * span + (days - base)
+    unique_keys, groups = np.unique(keys, return_inverse=True)
+    hour_sums = np.bincount(groups, weights=hours)
+    revenue_sums = np.bincount(groups, weights=revenue)
+
+    return {
+        (vehicles[key // span], base + int(key % span)): (hour_sums[i], revenue_sums[i])
+        for i, key in enumerate(unique_keys)
+    }
+
+
+def compute_chunk(bookings: List[dict], snapshots: Dict[str, dict]) -> Tuple[List[dict], List[dict]]:
+    """
+    Turn a chunk of changed bookings into utilization deltas and new snapshots
+
+    Args:
+        bookings: Changed booking rows
+        snapshots: booking_id -> previously applied snapshot
+
+    Returns:
+        tuple: (delta rows for vehicle_utilization, snapshot rows to upsert)
+    """
+    vehicle_ids, starts, ends, revenues, signs = [], [], [], [], []
+    new_snapshots = []
+
+    def add(vehicle_id, pickup, ret, revenue, sign):
+        vehicle_ids.append(vehicle_id)
+        starts.append(_epoch(pickup))
+        ends.append(_epoch(ret))
+        revenues.append(float(revenue))
+        signs.append(sign)
+
+    for booking in bookings:
+        old = snapshots.get(booking["id"])
+        if old and old["counted"]:
+            add(old["vehicle_id"], old["pickup_date"], old["return_date"], old["revenue"], -1)
+
+        counted = booking["status"] in COUNTED_STATUSES
+        if counted:
+            add(booking["vehicle_id"], booking["pickup_date"], booking["return_date"], booking["total_price"], 1)
+
+        new_snapshots.append({
+            "booking_id": booking["id"],
+            "vehicle_id": booking["vehicle_id"],
+            "pickup_date": booking["pickup_date"],
+            "return_date": booking["return_date"],
+            "revenue": float(booking["total_price"]),
+            "counted": counted,
+        })
+
+    contributions = clip_to_days(
+        vehicle_ids,
+        np.asarray(starts, dtype=np.float64),
+        np.asarray(ends, dtype=np.float64),
+        np.asarray(revenues, dtype=np.float64),
+        np.asarray(signs, dtype=np.float64),
+    )
+
+    epoch = datetime(1970, 1, 1).date()
+    deltas = [
+        {
+            "vehicle_id": vehicle_id,
+            "day": (epoch + timedelta(days=day)).isoformat(),
+            "booked_hours": round(float(hours), 4),
+            "revenue": round(float(revenue), 4),
+        }
+        for (vehicle_id, day), (hours, revenue) in contributions.items()
+        if abs(hours) > 1e-9 or abs(revenue) > 1e-9
+    ]
+    return deltas, new_snapshots
+
+
+def run_utilization_job(supabase, chunk_size: int = 1000, lag_seconds: int = 60) -> dict:
+    """
+    Process every booking changed since the stored watermark
+
+    Bookings are read in (updated_at, id) keyset order. Each chunk's deltas,
+    snapshots and the advanced watermark are written by a single RPC, so a
+    crash never double-applies a chunk. Rows newer than `lag_seconds` are left
+    for the next run to avoid skipping rows from still-open transactions.
+    """
+    watermark = supabase.table("job_watermarks").select("*").eq("job_name", JOB_NAME).execute()
+    watermark_at = watermark.data[0]["watermark_at"] if watermark.data else None
+    watermark_id = watermark.data[0]["watermark_id"] if watermark.data else None
+    horizon = (datetime.utcnow() - timedelta(seconds=lag_seconds)).isoformat()
+
+    processed = 0
+    while True:
+        query = supabase.table("bookings").select(
+            "id, vehicle_id, pickup_date, return_date, total_price, status, updated_at"
+        ).lt("updated_at", horizon)
+        if watermark_at:
+            query = query.or_(
+                f"updated_at.gt.{watermark_at},"
+                f"and(updated_at.eq.{watermark_at},id.gt.{watermark_id})"
+            )
+        page = query.order("updated_at").order("id").limit(chunk_size).execute()
+        bookings = page.data
+        if not bookings:
+            break
+
+        existing = supabase.table("booking_utilization_snapshots").select("*").in_(
+            "booking_id", [b["id"] for b in bookings]
+        ).execute()
+        snapshots = {s["booking_id"]: s for s in existing.data}
+
+        deltas, new_snapshots = compute_chunk(bookings, snapshots)
+        watermark_at = bookings[-1]["updated_at"]
+        watermark_id = bookings[-1]["id"]
+
+        supabase.rpc("apply_vehicle_utilization", {
+            "p_deltas": deltas,
+            "p_snapshots": new_snapshots,
+            "p_job": JOB_NAME,
+            "p_watermark_at": watermark_at,
+            "p_watermark_id": watermark_id,
+        }).execute()
+
+        processed += len(bookings)
+        if len(bookings) < chunk_size:
+            break
+
+    return {"processed": processed, "watermark_at": watermark_at}
@@ -6,8 +6,18 @@ from celery import Celery
 from celery.schedules import crontab
 from config import settings
 from app.database import get_supabase_admin
+from app.utilization import run_utilization_job
+from app.reconciliation import run_reconciliation
+from app.stripe_client import stripe_service
+from app.contract_pdf import record_render_failure, render_and_store_inline
+from app.storage import SIGNED_UPLOAD_TTL
 from datetime import datetime, timedelta
 import httpx
+import logging
+import stripe
+import time
+
+logger = logging.getLogger(__name__)
 
 celery_app = Celery(
     "hiyacars",
@@ -149,32 +159,217 @@ def process_monthly_payouts(organization_id: str, month: int, year: int):
 def expire_loyalty_points():
     """Expire loyalty points that have passed their expiration date"""
     supabase = get_supabase_admin()
+    started = time.monotonic()
+    now = datetime.utcnow().isoformat()
     
-    # Get expired transactions
-    expired_transactions = supabase.table("loyalty_transactions").select("*").eq(
-        "transaction_type", "earned"
-    ).lte("expires_at", datetime.utcnow().isoformat()).execute()
-    
-    for transaction in expired_transactions.data:
-        # Mark as expired
-        supabase.table("loyalty_transactions").update({
-            "transaction_type": "expired",
-            "points": -transaction["points"]
-        }).eq("id", transaction["id"]).execute()
-        
-        # Update user's loyalty points
-        points_response = supabase.table("loyalty_points").select("*").eq(
-            "user_id", transaction["user_id"]
-        ).execute()
+    # Each chunk is one set-based RPC that empties the lots it expires, so
+    # an interrupted run resumes with whatever is still unexpired
+    deductions = {}
+    expired_count = 0
+    while True:
+        response = supabase.rpc("expire_loyalty_chunk", {
+            "p_now": now,
+            "p_limit": settings.LOYALTY_EXPIRY_CHUNK_SIZE
+        }).execute()
         
-        if points_response.data:
-            current_points = points_response.data[0]
-            supabase.table("loyalty_points").update({
-                "available_points": max(0, current_points["available_points"] - transaction["points"]),
-                "updated_at": datetime.utcnow().isoformat()
-            }).eq("id", current_points["id"]).execute()
+        entries = 0
+        for row in response.data:
+            deductions[row["user_id"]] = deductions.get(row["user_id"], 0) + row["expired_points"]
+            entries += row["entries"]
+        expired_count += entries
+        if entries < settings.LOYALTY_EXPIRY_CHUNK_SIZE:
+            break
+    
+    duration = round(time.monotonic() - started, 3)
+    logger.info("Expired %d loyalty entries for %d users in %.3fs", expired_count, len(deductions), duration)
+    
+    return {
+        "success": True,
+        "expired_count": expired_count,
+        "users_affected": len(deductions),
+        "points_expired": sum(deductions.values()),
+        "duration_seconds": duration
+    }
+
+
+@celery_app.task(name="update_vehicle_utilization")
+def update_vehicle_utilization():
+    """Fold bookings changed since the last run into vehicle_utilization"""
+    supabase = get_supabase_admin()
     
-    return {"success": True, "expired_count": len(expired_transactions.data)}
+    result = run_utilization_job(supabase)
+    
+    return {"success": True, **result}
+
+
+@celery_app.task(name="expire_pending_bookings")
+def expire_pending_bookings():
+    """Cancel pending bookings that were never paid"""
+    supabase = get_supabase_admin()
+    started = time.monotonic()
+    cutoff = (datetime.utcnow() - timedelta(minutes=settings.PENDING_BOOKING_EXPIRY_MINUTES)).isoformat()
+    # Pending payments younger than this may still be confirmed by the client
+    payment_cutoff = (datetime.utcnow() - timedelta(minutes=settings.PAYMENT_INTENT_TTL_MINUTES)).isoformat()
+    
+    # One UPDATE ... RETURNING per chunk; the outbox trigger emits booking.cancelled per row
+    expired_count = 0
+    stale_intents = []
+    while True:
+        response = supabase.rpc("expire_pending_bookings", {
+            "p_cutoff": cutoff,
+            "p_limit": settings.BOOKING_EXPIRY_CHUNK_SIZE,
+            "p_payment_cutoff": payment_cutoff
+        }).execute()
+        expired_count += len(response.data)
+        for row in response.data:
+            stale_intents += row.get("pending_intents") or []
+        if len(response.data) < settings.BOOKING_EXPIRY_CHUNK_SIZE:
+            break
+    
+    # A cancelled intent can no longer succeed against the cancelled booking
+    cancelled_intents = 0
+    for intent_id in stale_intents:
+        try:
+            stripe_service.client.payment_intents.cancel(intent_id)
+            cancelled_intents += 1
+        except stripe.StripeError as e:
+            logger.warning("Could not cancel payment intent %s: %s", intent_id, e)
+    
+    duration = round(time.monotonic() - started, 3)
+    logger.info("Expired %d pending bookings in %.3fs", expired_count, duration)
+    
+    return {
+        "success": True,
+        "expired_count": expired_count,
+        "cancelled_intents": cancelled_intents,
+        "duration_seconds": duration
+    }
+
+
+@celery_app.task(name="reconcile_stripe_payments")
+def reconcile_stripe_payments():
+    """Fix payments whose status drifted from Stripe (e.g. lost webhooks)"""
+    supabase = get_supabase_admin()
+    started = time.monotonic()
+    
+    result = run_reconciliation(
+        supabase,
+        stripe_service.client,
+        lookback_hours=settings.STRIPE_RECONCILE_LOOKBACK_HOURS
+    )
+    
+    duration = round(time.monotonic() - started, 3)
+    logger.info("Reconciled %d payment intents, fixed %d, in %.3fs", result["scanned"], result["fixed"], duration)
+    
+    return {"success": True, **result, "duration_seconds": duration}
+
+
+@celery_app.task(name="purge_idempotency_keys")
+def purge_idempotency_keys():
+    """Delete stored Idempotency-Key responses past their retention"""
+    supabase = get_supabase_admin()
+    
+    response = supabase.table("idempotency_keys").delete().lt(
+        "expires_at", datetime.utcnow().isoformat()
+    ).execute()
+    
+    return {"success": True, "purged_count": len(response.data)}
+
+
+@celery_app.task(name="purge_outbox_events")
+def purge_outbox_events():
+    """Delete outbox events processed longer than OUTBOX_RETENTION_DAYS ago"""
+    supabase = get_supabase_admin()
+    before = (datetime.utcnow() - timedelta(days=settings.OUTBOX_RETENTION_DAYS)).isoformat()
+    
+    purged_count = 0
+    while True:
+        purged = supabase.rpc("purge_outbox_events", {
+            "p_before": before,
+            "p_limit": settings.OUTBOX_PURGE_CHUNK_SIZE
+        }).execute().data
+        purged_count += purged
+        if purged < settings.OUTBOX_PURGE_CHUNK_SIZE:
+            break
+    
+    return {"success": True, "purged_count": purged_count}
+
+
+@celery_app.task(name="render_missing_contract_pdfs")
+def render_missing_contract_pdfs():
+    """Render contract PDFs whose background render never finished (e.g. API restart)"""
+    supabase = get_supabase_admin()
+    started = time.monotonic()
+    
+    # Renders scheduled by the API normally finish within seconds. Failed
+    # contracts wait for pdf_retry_at and go after untried ones
+    now = datetime.utcnow()
+    cutoff = (now - timedelta(minutes=5)).isoformat()
+    
+    def missing(query, since_column: str):
+        return query.lt(since_column, cutoff).lt("pdf_attempts", settings.CONTRACT_PDF_MAX_ATTEMPTS).or_(
+            f'pdf_retry_at.is.null,pdf_retry_at.lt."{now.isoformat()}"'
+        ).order("pdf_attempts").order(since_column).limit(50).execute().data
+    
+    drafts = missing(
+        supabase.table("contracts").select("id, pdf_attempts").is_("pdf_url", "null"),
+        "created_at"
+    )
+    # Signing sets updated_at and schedules the signed render
+    signed = missing(
+        supabase.table("contracts").select("id, pdf_attempts").eq("status", "signed").is_("signed_pdf_url", "null"),
+        "updated_at"
+    )
+    
+    rendered = failed = 0
+    failed_ids = set()
+    for row, is_signed in [(row, False) for row in drafts] + [(row, True) for row in signed]:
+        if row["id"] in failed_ids:
+            continue  # Its draft render failed in this run
+        try:
+            if render_and_store_inline(supabase, row["id"], signed=is_signed):
+                rendered += 1
+        except Exception:
+            logger.exception("Rendering contract %s failed", row["id"])
+            record_render_failure(supabase, row["id"], row["pdf_attempts"] + 1)
+            failed_ids.add(row["id"])
+            failed += 1
+    
+    duration = round(time.monotonic() - started, 3)
+    logger.info("Rendered %d missing contract PDFs (%d failed) in %.3fs", rendered, failed, duration)
+    
+    return {"success": True, "rendered_count": rendered, "failed_count": failed, "duration_seconds": duration}
+
+
+@celery_app.task(name="sweep_abandoned_uploads")
+def sweep_abandoned_uploads():
+    """Delete direct uploads whose signed URL expired without /uploads/complete"""
+    supabase = get_supabase_admin()
+    
+    # Give clients an hour past the URL's expiry to finish the upload and call /complete
+    cutoff = (datetime.utcnow() - SIGNED_UPLOAD_TTL - timedelta(hours=1)).isoformat()
+    response = supabase.table("pending_uploads").select("bucket, path").lt(
+        "created_at", cutoff
+    ).order("created_at").limit(500).execute()
+    
+    paths_by_bucket = {}
+    for row in response.data:
+        paths_by_bucket.setdefault(row["bucket"], []).append(row["path"])
+    
+    swept = 0
+    for bucket, paths in paths_by_bucket.items():
+        try:
+            # Paths that were never written are ignored by storage
+            supabase.storage.from_(bucket).remove(paths)
+        except Exception:
+            logger.exception("Removing %d abandoned uploads from %s failed", len(paths), bucket)
+            continue
+        supabase.table("pending_uploads").delete().eq("bucket", bucket).in_("path", paths).execute()
+        swept += len(paths)
+    
+    logger.info("Swept %d abandoned uploads", swept)
+    
+    return {"success": True, "swept_count": swept}
 
 
 # Periodic tasks (configure in celerybeat)
@@ -187,5 +382,33 @@ celery_app.conf.beat_schedule = {
         "task": "expire_loyalty_points",
         "schedule": crontab(hour=0, minute=0),  # Daily at midnight
     },
+    "update-vehicle-utilization": {
+        "task": "update_vehicle_utilization",
+        "schedule": crontab(minute="*/10"),  # Every 10 minutes
+    },
+    "expire-pending-bookings": {
+        "task": "expire_pending_bookings",
+        "schedule": crontab(minute="*/5"),  # Every 5 minutes
+    },
+    "reconcile-stripe-payments": {
+        "task": "reconcile_stripe_payments",
+        "schedule": crontab(minute=30),  # Hourly
+    },
+    "render-missing-contract-pdfs": {
+        "task": "render_missing_contract_pdfs",
+        "schedule": crontab(minute="*/10"),  # Every 10 minutes
+    },
+    "sweep-abandoned-uploads": {
+        "task": "sweep_abandoned_uploads",
+        "schedule": crontab(minute=45),  # Hourly
+    },
+    "purge-idempotency-keys": {
+        "task": "purge_idempotency_keys",
+        "schedule": crontab(hour=3, minute=0),  # Daily at 03:00
+    },
+    "purge-outbox-events": {
+        "task": "purge_outbox_events",
+        "schedule": crontab(hour=3, minute=30),  # Daily at 03:30
+    },
 }
 
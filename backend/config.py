@@ -1,5 +1,5 @@
 from pydantic_settings import BaseSettings
-from typing import List
+from typing import Dict, List
 
 
 class Settings(BaseSettings):
@@ -17,6 +17,11 @@ class Settings(BaseSettings):
     STRIPE_SECRET_KEY: str = ""
     STRIPE_PUBLISHABLE_KEY: str = ""
     STRIPE_WEBHOOK_SECRET: str = ""
+    STRIPE_TIMEOUT_SECONDS: float = 15.0
+    STRIPE_MAX_RETRIES: int = 2  # Network/5xx retries, exponential backoff with jitter
+    STRIPE_MAX_CONCURRENCY: int = 20  # In-flight Stripe calls per worker
+    STRIPE_API_BASE: str = ""  # Override for a local stand-in, e.g. http://localhost:12111 (stripe-mock)
+    STRIPE_RECONCILE_LOOKBACK_HOURS: int = 72
     
     # OAuth
     GOOGLE_CLIENT_ID: str = ""
@@ -40,6 +45,84 @@ class Settings(BaseSettings):
     # Platform Fee
     PLATFORM_FEE_PERCENTAGE: float = 10.0
     
+    # Surge Pricing
+    # Curves are "occupancy:multiplier" points, interpolated linearly
+    SURGE_ENABLED: bool = True
+    SURGE_CURVE: str = "0.0:1.0,0.5:1.0,0.8:1.2,1.0:1.5"
+    SURGE_CATEGORY_CURVES: Dict[str, str] = {}  # e.g. {"luxury": "0.0:1.0,0.7:1.8"}
+    SURGE_WINDOW_HOURS: int = 72
+    
+    # Price Quotes
+    QUOTE_TTL_MINUTES: int = 10
+    QUOTE_CACHE_SIZE: int = 10000
+    
+    # Checkout holds (vehicle interval reserved from quote until payment)
+    HOLD_TTL_MINUTES: int = 15
+    HOLDS_PER_USER_MAX: int = 3  # Vehicles one customer can hold from quotes at once
+    
+    # Unpaid pending bookings are cancelled after this long
+    PENDING_BOOKING_EXPIRY_MINUTES: int = 60
+    PAYMENT_INTENT_TTL_MINUTES: int = 30  # A pending payment this young keeps its booking
+    BOOKING_EXPIRY_CHUNK_SIZE: int = 500
+    
+    # Availability cache (public availability endpoint)
+    AVAILABILITY_CACHE_TTL_SECONDS: int = 30
+    AVAILABILITY_CACHE_SIZE: int = 10000
+    
+    # Outbox dispatcher (booking/payment lifecycle events)
+    OUTBOX_DISPATCHER_ENABLED: bool = True
+    OUTBOX_BATCH_SIZE: int = 100
+    OUTBOX_POLL_INTERVAL_SECONDS: float = 2.0
+    OUTBOX_LEASE_SECONDS: int = 60
+    OUTBOX_MAX_ATTEMPTS: int = 10
+    OUTBOX_CELERY_TASKS: Dict[str, str] = {}  # event_type -> Celery task name
+    OUTBOX_BROADCAST_ENABLED: bool = True  # Per-process tail for in-memory caches
+    OUTBOX_BROADCAST_INTERVAL_SECONDS: float = 1.0
+    OUTBOX_BROADCAST_GAP_SECONDS: int = 60  # How long a skipped id is re-read
+    OUTBOX_RETENTION_DAYS: int = 7  # Processed events older than this are purged
+    OUTBOX_PURGE_CHUNK_SIZE: int = 10000
+    
+    # Stripe webhook inbox consumer (shares the outbox poll/lease settings)
+    STRIPE_EVENTS_CONSUMER_ENABLED: bool = True
+    STRIPE_EVENTS_BATCH_SIZE: int = 100
+    
+    # Loyalty
+    LOYALTY_POINTS_PER_AED: float = 1.0
+    LOYALTY_EXPIRY_CHUNK_SIZE: int = 1000
+    LOYALTY_TIERS: str = "bronze:0,silver:1000,gold:5000,platinum:20000"  # name:min lifetime points
+    LEADERBOARD_REFRESH_SECONDS: float = 600.0  # Safety-net resync; changes arrive through the outbox
+    
+    # Contract PDFs
+    CONTRACT_PDF_WORKERS: int = 2  # Rendering processes per API worker
+    CONTRACT_FONT_DIR: str = ""  # Defaults to the bundled Lato fonts (app/assets/fonts)
+    CONTRACT_PDF_MAX_ATTEMPTS: int = 5  # Background re-renders before a contract is given up on
+    CONTRACT_PDF_RETRY_MINUTES: int = 10  # Wait after the first failure, doubled after each one
+    SIGNATURE_CACHE_DIR: str = ""  # Local copies of signature images (defaults to the temp dir)
+    SIGNATURE_CACHE_MAX_FILES: int = 1000
+    SIGNATURE_MAX_BYTES: int = 2 * 1024 * 1024
+    
+    # Streaming uploads (KYC documents and signatures)
+    UPLOAD_MAX_BYTES: int = 15 * 1024 * 1024
+    UPLOAD_CHUNK_BYTES: int = 1024 * 1024
+    UPLOAD_IMAGE_MAX_DIMENSION: int = 2048  # Longest side kept for uploaded photos
+    UPLOAD_IMAGE_QUALITY: int = 85  # JPEG/WebP re-encode quality
+    UPLOAD_IMAGE_WORKERS: int = 2  # Processes used for re-encoding
+    UPLOAD_TIMEOUT_SECONDS: float = 60.0
+    
+    # KYC review queue
+    KYC_CLAIM_LEASE_MINUTES: int = 30  # Claimed applications return to the queue after this
+    
+    # Signed download URLs for private files (KYC documents)
+    SIGNED_URL_TTL_SECONDS: int = 3600
+    SIGNED_URL_REFRESH_SECONDS: int = 300  # Re-sign when less than this is left
+    SIGNED_URL_CACHE_SIZE: int = 10000
+    
+    # Idempotency-Key handling (POST /bookings, POST /payments/intent)
+    IDEMPOTENCY_TTL_HOURS: int = 24
+    IDEMPOTENCY_CACHE_SIZE: int = 10000
+    IDEMPOTENCY_LOCK_SECONDS: int = 60  # How long a crashed request holds its key
+    IDEMPOTENCY_WAIT_SECONDS: float = 10.0  # How long a duplicate waits for the first
+    
     @property
     def cors_origins_list(self) -> List[str]:
         return [origin.strip() for origin in self.CORS_ORIGINS.split(",")]
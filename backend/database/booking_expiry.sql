@@ -0,0 +1,50 @@
+-- Stale Pending Booking Expiry
+-- Run after outbox.sql. Used by the `expire_pending_bookings` Celery task:
+-- pending bookings that were never paid are cancelled in set-based chunks.
+-- The bookings_outbox trigger emits a 'booking.cancelled' event for every
+-- row, so caches, holds and rollups follow without extra work here.
+-- A pending payment younger than p_payment_cutoff (the client may still be
+-- confirming it) also protects its booking. Older pending intents of the
+-- bookings that do expire are returned so the task can cancel them at Stripe.
+
+CREATE INDEX IF NOT EXISTS idx_bookings_pending_created ON bookings(created_at) WHERE status = 'pending';
+
+DROP FUNCTION IF EXISTS public.expire_pending_bookings(TIMESTAMPTZ, INTEGER);
+
+CREATE OR REPLACE FUNCTION public.expire_pending_bookings(
+  p_cutoff TIMESTAMPTZ,
+  p_limit INTEGER,
+  p_payment_cutoff TIMESTAMPTZ
+)
+RETURNS TABLE (id UUID, vehicle_id UUID, customer_id UUID, pending_intents TEXT[]) AS $$
+BEGIN
+  RETURN QUERY
+  WITH stale AS (
+    SELECT b.id
+    FROM public.bookings b
+    WHERE b.status = 'pending'
+      AND b.created_at < p_cutoff
+      -- Leave bookings whose payment is in flight, being confirmed or captured
+      AND NOT EXISTS (
+        SELECT 1 FROM public.payments p
+        WHERE p.booking_id = b.id
+          AND (p.status IN ('processing', 'completed')
+            OR (p.status = 'pending' AND p.created_at >= p_payment_cutoff))
+      )
+    ORDER BY b.created_at
+    LIMIT p_limit
+    FOR UPDATE SKIP LOCKED
+  )
+  UPDATE public.bookings b
+  SET status = 'cancelled', updated_at = NOW()
+  FROM stale
+  WHERE b.id = stale.id AND b.status = 'pending'
+  RETURNING b.id, b.vehicle_id, b.customer_id, ARRAY(
+    SELECT p.stripe_payment_intent_id FROM public.payments p
+    WHERE p.booking_id = b.id AND p.status = 'pending' AND p.stripe_payment_intent_id IS NOT NULL
+  );
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER;
+
+-- Only the expire_pending_bookings Celery task (service role) may cancel bookings
+REVOKE EXECUTE ON FUNCTION public.expire_pending_bookings(TIMESTAMPTZ, INTEGER, TIMESTAMPTZ) FROM PUBLIC, anon, authenticated;
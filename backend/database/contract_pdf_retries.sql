@@ -0,0 +1,14 @@
+-- Contract PDF Retries
+-- Run after contract_signing.sql. The render_missing_contract_pdfs Celery task
+-- counts failed renders (draft or signed PDF) per contract and pushes the next
+-- attempt back exponentially (pdf_retry_at); contracts are given up on after
+-- CONTRACT_PDF_MAX_ATTEMPTS. Untried contracts are picked before ones that
+-- failed, so a contract that always fails cannot starve newer ones. A
+-- successful render resets both.
+
+ALTER TABLE contracts ADD COLUMN IF NOT EXISTS pdf_attempts INTEGER NOT NULL DEFAULT 0;
+ALTER TABLE contracts ADD COLUMN IF NOT EXISTS pdf_retry_at TIMESTAMPTZ;
+
+CREATE INDEX IF NOT EXISTS idx_contracts_missing_pdf ON contracts(pdf_attempts, created_at) WHERE pdf_url IS NULL;
+CREATE INDEX IF NOT EXISTS idx_contracts_missing_signed_pdf ON contracts(pdf_attempts, updated_at)
+  WHERE status = 'signed' AND signed_pdf_url IS NULL;
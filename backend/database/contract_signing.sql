@@ -0,0 +1,40 @@
+-- Signed Contract PDFs
+-- Run after schema.sql. Once both parties have signed, the API re-renders the
+-- contract with their signature images and stores it next to the draft PDF.
+-- signed_pdf_sha256 is the SHA-256 of the stored file, so a downloaded copy
+-- can be checked against what was signed.
+--
+-- POST /contracts/{id}/sign records a signature with sign_contract_party(),
+-- which decides in the same UPDATE whether both parties have now signed, so
+-- two parties signing at once still end with status 'signed'. Only draft
+-- contracts can be signed; once signed, the signatures are final.
+
+ALTER TABLE contracts ADD COLUMN IF NOT EXISTS signed_pdf_url TEXT;
+ALTER TABLE contracts ADD COLUMN IF NOT EXISTS signed_pdf_sha256 TEXT;
+ALTER TABLE contracts ADD COLUMN IF NOT EXISTS signed_pdf_at TIMESTAMPTZ;
+
+-- Record one party's signature ('customer' or 'agency'). Returns the updated
+-- contract, or no row if it is no longer a draft. A concurrent signer's
+-- UPDATE waits for the row lock and then sees this signature.
+CREATE OR REPLACE FUNCTION public.sign_contract_party(p_contract_id UUID, p_party TEXT, p_signature_path TEXT)
+RETURNS SETOF public.contracts AS $$
+  UPDATE public.contracts c
+  SET customer_signature_url = CASE WHEN p_party = 'customer' THEN p_signature_path ELSE c.customer_signature_url END,
+      customer_signed_at = CASE WHEN p_party = 'customer' THEN NOW() ELSE c.customer_signed_at END,
+      agency_signature_url = CASE WHEN p_party = 'agency' THEN p_signature_path ELSE c.agency_signature_url END,
+      agency_signed_at = CASE WHEN p_party = 'agency' THEN NOW() ELSE c.agency_signed_at END,
+      status = CASE
+        WHEN (p_party = 'customer' AND c.agency_signature_url IS NOT NULL)
+          OR (p_party = 'agency' AND c.customer_signature_url IS NOT NULL)
+        THEN 'signed'
+        ELSE c.status
+      END,
+      updated_at = NOW()
+  WHERE c.id = p_contract_id
+    AND c.status = 'draft'
+    AND p_party IN ('customer', 'agency')
+  RETURNING c.*;
+$$ LANGUAGE sql SECURITY DEFINER;
+
+-- Parties are authorised by the API, which calls this with the service role
+REVOKE EXECUTE ON FUNCTION public.sign_contract_party(UUID, TEXT, TEXT) FROM PUBLIC, anon, authenticated;
@@ -0,0 +1,39 @@
+-- KYC Review Queue
+-- Run after schema.sql. GET /kyc/queue pages through applications that are
+-- under review, oldest first, with keyset pagination on (updated_at, id).
+-- POST /kyc/queue/claim leases a batch to one reviewer with claim_kyc_reviews();
+-- SKIP LOCKED means parallel reviewers never block on or receive the same rows.
+-- A lease that is not acted on expires and the application is claimable again.
+
+ALTER TABLE kyc ADD COLUMN IF NOT EXISTS claimed_by UUID REFERENCES users(id);
+ALTER TABLE kyc ADD COLUMN IF NOT EXISTS claimed_at TIMESTAMPTZ;
+
+CREATE INDEX IF NOT EXISTS idx_kyc_review_queue ON kyc(updated_at, id) WHERE status = 'under_review';
+
+-- Lease up to p_limit applications to a reviewer (their own live leases are
+-- renewed and count towards the limit). updated_at is left alone so the
+-- queue order does not change.
+CREATE OR REPLACE FUNCTION public.claim_kyc_reviews(
+  p_reviewer UUID,
+  p_limit INTEGER DEFAULT 5,
+  p_lease_seconds INTEGER DEFAULT 1800
+)
+RETURNS SETOF public.kyc AS $$
+  UPDATE public.kyc
+  SET claimed_by = p_reviewer,
+      claimed_at = NOW()
+  WHERE id IN (
+    SELECT id FROM public.kyc
+    WHERE status = 'under_review'
+      AND (claimed_by IS NULL
+        OR claimed_by = p_reviewer
+        OR claimed_at < NOW() - make_interval(secs => p_lease_seconds))
+    ORDER BY updated_at, id
+    LIMIT p_limit
+    FOR UPDATE SKIP LOCKED
+  )
+  RETURNING *;
+$$ LANGUAGE sql SECURITY DEFINER;
+
+-- Reviewers are authorised by the API, which calls this with the service role
+REVOKE EXECUTE ON FUNCTION public.claim_kyc_reviews(UUID, INTEGER, INTEGER) FROM PUBLIC, anon, authenticated;
@@ -0,0 +1,64 @@
+-- Set-based Loyalty Point Expiry
+-- Run after loyalty_ledger.sql.
+-- The `expire_loyalty_points` Celery task calls expire_loyalty_chunk() until
+-- it returns fewer lots than the chunk size. Only what is left in a lot
+-- expires (partly redeemed lots lose just their remainder), and each user
+-- gets one 'expired' ledger entry per chunk.
+
+-- Expire one chunk atomically: empty the due lots and deduct per user. The
+-- lots themselves are the checkpoint: an emptied lot is never due again, so
+-- a crashed run simply resumes with the lots that are still live.
+-- Returns one row per user with the points deducted and lots expired.
+DROP FUNCTION IF EXISTS public.expire_loyalty_chunk(TIMESTAMPTZ, INTEGER, TEXT);
+
+CREATE OR REPLACE FUNCTION public.expire_loyalty_chunk(p_now TIMESTAMPTZ, p_limit INTEGER)
+RETURNS TABLE (user_id UUID, expired_points INTEGER, entries INTEGER) AS $$
+  WITH due AS (
+    SELECT l.id, l.remaining
+    FROM public.loyalty_lots l
+    WHERE l.remaining > 0
+      AND l.expires_at <= p_now
+    ORDER BY l.expires_at, l.id
+    LIMIT p_limit
+    FOR UPDATE SKIP LOCKED
+  ),
+  emptied AS (
+    UPDATE public.loyalty_lots l
+    SET remaining = 0
+    FROM due
+    WHERE l.id = due.id
+    RETURNING l.id, l.user_id, due.remaining AS points
+  ),
+  per_user AS (
+    SELECT e.user_id, SUM(e.points)::INTEGER AS points, COUNT(*)::INTEGER AS entries
+    FROM emptied e
+    GROUP BY e.user_id
+  ),
+  -- Never deduct more than is still available
+  balances AS (
+    SELECT lp.user_id, LEAST(pu.points, lp.available_points) AS deduct, pu.entries
+    FROM public.loyalty_points lp
+    JOIN per_user pu ON pu.user_id = lp.user_id
+    FOR UPDATE OF lp
+  ),
+  deducted AS (
+    UPDATE public.loyalty_points lp
+    SET available_points = lp.available_points - b.deduct,
+        updated_at = NOW()
+    FROM balances b
+    WHERE lp.user_id = b.user_id
+    RETURNING b.user_id, b.deduct, b.entries
+  ),
+  ledger AS (
+    INSERT INTO public.loyalty_transactions (user_id, transaction_type, points, description)
+    SELECT d.user_id, 'expired', -d.deduct, 'Expired points from ' || d.entries || ' lots'
+    FROM deducted d
+    WHERE d.deduct > 0
+  )
+  SELECT pu.user_id, COALESCE(d.deduct, 0), pu.entries
+  FROM per_user pu
+  LEFT JOIN deducted d ON d.user_id = pu.user_id;
+$$ LANGUAGE sql SECURITY DEFINER;
+
+-- Only the expire_loyalty_points Celery task (service role) may expire points
+REVOKE EXECUTE ON FUNCTION public.expire_loyalty_chunk(TIMESTAMPTZ, INTEGER) FROM PUBLIC, anon, authenticated;
@@ -0,0 +1,35 @@
+-- Loyalty Tiers and Leaderboard
+-- Run after outbox.sql. The API keeps ranks in memory (app/leaderboard.py).
+-- Every lifetime_points change writes a 'loyalty.lifetime_points' outbox
+-- event, which each API process applies to its index; the periodic resync
+-- only re-reads loyalty_points rows whose updated_at moved since its last
+-- sync, which this index serves.
+
+CREATE INDEX IF NOT EXISTS idx_loyalty_points_updated ON loyalty_points(updated_at, user_id);
+
+ALTER TABLE outbox DROP CONSTRAINT IF EXISTS outbox_aggregate_type_check;
+ALTER TABLE outbox ADD CONSTRAINT outbox_aggregate_type_check
+  CHECK (aggregate_type IN ('booking', 'payment', 'loyalty'));
+
+CREATE OR REPLACE FUNCTION public.loyalty_points_outbox_event()
+RETURNS TRIGGER AS $$
+BEGIN
+  IF TG_OP = 'UPDATE' AND NEW.lifetime_points IS NOT DISTINCT FROM OLD.lifetime_points THEN
+    RETURN NULL;
+  END IF;
+
+  INSERT INTO public.outbox (aggregate_type, aggregate_id, event_type, payload)
+  VALUES (
+    'loyalty',
+    NEW.user_id,
+    'loyalty.lifetime_points',
+    jsonb_build_object('user_id', NEW.user_id, 'lifetime_points', NEW.lifetime_points)
+  );
+
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER;
+
+CREATE OR REPLACE TRIGGER loyalty_points_outbox
+  AFTER INSERT OR UPDATE OF lifetime_points ON public.loyalty_points
+  FOR EACH ROW EXECUTE FUNCTION public.loyalty_points_outbox_event();
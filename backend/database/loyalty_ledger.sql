@@ -0,0 +1,219 @@
+-- Loyalty Ledger
+-- Run after schema.sql. loyalty_transactions is an append-only ledger and
+-- loyalty_points its running balance. Every balance change goes through
+-- loyalty_post(), which writes the ledger row and increments the balance
+-- in the same transaction, so concurrent earns/redemptions never lose updates.
+--
+-- Points are held in lots: every positive entry opens a lot with its own
+-- expiry and negative entries consume the oldest-expiring live lots first,
+-- so available_points always equals the sum of remaining lot points.
+-- loyalty_lot_usage records which lots each entry consumed, so returned
+-- points go back into those lots and keep their original expiry.
+
+-- The old POST /loyalty/earn could credit a booking more than once. Keep the
+-- first 'earned' row per booking, take the duplicates' points back out of the
+-- balance and drop them, so the unique index below can be built. Safe to
+-- re-run: once the index exists there is nothing left to remove.
+WITH duplicates AS (
+  DELETE FROM loyalty_transactions t
+  USING (
+    SELECT id, ROW_NUMBER() OVER (PARTITION BY booking_id ORDER BY created_at, id) AS n
+    FROM loyalty_transactions
+    WHERE transaction_type = 'earned' AND booking_id IS NOT NULL
+  ) ranked
+  WHERE t.id = ranked.id AND ranked.n > 1
+  RETURNING t.user_id, t.points
+),
+per_user AS (
+  SELECT user_id, SUM(points)::INTEGER AS points FROM duplicates GROUP BY user_id
+)
+UPDATE loyalty_points lp
+SET total_points = GREATEST(lp.total_points - pu.points, 0),
+    available_points = GREATEST(lp.available_points - pu.points, 0),
+    lifetime_points = GREATEST(lp.lifetime_points - pu.points, 0),
+    updated_at = NOW()
+FROM per_user pu
+WHERE lp.user_id = pu.user_id;
+
+-- Earning is idempotent per booking (the outbox delivers at least once)
+CREATE UNIQUE INDEX IF NOT EXISTS idx_loyalty_earned_booking
+  ON loyalty_transactions(booking_id) WHERE transaction_type = 'earned';
+
+CREATE TABLE IF NOT EXISTS loyalty_lots (
+    id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+    user_id UUID NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    transaction_id UUID REFERENCES loyalty_transactions(id),
+    points INTEGER NOT NULL,
+    remaining INTEGER NOT NULL CHECK (remaining >= 0),
+    expires_at TIMESTAMPTZ,  -- NULL never expires
+    created_at TIMESTAMPTZ DEFAULT NOW()
+);
+
+-- Expiry only touches live lots; FIFO consumption and "next expiry" are per user
+CREATE INDEX IF NOT EXISTS idx_loyalty_lots_live ON loyalty_lots(expires_at) WHERE remaining > 0;
+CREATE INDEX IF NOT EXISTS idx_loyalty_lots_user_live ON loyalty_lots(user_id, expires_at) WHERE remaining > 0;
+
+CREATE TABLE IF NOT EXISTS loyalty_lot_usage (
+    transaction_id UUID NOT NULL REFERENCES loyalty_transactions(id),
+    lot_id UUID NOT NULL REFERENCES loyalty_lots(id) ON DELETE CASCADE,
+    points INTEGER NOT NULL,
+    PRIMARY KEY (transaction_id, lot_id)
+);
+
+-- Points a user can spend right now: lots past expiry no longer count, even
+-- before the expiry job has removed them from available_points
+CREATE OR REPLACE FUNCTION public.live_loyalty_points(p_user_id UUID)
+RETURNS INTEGER AS $$
+  SELECT COALESCE(SUM(remaining), 0)::INTEGER
+  FROM public.loyalty_lots
+  WHERE user_id = p_user_id
+    AND remaining > 0
+    AND (expires_at IS NULL OR expires_at > NOW());
+$$ LANGUAGE sql STABLE;
+
+-- Consume points from a user's oldest-expiring live lots (caller holds the
+-- user's loyalty_points row lock, which serializes consumption per user) and
+-- record which lots the transaction used.
+-- Lots that are already past expiry are left for the expiry job.
+DROP FUNCTION IF EXISTS public.consume_loyalty_lots(UUID, INTEGER);
+
+CREATE OR REPLACE FUNCTION public.consume_loyalty_lots(p_user_id UUID, p_points INTEGER, p_transaction_id UUID)
+RETURNS VOID AS $$
+  WITH consumed AS (
+    UPDATE public.loyalty_lots l
+    SET remaining = l.remaining - LEAST(l.remaining, p_points - (c.running - c.remaining))
+    FROM (
+      SELECT id, remaining,
+        SUM(remaining) OVER (ORDER BY expires_at NULLS LAST, created_at, id) AS running
+      FROM public.loyalty_lots
+      WHERE user_id = p_user_id
+        AND remaining > 0
+        AND (expires_at IS NULL OR expires_at > NOW())
+    ) c
+    WHERE l.id = c.id AND c.running - c.remaining < p_points
+    RETURNING l.id, LEAST(c.remaining, p_points - (c.running - c.remaining)) AS points
+  )
+  INSERT INTO public.loyalty_lot_usage (transaction_id, lot_id, points)
+  SELECT p_transaction_id, consumed.id, consumed.points FROM consumed;
+$$ LANGUAGE sql;
+
+-- Put up to p_points back into the lots a transaction consumed (latest
+-- expiring first). Lots that expired meanwhile are picked up by the expiry
+-- job. Returns the number of points restored.
+CREATE OR REPLACE FUNCTION public.restore_loyalty_lots(p_transaction_id UUID, p_points INTEGER)
+RETURNS INTEGER AS $$
+  WITH restored AS (
+    UPDATE public.loyalty_lots l
+    SET remaining = l.remaining + LEAST(u.points, p_points - (u.running - u.points))
+    FROM (
+      SELECT lu.lot_id, lu.points,
+        SUM(lu.points) OVER (ORDER BY lot.expires_at DESC NULLS FIRST, lot.id) AS running
+      FROM public.loyalty_lot_usage lu
+      JOIN public.loyalty_lots lot ON lot.id = lu.lot_id
+      WHERE lu.transaction_id = p_transaction_id
+    ) u
+    WHERE l.id = u.lot_id AND u.running - u.points < p_points
+    RETURNING LEAST(u.points, p_points - (u.running - u.points)) AS points
+  )
+  SELECT COALESCE(SUM(points), 0)::INTEGER FROM restored;
+$$ LANGUAGE sql;
+
+-- Post one ledger entry. Negative points require enough live (unexpired)
+-- points. A positive entry with p_restore_from returns points to the lots
+-- that transaction consumed instead of opening a new lot.
+-- Returns the new transaction merged with the resulting balance, or NULL if
+-- the booking already earned its points.
+DROP FUNCTION IF EXISTS public.loyalty_post(UUID, TEXT, INTEGER, UUID, TEXT, TIMESTAMPTZ);
+
+CREATE OR REPLACE FUNCTION public.loyalty_post(
+  p_user_id UUID,
+  p_type TEXT,
+  p_points INTEGER,
+  p_booking_id UUID DEFAULT NULL,
+  p_description TEXT DEFAULT NULL,
+  p_expires_at TIMESTAMPTZ DEFAULT NULL,
+  p_restore_from UUID DEFAULT NULL
+)
+RETURNS JSONB AS $$
+DECLARE
+  txn public.loyalty_transactions;
+  balance public.loyalty_points;
+  earned INTEGER := CASE WHEN p_type = 'earned' THEN p_points ELSE 0 END;
+  unrestored INTEGER := p_points;
+BEGIN
+  INSERT INTO public.loyalty_transactions (user_id, booking_id, transaction_type, points, description, expires_at)
+  VALUES (p_user_id, p_booking_id, p_type, p_points, p_description, p_expires_at)
+  ON CONFLICT (booking_id) WHERE transaction_type = 'earned' DO NOTHING
+  RETURNING * INTO txn;
+  IF NOT FOUND THEN
+    RETURN NULL;
+  END IF;
+
+  IF p_points < 0 THEN
+    -- Lock the balance first so the live-lot check and the consumption agree
+    PERFORM 1 FROM public.loyalty_points WHERE user_id = p_user_id FOR UPDATE;
+    IF public.live_loyalty_points(p_user_id) < -p_points THEN
+      RAISE EXCEPTION 'insufficient_loyalty_points';
+    END IF;
+    UPDATE public.loyalty_points
+    SET available_points = available_points + p_points,
+        updated_at = NOW()
+    WHERE user_id = p_user_id AND available_points >= -p_points
+    RETURNING * INTO balance;
+    IF NOT FOUND THEN
+      RAISE EXCEPTION 'insufficient_loyalty_points';
+    END IF;
+    PERFORM public.consume_loyalty_lots(p_user_id, -p_points, txn.id);
+  ELSE
+    INSERT INTO public.loyalty_points (user_id, total_points, available_points, lifetime_points, updated_at)
+    VALUES (p_user_id, earned, p_points, earned, NOW())
+    ON CONFLICT (user_id) DO UPDATE
+    SET total_points = loyalty_points.total_points + earned,
+        available_points = loyalty_points.available_points + p_points,
+        lifetime_points = loyalty_points.lifetime_points + earned,
+        updated_at = NOW()
+    RETURNING * INTO balance;
+
+    IF p_points > 0 AND p_restore_from IS NOT NULL THEN
+      unrestored := p_points - public.restore_loyalty_lots(p_restore_from, p_points);
+    END IF;
+    IF unrestored > 0 THEN
+      INSERT INTO public.loyalty_lots (user_id, transaction_id, points, remaining, expires_at)
+      VALUES (p_user_id, txn.id, unrestored, unrestored, p_expires_at);
+    END IF;
+  END IF;
+
+  RETURN to_jsonb(txn) || jsonb_build_object('available_points', balance.available_points);
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER;
+
+REVOKE EXECUTE ON FUNCTION public.loyalty_post(UUID, TEXT, INTEGER, UUID, TEXT, TIMESTAMPTZ, UUID) FROM PUBLIC, anon, authenticated;
+-- The lot helpers are only called from loyalty_post and the payment triggers
+REVOKE EXECUTE ON FUNCTION public.live_loyalty_points(UUID) FROM PUBLIC, anon, authenticated;
+REVOKE EXECUTE ON FUNCTION public.consume_loyalty_lots(UUID, INTEGER, UUID) FROM PUBLIC, anon, authenticated;
+REVOKE EXECUTE ON FUNCTION public.restore_loyalty_lots(UUID, INTEGER) FROM PUBLIC, anon, authenticated;
+
+-- One-off: open lots for balances that existed before lots were introduced.
+-- Earlier redemptions are assumed to have used the oldest points, so the
+-- available balance is spread over the user's newest unexpired earn entries.
+CREATE OR REPLACE FUNCTION public.backfill_loyalty_lots()
+RETURNS VOID AS $$
+  INSERT INTO public.loyalty_lots (user_id, transaction_id, points, remaining, expires_at, created_at)
+  SELECT e.user_id, e.id, e.points,
+    GREATEST(LEAST(e.points, e.available_points - (e.newer_total - e.points)), 0),
+    e.expires_at, e.created_at
+  FROM (
+    SELECT t.id, t.user_id, t.points, t.expires_at, t.created_at, lp.available_points,
+      SUM(t.points) OVER (
+        PARTITION BY t.user_id ORDER BY t.expires_at DESC NULLS FIRST, t.created_at DESC, t.id DESC
+      ) AS newer_total
+    FROM public.loyalty_transactions t
+    JOIN public.loyalty_points lp ON lp.user_id = t.user_id
+    WHERE t.transaction_type = 'earned'
+      AND (t.expires_at IS NULL OR t.expires_at > NOW())
+      AND NOT EXISTS (SELECT 1 FROM public.loyalty_lots l WHERE l.transaction_id = t.id)
+  ) e
+  WHERE e.available_points - (e.newer_total - e.points) > 0;
+$$ LANGUAGE sql SECURITY DEFINER;
+
+REVOKE EXECUTE ON FUNCTION public.backfill_loyalty_lots() FROM PUBLIC, anon, authenticated;
@@ -0,0 +1,221 @@
+-- Organization Dashboard Rollups
+-- Run after outbox.sql. Daily and current-state aggregates per organization,
+-- maintained incrementally so GET /organizations/{id}/dashboard never scans
+-- bookings or payments.
+--
+-- Booking and payment figures are applied from outbox events (trigger on
+-- outbox INSERT, i.e. in the same transaction as the status change).
+-- Fleet size and review ratings come from their own triggers.
+
+CREATE TABLE IF NOT EXISTS organization_daily_stats (
+    organization_id UUID NOT NULL REFERENCES organizations(id),
+    day DATE NOT NULL,
+    revenue DECIMAL(12, 2) DEFAULT 0,
+    refunds DECIMAL(12, 2) DEFAULT 0,
+    booked_hours DECIMAL(12, 2) DEFAULT 0,
+    bookings_confirmed INTEGER DEFAULT 0,
+    bookings_cancelled INTEGER DEFAULT 0,
+    rating_sum DECIMAL(12, 2) DEFAULT 0,
+    rating_count INTEGER DEFAULT 0,
+    PRIMARY KEY (organization_id, day)
+);
+
+CREATE TABLE IF NOT EXISTS organization_stats (
+    organization_id UUID PRIMARY KEY REFERENCES organizations(id),
+    fleet_size INTEGER DEFAULT 0,
+    active_rentals INTEGER DEFAULT 0,
+    updated_at TIMESTAMPTZ DEFAULT NOW()
+);
+
+-- Add a delta to one daily counter column
+CREATE OR REPLACE FUNCTION public.bump_org_daily(p_org UUID, p_day DATE, p_column TEXT, p_delta NUMERIC)
+RETURNS VOID AS $$
+BEGIN
+  IF p_org IS NULL OR p_delta = 0 THEN
+    RETURN;
+  END IF;
+  EXECUTE format(
+    'INSERT INTO public.organization_daily_stats (organization_id, day, %1$I) VALUES ($1, $2, $3)
+     ON CONFLICT (organization_id, day) DO UPDATE
+     SET %1$I = organization_daily_stats.%1$I + EXCLUDED.%1$I',
+    p_column
+  ) USING p_org, p_day, p_delta;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Add a delta to one current-state counter column
+CREATE OR REPLACE FUNCTION public.bump_org_stat(p_org UUID, p_column TEXT, p_delta INTEGER)
+RETURNS VOID AS $$
+BEGIN
+  IF p_org IS NULL OR p_delta = 0 THEN
+    RETURN;
+  END IF;
+  EXECUTE format(
+    'INSERT INTO public.organization_stats (organization_id, %1$I, updated_at) VALUES ($1, GREATEST($2, 0), NOW())
+     ON CONFLICT (organization_id) DO UPDATE
+     SET %1$I = GREATEST(organization_stats.%1$I + $2, 0), updated_at = NOW()',
+    p_column
+  ) USING p_org, p_delta;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Spread a booking's hours over the days it covers (p_sign = 1 to add, -1 to remove)
+CREATE OR REPLACE FUNCTION public.add_org_booked_hours(p_org UUID, p_start TIMESTAMPTZ, p_end TIMESTAMPTZ, p_sign INTEGER)
+RETURNS VOID AS $$
+  INSERT INTO public.organization_daily_stats (organization_id, day, booked_hours)
+  SELECT
+    p_org,
+    d::date,
+    p_sign * EXTRACT(EPOCH FROM LEAST(p_end, d + INTERVAL '1 day') - GREATEST(p_start, d)) / 3600
+  FROM generate_series(date_trunc('day', p_start), p_end, INTERVAL '1 day') AS d
+  WHERE d < p_end
+  ON CONFLICT (organization_id, day) DO UPDATE
+  SET booked_hours = organization_daily_stats.booked_hours + EXCLUDED.booked_hours;
+$$ LANGUAGE sql;
+
+-- Only called from the triggers below
+REVOKE EXECUTE ON FUNCTION public.bump_org_daily(UUID, DATE, TEXT, NUMERIC) FROM PUBLIC, anon, authenticated;
+REVOKE EXECUTE ON FUNCTION public.bump_org_stat(UUID, TEXT, INTEGER) FROM PUBLIC, anon, authenticated;
+REVOKE EXECUTE ON FUNCTION public.add_org_booked_hours(UUID, TIMESTAMPTZ, TIMESTAMPTZ, INTEGER) FROM PUBLIC, anon, authenticated;
+
+-- Apply booking/payment outbox events to the rollups
+CREATE OR REPLACE FUNCTION public.apply_org_rollups()
+RETURNS TRIGGER AS $$
+DECLARE
+  b JSONB;
+  prev JSONB;
+  p JSONB;
+  org UUID;
+  counted TEXT[] := ARRAY['confirmed', 'in_progress', 'completed'];
+BEGIN
+  IF NEW.aggregate_type = 'booking' THEN
+    b := NEW.payload->'booking';
+    prev := NEW.payload->'previous';
+    org := (b->>'organization_id')::UUID;
+
+    -- Booked hours follow the booking while it is in a counted status
+    IF prev IS NOT NULL AND prev->>'status' = ANY(counted) THEN
+      PERFORM public.add_org_booked_hours(org, (prev->>'pickup_date')::TIMESTAMPTZ, (prev->>'return_date')::TIMESTAMPTZ, -1);
+    END IF;
+    IF b->>'status' = ANY(counted) THEN
+      PERFORM public.add_org_booked_hours(org, (b->>'pickup_date')::TIMESTAMPTZ, (b->>'return_date')::TIMESTAMPTZ, 1);
+    END IF;
+
+    IF NEW.event_type = 'booking.confirmed' THEN
+      PERFORM public.bump_org_daily(org, NEW.created_at::DATE, 'bookings_confirmed', 1);
+    ELSIF NEW.event_type = 'booking.cancelled' THEN
+      PERFORM public.bump_org_daily(org, NEW.created_at::DATE, 'bookings_cancelled', 1);
+    END IF;
+
+    PERFORM public.bump_org_stat(
+      org,
+      'active_rentals',
+      (b->>'status' = 'in_progress')::INTEGER - COALESCE((prev->>'status' = 'in_progress')::INTEGER, 0)
+    );
+
+  ELSIF NEW.aggregate_type = 'payment' THEN
+    p := NEW.payload->'payment';
+    SELECT organization_id INTO org FROM public.bookings WHERE id = (p->>'booking_id')::UUID;
+
+    IF p->>'status' = 'completed' THEN
+      PERFORM public.bump_org_daily(org, NEW.created_at::DATE, 'revenue', (p->>'amount')::NUMERIC);
+    ELSIF p->>'status' = 'refunded' AND NEW.payload->>'previous_status' = 'completed' THEN
+      PERFORM public.bump_org_daily(org, NEW.created_at::DATE, 'refunds', (p->>'amount')::NUMERIC);
+    END IF;
+  END IF;
+
+  RETURN NEW;
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER;
+
+CREATE OR REPLACE TRIGGER outbox_org_rollups
+  AFTER INSERT ON public.outbox
+  FOR EACH ROW EXECUTE FUNCTION public.apply_org_rollups();
+
+-- Fleet size
+CREATE OR REPLACE FUNCTION public.vehicle_org_rollups()
+RETURNS TRIGGER AS $$
+BEGIN
+  IF TG_OP = 'INSERT' THEN
+    PERFORM public.bump_org_stat(NEW.organization_id, 'fleet_size', 1);
+  ELSIF TG_OP = 'DELETE' THEN
+    PERFORM public.bump_org_stat(OLD.organization_id, 'fleet_size', -1);
+  END IF;
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER;
+
+CREATE OR REPLACE TRIGGER vehicles_org_rollups
+  AFTER INSERT OR DELETE ON public.vehicles
+  FOR EACH ROW EXECUTE FUNCTION public.vehicle_org_rollups();
+
+-- Pending KYC was dropped: customers have no organization and cannot book
+-- before KYC is approved, so it could not be attributed to an agency
+DROP TRIGGER IF EXISTS kyc_org_rollups ON public.kyc;
+DROP FUNCTION IF EXISTS public.kyc_org_rollups();
+ALTER TABLE organization_stats DROP COLUMN IF EXISTS pending_kyc;
+
+-- Review ratings, bucketed by the day the review was written
+CREATE OR REPLACE FUNCTION public.review_org_rollups()
+RETURNS TRIGGER AS $$
+DECLARE
+  org UUID;
+BEGIN
+  IF TG_OP <> 'INSERT' THEN
+    SELECT organization_id INTO org FROM public.vehicles WHERE id = OLD.vehicle_id;
+    PERFORM public.bump_org_daily(org, OLD.created_at::DATE, 'rating_sum', -OLD.rating);
+    PERFORM public.bump_org_daily(org, OLD.created_at::DATE, 'rating_count', -1);
+  END IF;
+  IF TG_OP <> 'DELETE' THEN
+    SELECT organization_id INTO org FROM public.vehicles WHERE id = NEW.vehicle_id;
+    PERFORM public.bump_org_daily(org, NEW.created_at::DATE, 'rating_sum', NEW.rating);
+    PERFORM public.bump_org_daily(org, NEW.created_at::DATE, 'rating_count', 1);
+  END IF;
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER;
+
+CREATE OR REPLACE TRIGGER reviews_org_rollups
+  AFTER INSERT OR UPDATE OF rating OR DELETE ON public.reviews
+  FOR EACH ROW EXECUTE FUNCTION public.review_org_rollups();
+
+-- One-off backfill for data that existed before the rollups were installed
+CREATE OR REPLACE FUNCTION public.backfill_organization_rollups()
+RETURNS VOID AS $$
+BEGIN
+  TRUNCATE public.organization_daily_stats, public.organization_stats;
+
+  INSERT INTO public.organization_stats (organization_id, fleet_size, active_rentals)
+  SELECT o.id,
+    (SELECT COUNT(*) FROM public.vehicles v WHERE v.organization_id = o.id),
+    (SELECT COUNT(*) FROM public.bookings b WHERE b.organization_id = o.id AND b.status = 'in_progress')
+  FROM public.organizations o;
+
+  PERFORM public.add_org_booked_hours(b.organization_id, b.pickup_date, b.return_date, 1)
+  FROM public.bookings b
+  WHERE b.status IN ('confirmed', 'in_progress', 'completed');
+
+  PERFORM public.bump_org_daily(b.organization_id, b.updated_at::DATE, 'bookings_confirmed', 1)
+  FROM public.bookings b
+  WHERE b.status IN ('confirmed', 'in_progress', 'completed');
+
+  PERFORM public.bump_org_daily(b.organization_id, b.updated_at::DATE, 'bookings_cancelled', 1)
+  FROM public.bookings b
+  WHERE b.status = 'cancelled';
+
+  PERFORM public.bump_org_daily(b.organization_id, p.updated_at::DATE, 'revenue', p.amount)
+  FROM public.payments p JOIN public.bookings b ON b.id = p.booking_id
+  WHERE p.status IN ('completed', 'refunded');
+
+  PERFORM public.bump_org_daily(b.organization_id, p.updated_at::DATE, 'refunds', p.amount)
+  FROM public.payments p JOIN public.bookings b ON b.id = p.booking_id
+  WHERE p.status = 'refunded';
+
+  PERFORM public.bump_org_daily(v.organization_id, r.created_at::DATE, 'rating_sum', r.rating),
+          public.bump_org_daily(v.organization_id, r.created_at::DATE, 'rating_count', 1)
+  FROM public.reviews r JOIN public.vehicles v ON v.id = r.vehicle_id;
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER;
+
+-- Run once from the SQL editor; it truncates the rollups first
+REVOKE EXECUTE ON FUNCTION public.backfill_organization_rollups() FROM PUBLIC, anon, authenticated;
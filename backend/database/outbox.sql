@@ -0,0 +1,146 @@
+-- Transactional Outbox for Booking and Payment Lifecycle Events
+-- Run after schema.sql. Triggers write an outbox row in the same transaction
+-- as every booking/payment status change; the API's OutboxDispatcher
+-- (app/events.py) claims and processes them in batches.
+
+CREATE TABLE IF NOT EXISTS outbox (
+    id BIGSERIAL PRIMARY KEY,
+    aggregate_type TEXT NOT NULL CHECK (aggregate_type IN ('booking', 'payment')),
+    aggregate_id UUID NOT NULL,
+    event_type TEXT NOT NULL,
+    payload JSONB NOT NULL,
+    created_at TIMESTAMPTZ DEFAULT NOW(),
+    claimed_at TIMESTAMPTZ,
+    claimed_by TEXT,
+    processed_at TIMESTAMPTZ,
+    attempts INTEGER DEFAULT 0,
+    last_error TEXT
+);
+
+-- Only unprocessed events are ever scanned
+CREATE INDEX IF NOT EXISTS idx_outbox_pending ON outbox(id) WHERE processed_at IS NULL;
+
+-- Bookings: 'booking.<status>' on insert/status change, 'booking.rescheduled' on date change
+CREATE OR REPLACE FUNCTION public.booking_outbox_event()
+RETURNS TRIGGER AS $$
+DECLARE
+  event_type TEXT;
+BEGIN
+  IF TG_OP = 'INSERT' OR NEW.status IS DISTINCT FROM OLD.status THEN
+    event_type := 'booking.' || NEW.status;
+  ELSIF NEW.pickup_date IS DISTINCT FROM OLD.pickup_date
+     OR NEW.return_date IS DISTINCT FROM OLD.return_date THEN
+    event_type := 'booking.rescheduled';
+  ELSE
+    RETURN NEW;
+  END IF;
+
+  INSERT INTO public.outbox (aggregate_type, aggregate_id, event_type, payload)
+  VALUES (
+    'booking',
+    NEW.id,
+    event_type,
+    jsonb_build_object(
+      'booking', to_jsonb(NEW),
+      'previous', CASE WHEN TG_OP = 'UPDATE' THEN to_jsonb(OLD) END
+    )
+  );
+
+  RETURN NEW;
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER;
+
+CREATE OR REPLACE TRIGGER bookings_outbox
+  AFTER INSERT OR UPDATE OF status, pickup_date, return_date ON public.bookings
+  FOR EACH ROW EXECUTE FUNCTION public.booking_outbox_event();
+
+-- Payments: 'payment.<status>' on insert/status change
+CREATE OR REPLACE FUNCTION public.payment_outbox_event()
+RETURNS TRIGGER AS $$
+BEGIN
+  IF TG_OP = 'UPDATE' AND NEW.status IS NOT DISTINCT FROM OLD.status THEN
+    RETURN NEW;
+  END IF;
+
+  INSERT INTO public.outbox (aggregate_type, aggregate_id, event_type, payload)
+  VALUES (
+    'payment',
+    NEW.id,
+    'payment.' || NEW.status,
+    jsonb_build_object(
+      'payment', to_jsonb(NEW),
+      'previous_status', CASE WHEN TG_OP = 'UPDATE' THEN OLD.status END
+    )
+  );
+
+  RETURN NEW;
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER;
+
+CREATE OR REPLACE TRIGGER payments_outbox
+  AFTER INSERT OR UPDATE OF status ON public.payments
+  FOR EACH ROW EXECUTE FUNCTION public.payment_outbox_event();
+
+-- Lease a batch of pending events to one dispatcher.
+-- SKIP LOCKED lets several API workers poll concurrently without overlap;
+-- events whose lease expired (crashed worker) become claimable again.
+CREATE OR REPLACE FUNCTION public.claim_outbox_events(
+  p_worker TEXT,
+  p_limit INTEGER DEFAULT 100,
+  p_lease_seconds INTEGER DEFAULT 60,
+  p_max_attempts INTEGER DEFAULT 10
+)
+RETURNS SETOF public.outbox AS $$
+  UPDATE public.outbox
+  SET claimed_at = NOW(),
+      claimed_by = p_worker,
+      attempts = attempts + 1
+  WHERE id IN (
+    SELECT id FROM public.outbox
+    WHERE processed_at IS NULL
+      AND attempts < p_max_attempts
+      AND (claimed_at IS NULL OR claimed_at < NOW() - make_interval(secs => p_lease_seconds))
+    ORDER BY id
+    LIMIT p_limit
+    FOR UPDATE SKIP LOCKED
+  )
+  RETURNING *;
+$$ LANGUAGE sql SECURITY DEFINER;
+
+-- Only the API's dispatcher (service role) leases events
+REVOKE EXECUTE ON FUNCTION public.claim_outbox_events(TEXT, INTEGER, INTEGER, INTEGER) FROM PUBLIC, anon, authenticated;
+
+-- Recount total_bookings for a set of vehicles (idempotent, safe to retry)
+CREATE OR REPLACE FUNCTION public.refresh_vehicle_total_bookings(p_vehicle_ids UUID[])
+RETURNS VOID AS $$
+  UPDATE public.vehicles v
+  SET total_bookings = (
+    SELECT COUNT(*) FROM public.bookings b
+    WHERE b.vehicle_id = v.id
+      AND b.status IN ('confirmed', 'in_progress', 'completed')
+  ),
+  updated_at = NOW()
+  WHERE v.id = ANY(p_vehicle_ids);
+$$ LANGUAGE sql SECURITY DEFINER;
+
+REVOKE EXECUTE ON FUNCTION public.refresh_vehicle_total_bookings(UUID[]) FROM PUBLIC, anon, authenticated;
+
+-- Delete up to p_limit events processed before p_before (the purge_outbox_events
+-- Celery task calls this until it returns less than p_limit). Events that ran
+-- out of attempts are never processed and stay for inspection.
+CREATE OR REPLACE FUNCTION public.purge_outbox_events(p_before TIMESTAMPTZ, p_limit INTEGER DEFAULT 10000)
+RETURNS INTEGER AS $$
+  WITH purged AS (
+    DELETE FROM public.outbox
+    WHERE id IN (
+      SELECT id FROM public.outbox
+      WHERE processed_at < p_before
+      ORDER BY id
+      LIMIT p_limit
+    )
+    RETURNING 1
+  )
+  SELECT COUNT(*)::INTEGER FROM purged;
+$$ LANGUAGE sql SECURITY DEFINER;
+
+REVOKE EXECUTE ON FUNCTION public.purge_outbox_events(TIMESTAMPTZ, INTEGER) FROM PUBLIC, anon, authenticated;
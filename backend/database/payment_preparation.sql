@@ -0,0 +1,181 @@
+-- Payment Preparation with Wallet and Loyalty Reservations
+-- Run after outbox.sql and loyalty_ledger.sql. POST /payments/intent calls prepare_payment() once:
+-- the booking checks (owner, still pending, amount equals total_price, no
+-- other live payment), the loyalty/wallet reservations and the pending
+-- payment row all happen in one transaction, so concurrent payments can
+-- never spend the same points or funds twice. Points are only ever redeemed
+-- here, against a payment.
+--
+-- A retried request (same Idempotency-Key, so the same payment id) gets the
+-- payment back while it still holds its reservations, and reserves again if
+-- the first attempt failed, so nothing is reserved twice.
+--
+-- Reservations are settled by a trigger when the payment completes (wallet
+-- funds are captured) or fails (points and funds are released). Released
+-- points go back into the lots they were redeemed from, keeping their expiry.
+
+CREATE TABLE IF NOT EXISTS wallets (
+    user_id UUID PRIMARY KEY REFERENCES users(id) ON DELETE CASCADE,
+    balance DECIMAL(10, 2) NOT NULL DEFAULT 0 CHECK (balance >= 0),
+    reserved DECIMAL(10, 2) NOT NULL DEFAULT 0 CHECK (reserved >= 0 AND reserved <= balance),
+    updated_at TIMESTAMPTZ DEFAULT NOW()
+);
+
+-- The 'redeemed' ledger entry that reserved the payment's points
+ALTER TABLE payments ADD COLUMN IF NOT EXISTS loyalty_transaction_id UUID REFERENCES loyalty_transactions(id);
+
+-- Errors are raised with stable messages that the API maps to HTTP statuses
+CREATE OR REPLACE FUNCTION public.prepare_payment(
+  p_payment_id UUID,
+  p_booking_id UUID,
+  p_customer_id UUID,
+  p_amount NUMERIC,
+  p_method TEXT,
+  p_wallet_amount NUMERIC DEFAULT 0,
+  p_loyalty_points INTEGER DEFAULT 0
+)
+RETURNS SETOF public.payments AS $$
+DECLARE
+  booking public.bookings;
+  existing public.payments;
+  redemption JSONB;
+BEGIN
+  SELECT * INTO booking FROM public.bookings WHERE id = p_booking_id FOR UPDATE;
+  IF NOT FOUND THEN
+    RAISE EXCEPTION 'booking_not_found';
+  END IF;
+  IF booking.customer_id <> p_customer_id THEN
+    RAISE EXCEPTION 'not_authorized';
+  END IF;
+  IF booking.status <> 'pending' THEN
+    RAISE EXCEPTION 'booking_not_pending';
+  END IF;
+  IF ROUND(p_amount, 2) <> booking.total_price THEN
+    RAISE EXCEPTION 'amount_mismatch';
+  END IF;
+
+  SELECT * INTO existing FROM public.payments WHERE id = p_payment_id FOR UPDATE;
+  IF FOUND THEN
+    IF existing.booking_id <> p_booking_id THEN
+      RAISE EXCEPTION 'not_authorized';
+    END IF;
+    IF existing.status IN ('pending', 'processing') THEN
+      RETURN NEXT existing;
+      RETURN;
+    END IF;
+    IF existing.status <> 'failed' THEN
+      RAISE EXCEPTION 'payment_already_settled';
+    END IF;
+  END IF;
+
+  -- One live payment per booking (the booking row lock serialises this check)
+  PERFORM 1 FROM public.payments
+  WHERE booking_id = p_booking_id AND id <> p_payment_id AND status IN ('pending', 'processing');
+  IF FOUND THEN
+    RAISE EXCEPTION 'payment_in_progress';
+  END IF;
+
+  IF COALESCE(p_loyalty_points, 0) > 0 THEN
+    -- Raises insufficient_loyalty_points if the balance is too low
+    redemption := public.loyalty_post(
+      p_customer_id, 'redeemed', -p_loyalty_points, p_booking_id,
+      'Redeemed ' || p_loyalty_points || ' points for payment ' || p_payment_id
+    );
+  END IF;
+
+  IF COALESCE(p_wallet_amount, 0) > 0 THEN
+    UPDATE public.wallets
+    SET reserved = reserved + p_wallet_amount,
+        updated_at = NOW()
+    WHERE user_id = p_customer_id AND balance - reserved >= p_wallet_amount;
+    IF NOT FOUND THEN
+      RAISE EXCEPTION 'insufficient_wallet_balance';
+    END IF;
+  END IF;
+
+  RETURN QUERY
+  INSERT INTO public.payments (
+    id, booking_id, customer_id, amount, currency, method, status,
+    wallet_amount, loyalty_points_used, loyalty_transaction_id, created_at, updated_at
+  )
+  VALUES (
+    p_payment_id, p_booking_id, p_customer_id, p_amount, 'AED', p_method, 'pending',
+    COALESCE(p_wallet_amount, 0), COALESCE(p_loyalty_points, 0), (redemption->>'id')::UUID, NOW(), NOW()
+  )
+  ON CONFLICT (id) DO UPDATE
+  SET amount = EXCLUDED.amount,
+      method = EXCLUDED.method,
+      status = 'pending',
+      wallet_amount = EXCLUDED.wallet_amount,
+      loyalty_points_used = EXCLUDED.loyalty_points_used,
+      loyalty_transaction_id = EXCLUDED.loyalty_transaction_id,
+      failure_reason = NULL,
+      updated_at = NOW()
+  RETURNING *;
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER;
+
+-- Capture or release a payment's reservations when it settles
+CREATE OR REPLACE FUNCTION public.settle_payment_reservations()
+RETURNS TRIGGER AS $$
+BEGIN
+  -- A card can still succeed after a failed attempt; take back what the failure released
+  IF OLD.status = 'failed' AND NEW.status = 'completed' THEN
+    IF NEW.wallet_amount > 0 THEN
+      UPDATE public.wallets
+      SET balance = balance - LEAST(NEW.wallet_amount, balance - reserved),
+          updated_at = NOW()
+      WHERE user_id = NEW.customer_id;
+    END IF;
+    IF NEW.loyalty_points_used > 0 THEN
+      -- The points may have been spent or expired meanwhile; take back what is left
+      PERFORM public.loyalty_post(
+        NEW.customer_id, 'redeemed', -LEAST(NEW.loyalty_points_used, live.points), NEW.booking_id,
+        'Redeemed points for payment ' || NEW.id || ' after retry'
+      )
+      FROM (SELECT public.live_loyalty_points(NEW.customer_id) AS points) live
+      WHERE live.points > 0;
+    END IF;
+    RETURN NEW;
+  END IF;
+
+  IF OLD.status NOT IN ('pending', 'processing') THEN
+    RETURN NEW;
+  END IF;
+
+  IF NEW.status = 'completed' AND NEW.wallet_amount > 0 THEN
+    UPDATE public.wallets
+    SET balance = balance - NEW.wallet_amount,
+        reserved = reserved - NEW.wallet_amount,
+        updated_at = NOW()
+    WHERE user_id = NEW.customer_id;
+
+  ELSIF NEW.status = 'failed' THEN
+    IF NEW.wallet_amount > 0 THEN
+      UPDATE public.wallets
+      SET reserved = reserved - NEW.wallet_amount,
+          updated_at = NOW()
+      WHERE user_id = NEW.customer_id;
+    END IF;
+
+    IF NEW.loyalty_points_used > 0 THEN
+      PERFORM public.loyalty_post(
+        NEW.customer_id, 'adjustment', NEW.loyalty_points_used, NEW.booking_id,
+        'Points returned for failed payment ' || NEW.id,
+        NULL, NEW.loyalty_transaction_id
+      );
+    END IF;
+  END IF;
+
+  RETURN NEW;
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER;
+
+CREATE OR REPLACE TRIGGER payments_settle_reservations
+  AFTER UPDATE OF status ON public.payments
+  FOR EACH ROW
+  WHEN (NEW.status IS DISTINCT FROM OLD.status)
+  EXECUTE FUNCTION public.settle_payment_reservations();
+
+-- Only the API (service role) may prepare payments on a customer's behalf
+REVOKE EXECUTE ON FUNCTION public.prepare_payment(UUID, UUID, UUID, NUMERIC, TEXT, NUMERIC, INTEGER) FROM PUBLIC, anon, authenticated;
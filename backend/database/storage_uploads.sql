@@ -0,0 +1,35 @@
+-- Storage Upload Limits and Pending Uploads
+-- Run after the storage buckets exist (see SUPABASE_STORAGE_SETUP.md).
+-- POST /uploads/sign hands the client a URL that writes straight to storage,
+-- so the size and type checks in POST /uploads/complete come after the bytes
+-- are stored. The bucket limits below make storage itself refuse oversized or
+-- wrongly typed files; keep file_size_limit in line with UPLOAD_MAX_BYTES.
+
+UPDATE storage.buckets
+SET file_size_limit = 15 * 1024 * 1024,
+    allowed_mime_types = ARRAY['image/*']
+WHERE id IN ('avatars', 'vehicle-images');
+
+UPDATE storage.buckets
+SET file_size_limit = 15 * 1024 * 1024,
+    allowed_mime_types = ARRAY['image/*', 'application/pdf']
+WHERE id = 'kyc-documents';
+
+-- Only the API writes here (rendered contract PDFs)
+UPDATE storage.buckets
+SET file_size_limit = 15 * 1024 * 1024,
+    allowed_mime_types = ARRAY['application/pdf']
+WHERE id = 'contracts';
+
+-- One row per signed upload path, removed by POST /uploads/complete. Rows
+-- that outlive the signed URL belong to uploads that were never completed;
+-- the sweep_abandoned_uploads Celery task deletes their objects and the row.
+CREATE TABLE IF NOT EXISTS pending_uploads (
+    bucket TEXT NOT NULL,
+    path TEXT NOT NULL,
+    user_id UUID NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (bucket, path)
+);
+
+CREATE INDEX IF NOT EXISTS idx_pending_uploads_created ON pending_uploads(created_at);
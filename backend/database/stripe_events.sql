@@ -0,0 +1,88 @@
+-- Stripe Webhook Inbox
+-- Run after outbox.sql. POST /payments/webhook only verifies the signature and
+-- stores the event here (duplicates from Stripe retries are dropped by the
+-- primary key); the API's StripeEventConsumer (app/stripe_events.py) applies
+-- them in batches. Payment status changes then flow through the outbox.
+
+CREATE TABLE IF NOT EXISTS stripe_events (
+    id TEXT PRIMARY KEY,  -- Stripe event id (evt_...)
+    type TEXT NOT NULL,
+    payload JSONB NOT NULL,
+    received_at TIMESTAMPTZ DEFAULT NOW(),
+    claimed_at TIMESTAMPTZ,
+    claimed_by TEXT,
+    processed_at TIMESTAMPTZ,
+    latency_ms INTEGER GENERATED ALWAYS AS (
+        (EXTRACT(EPOCH FROM processed_at - received_at) * 1000)::INTEGER
+    ) STORED,
+    attempts INTEGER DEFAULT 0,
+    last_error TEXT
+);
+
+CREATE INDEX IF NOT EXISTS idx_stripe_events_pending ON stripe_events(received_at) WHERE processed_at IS NULL;
+
+-- Lease a batch of unprocessed events (same scheme as claim_outbox_events)
+CREATE OR REPLACE FUNCTION public.claim_stripe_events(
+  p_worker TEXT,
+  p_limit INTEGER DEFAULT 100,
+  p_lease_seconds INTEGER DEFAULT 60,
+  p_max_attempts INTEGER DEFAULT 10
+)
+RETURNS SETOF public.stripe_events AS $$
+  UPDATE public.stripe_events
+  SET claimed_at = NOW(),
+      claimed_by = p_worker,
+      attempts = attempts + 1
+  WHERE id IN (
+    SELECT id FROM public.stripe_events
+    WHERE processed_at IS NULL
+      AND attempts < p_max_attempts
+      AND (claimed_at IS NULL OR claimed_at < NOW() - make_interval(secs => p_lease_seconds))
+    ORDER BY received_at
+    LIMIT p_limit
+    FOR UPDATE SKIP LOCKED
+  )
+  RETURNING *;
+$$ LANGUAGE sql SECURITY DEFINER;
+
+REVOKE EXECUTE ON FUNCTION public.claim_stripe_events(TEXT, INTEGER, INTEGER, INTEGER) FROM PUBLIC, anon, authenticated;
+
+-- Apply a batch of payment status updates keyed by PaymentIntent id.
+-- Settled payments are never moved back by late or out-of-order events.
+CREATE OR REPLACE FUNCTION public.apply_payment_updates(p_updates JSONB)
+RETURNS INTEGER AS $$
+  WITH updated AS (
+    UPDATE public.payments p
+    SET status = u.status,
+        stripe_charge_id = COALESCE(u.charge_id, p.stripe_charge_id),
+        failure_reason = u.failure_reason,
+        updated_at = NOW()
+    FROM jsonb_to_recordset(p_updates) AS u(intent_id TEXT, status TEXT, charge_id TEXT, failure_reason TEXT)
+    WHERE p.stripe_payment_intent_id = u.intent_id
+      AND p.status IS DISTINCT FROM u.status
+      AND p.status NOT IN ('completed', 'refunded', 'partially_refunded')
+    RETURNING 1
+  )
+  SELECT COUNT(*)::INTEGER FROM updated;
+$$ LANGUAGE sql SECURITY DEFINER;
+
+-- Payments are only moved by the event consumer and reconciliation (service role)
+REVOKE EXECUTE ON FUNCTION public.apply_payment_updates(JSONB) FROM PUBLIC, anon, authenticated;
+
+-- Consumer entry point: applies the updates and returns the intent ids that
+-- have a payments row. Events for the others arrived before the row was
+-- inserted (webhook racing the API) and are retried by the consumer.
+CREATE OR REPLACE FUNCTION public.apply_payment_events(p_updates JSONB)
+RETURNS SETOF TEXT AS $$
+BEGIN
+  PERFORM public.apply_payment_updates(p_updates);
+  RETURN QUERY
+  SELECT DISTINCT p.stripe_payment_intent_id
+  FROM public.payments p
+  WHERE p.stripe_payment_intent_id IN (
+    SELECT u.intent_id FROM jsonb_to_recordset(p_updates) AS u(intent_id TEXT)
+  );
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER;
+
+REVOKE EXECUTE ON FUNCTION public.apply_payment_events(JSONB) FROM PUBLIC, anon, authenticated;
@@ -0,0 +1,128 @@
+-- Incremental Vehicle Rating Aggregates
+-- Run after schema.sql. Review writes adjust per-vehicle sums and counts by
+-- their delta in the same transaction, and vehicles.rating / total_reviews
+-- are derived from those aggregates, so the API never re-reads all of a
+-- vehicle's reviews to average them. The same row keeps a star histogram for
+-- GET /reviews/vehicle/{id}/summary.
+
+CREATE TABLE IF NOT EXISTS vehicle_rating_stats (
+    vehicle_id UUID PRIMARY KEY REFERENCES vehicles(id) ON DELETE CASCADE,
+    rating_sum DECIMAL(12, 2) NOT NULL DEFAULT 0,
+    rating_count INTEGER NOT NULL DEFAULT 0,
+    cleanliness_sum DECIMAL(12, 2) NOT NULL DEFAULT 0,
+    cleanliness_count INTEGER NOT NULL DEFAULT 0,
+    comfort_sum DECIMAL(12, 2) NOT NULL DEFAULT 0,
+    comfort_count INTEGER NOT NULL DEFAULT 0,
+    value_sum DECIMAL(12, 2) NOT NULL DEFAULT 0,
+    value_count INTEGER NOT NULL DEFAULT 0,
+    updated_at TIMESTAMPTZ DEFAULT NOW()
+);
+
+-- Star histogram: each review counts towards its rating rounded to whole stars
+ALTER TABLE vehicle_rating_stats ADD COLUMN IF NOT EXISTS stars_1 INTEGER NOT NULL DEFAULT 0;
+ALTER TABLE vehicle_rating_stats ADD COLUMN IF NOT EXISTS stars_2 INTEGER NOT NULL DEFAULT 0;
+ALTER TABLE vehicle_rating_stats ADD COLUMN IF NOT EXISTS stars_3 INTEGER NOT NULL DEFAULT 0;
+ALTER TABLE vehicle_rating_stats ADD COLUMN IF NOT EXISTS stars_4 INTEGER NOT NULL DEFAULT 0;
+ALTER TABLE vehicle_rating_stats ADD COLUMN IF NOT EXISTS stars_5 INTEGER NOT NULL DEFAULT 0;
+
+-- Add (p_sign = 1) or remove (p_sign = -1) one review's ratings
+CREATE OR REPLACE FUNCTION public.bump_vehicle_rating(p_review public.reviews, p_sign INTEGER)
+RETURNS VOID AS $$
+  INSERT INTO public.vehicle_rating_stats (
+    vehicle_id, rating_sum, rating_count,
+    cleanliness_sum, cleanliness_count, comfort_sum, comfort_count, value_sum, value_count,
+    stars_1, stars_2, stars_3, stars_4, stars_5
+  )
+  SELECT
+    p_review.vehicle_id, p_sign * p_review.rating, p_sign,
+    p_sign * COALESCE(p_review.cleanliness_rating, 0), p_sign * (p_review.cleanliness_rating IS NOT NULL)::INTEGER,
+    p_sign * COALESCE(p_review.comfort_rating, 0), p_sign * (p_review.comfort_rating IS NOT NULL)::INTEGER,
+    p_sign * COALESCE(p_review.value_rating, 0), p_sign * (p_review.value_rating IS NOT NULL)::INTEGER,
+    p_sign * (stars = 1)::INTEGER, p_sign * (stars = 2)::INTEGER, p_sign * (stars = 3)::INTEGER,
+    p_sign * (stars = 4)::INTEGER, p_sign * (stars = 5)::INTEGER
+  FROM (SELECT ROUND(p_review.rating)::INTEGER AS stars) bucket
+  ON CONFLICT (vehicle_id) DO UPDATE
+  SET rating_sum = vehicle_rating_stats.rating_sum + EXCLUDED.rating_sum,
+      rating_count = vehicle_rating_stats.rating_count + EXCLUDED.rating_count,
+      cleanliness_sum = vehicle_rating_stats.cleanliness_sum + EXCLUDED.cleanliness_sum,
+      cleanliness_count = vehicle_rating_stats.cleanliness_count + EXCLUDED.cleanliness_count,
+      comfort_sum = vehicle_rating_stats.comfort_sum + EXCLUDED.comfort_sum,
+      comfort_count = vehicle_rating_stats.comfort_count + EXCLUDED.comfort_count,
+      value_sum = vehicle_rating_stats.value_sum + EXCLUDED.value_sum,
+      value_count = vehicle_rating_stats.value_count + EXCLUDED.value_count,
+      stars_1 = vehicle_rating_stats.stars_1 + EXCLUDED.stars_1,
+      stars_2 = vehicle_rating_stats.stars_2 + EXCLUDED.stars_2,
+      stars_3 = vehicle_rating_stats.stars_3 + EXCLUDED.stars_3,
+      stars_4 = vehicle_rating_stats.stars_4 + EXCLUDED.stars_4,
+      stars_5 = vehicle_rating_stats.stars_5 + EXCLUDED.stars_5,
+      updated_at = NOW();
+$$ LANGUAGE sql;
+
+-- Copy the derived average and count onto the vehicle row
+CREATE OR REPLACE FUNCTION public.sync_vehicle_rating(p_vehicle UUID)
+RETURNS VOID AS $$
+  UPDATE public.vehicles v
+  SET rating = CASE WHEN s.rating_count > 0 THEN ROUND(s.rating_sum / s.rating_count, 2) ELSE 0 END,
+      total_reviews = GREATEST(s.rating_count, 0),
+      updated_at = NOW()
+  FROM public.vehicle_rating_stats s
+  WHERE s.vehicle_id = p_vehicle AND v.id = p_vehicle;
+$$ LANGUAGE sql;
+
+CREATE OR REPLACE FUNCTION public.review_vehicle_ratings()
+RETURNS TRIGGER AS $$
+BEGIN
+  IF TG_OP <> 'INSERT' THEN
+    PERFORM public.bump_vehicle_rating(OLD, -1);
+  END IF;
+  IF TG_OP <> 'DELETE' THEN
+    PERFORM public.bump_vehicle_rating(NEW, 1);
+    PERFORM public.sync_vehicle_rating(NEW.vehicle_id);
+  END IF;
+  IF TG_OP = 'DELETE' OR OLD.vehicle_id <> NEW.vehicle_id THEN
+    PERFORM public.sync_vehicle_rating(OLD.vehicle_id);
+  END IF;
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER;
+
+CREATE OR REPLACE TRIGGER reviews_vehicle_ratings
+  AFTER INSERT
+    OR UPDATE OF vehicle_id, rating, cleanliness_rating, comfort_rating, value_rating
+    OR DELETE ON public.reviews
+  FOR EACH ROW EXECUTE FUNCTION public.review_vehicle_ratings();
+
+-- One-off backfill for reviews that existed before the trigger was installed
+CREATE OR REPLACE FUNCTION public.backfill_vehicle_ratings()
+RETURNS VOID AS $$
+BEGIN
+  TRUNCATE public.vehicle_rating_stats;
+
+  INSERT INTO public.vehicle_rating_stats (
+    vehicle_id, rating_sum, rating_count,
+    cleanliness_sum, cleanliness_count, comfort_sum, comfort_count, value_sum, value_count,
+    stars_1, stars_2, stars_3, stars_4, stars_5
+  )
+  SELECT r.vehicle_id, SUM(r.rating), COUNT(*),
+    COALESCE(SUM(r.cleanliness_rating), 0), COUNT(r.cleanliness_rating),
+    COALESCE(SUM(r.comfort_rating), 0), COUNT(r.comfort_rating),
+    COALESCE(SUM(r.value_rating), 0), COUNT(r.value_rating),
+    COUNT(*) FILTER (WHERE ROUND(r.rating) = 1), COUNT(*) FILTER (WHERE ROUND(r.rating) = 2),
+    COUNT(*) FILTER (WHERE ROUND(r.rating) = 3), COUNT(*) FILTER (WHERE ROUND(r.rating) = 4),
+    COUNT(*) FILTER (WHERE ROUND(r.rating) = 5)
+  FROM public.reviews r
+  GROUP BY r.vehicle_id;
+
+  UPDATE public.vehicles v
+  SET rating = COALESCE(ROUND(s.rating_sum / NULLIF(s.rating_count, 0), 2), 0),
+      total_reviews = COALESCE(s.rating_count, 0)
+  FROM public.vehicles v2
+  LEFT JOIN public.vehicle_rating_stats s ON s.vehicle_id = v2.id
+  WHERE v.id = v2.id;
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER;
+
+-- Only the review trigger and a one-off backfill from the SQL editor use these
+REVOKE EXECUTE ON FUNCTION public.bump_vehicle_rating(public.reviews, INTEGER) FROM PUBLIC, anon, authenticated;
+REVOKE EXECUTE ON FUNCTION public.sync_vehicle_rating(UUID) FROM PUBLIC, anon, authenticated;
+REVOKE EXECUTE ON FUNCTION public.backfill_vehicle_ratings() FROM PUBLIC, anon, authenticated;
@@ -0,0 +1,78 @@
+-- Per-Vehicle Daily Utilization
+-- Run after schema.sql. Filled incrementally by the `update_vehicle_utilization`
+-- Celery task (app/utilization.py), which only reads bookings changed since
+-- its last watermark.
+
+-- Generic checkpoint table for incremental background jobs
+CREATE TABLE IF NOT EXISTS job_watermarks (
+    job_name TEXT PRIMARY KEY,
+    watermark_at TIMESTAMPTZ,
+    watermark_id UUID,
+    state JSONB DEFAULT '{}',
+    updated_at TIMESTAMPTZ DEFAULT NOW()
+);
+
+CREATE TABLE IF NOT EXISTS vehicle_utilization (
+    vehicle_id UUID NOT NULL REFERENCES vehicles(id) ON DELETE CASCADE,
+    day DATE NOT NULL,
+    booked_hours DECIMAL(8, 2) DEFAULT 0,
+    revenue DECIMAL(12, 2) DEFAULT 0,
+    updated_at TIMESTAMPTZ DEFAULT NOW(),
+    PRIMARY KEY (vehicle_id, day)
+);
+
+-- Last interval/revenue of each booking that was applied to vehicle_utilization,
+-- so a later change can subtract exactly what was added before
+CREATE TABLE IF NOT EXISTS booking_utilization_snapshots (
+    booking_id UUID PRIMARY KEY REFERENCES bookings(id) ON DELETE CASCADE,
+    vehicle_id UUID NOT NULL,
+    pickup_date TIMESTAMPTZ NOT NULL,
+    return_date TIMESTAMPTZ NOT NULL,
+    revenue DECIMAL(10, 2) NOT NULL,
+    counted BOOLEAN NOT NULL
+);
+
+-- Keyset scan of changed bookings
+CREATE INDEX IF NOT EXISTS idx_bookings_updated ON bookings(updated_at, id);
+
+-- Apply one chunk of deltas, snapshots and the new watermark atomically
+CREATE OR REPLACE FUNCTION public.apply_vehicle_utilization(
+  p_deltas JSONB,
+  p_snapshots JSONB,
+  p_job TEXT,
+  p_watermark_at TIMESTAMPTZ,
+  p_watermark_id UUID
+)
+RETURNS VOID AS $$
+BEGIN
+  INSERT INTO public.vehicle_utilization (vehicle_id, day, booked_hours, revenue)
+  SELECT d.vehicle_id, d.day, d.booked_hours, d.revenue
+  FROM jsonb_to_recordset(p_deltas) AS d(vehicle_id UUID, day DATE, booked_hours NUMERIC, revenue NUMERIC)
+  ON CONFLICT (vehicle_id, day) DO UPDATE
+  SET booked_hours = vehicle_utilization.booked_hours + EXCLUDED.booked_hours,
+      revenue = vehicle_utilization.revenue + EXCLUDED.revenue,
+      updated_at = NOW();
+
+  INSERT INTO public.booking_utilization_snapshots (booking_id, vehicle_id, pickup_date, return_date, revenue, counted)
+  SELECT s.booking_id, s.vehicle_id, s.pickup_date, s.return_date, s.revenue, s.counted
+  FROM jsonb_to_recordset(p_snapshots) AS s(
+    booking_id UUID, vehicle_id UUID, pickup_date TIMESTAMPTZ, return_date TIMESTAMPTZ, revenue NUMERIC, counted BOOLEAN
+  )
+  ON CONFLICT (booking_id) DO UPDATE
+  SET vehicle_id = EXCLUDED.vehicle_id,
+      pickup_date = EXCLUDED.pickup_date,
+      return_date = EXCLUDED.return_date,
+      revenue = EXCLUDED.revenue,
+      counted = EXCLUDED.counted;
+
+  INSERT INTO public.job_watermarks (job_name, watermark_at, watermark_id, updated_at)
+  VALUES (p_job, p_watermark_at, p_watermark_id, NOW())
+  ON CONFLICT (job_name) DO UPDATE
+  SET watermark_at = EXCLUDED.watermark_at,
+      watermark_id = EXCLUDED.watermark_id,
+      updated_at = NOW();
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER;
+
+-- Only the update_vehicle_utilization Celery task (service role) applies chunks
+REVOKE EXECUTE ON FUNCTION public.apply_vehicle_utilization(JSONB, JSONB, TEXT, TIMESTAMPTZ, UUID) FROM PUBLIC, anon, authenticated;
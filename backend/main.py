@@ -5,16 +5,41 @@ import uvicorn
 
 from config import settings
 from app.database import init_db
-from app.api.v1 import auth, vehicles, bookings, payments, kyc, contracts, loyalty, reviews
+from app.events import outbox_broadcast, outbox_dispatcher
+from app.stripe_events import stripe_event_consumer
+from app.storage import storage
+from app.contract_pdf import contract_pdf_service
+from app.surge import surge_engine
+from app.leaderboard import loyalty_leaderboard
+from app.signature_images import signature_images
+import app.event_handlers  # registers outbox subscribers
+from app.api.v1 import auth, vehicles, bookings, payments, kyc, contracts, loyalty, reviews, organizations, uploads
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
    # Startup
    await init_db()
+   contract_pdf_service.start()
+   if settings.SURGE_ENABLED:
+       surge_engine.start()
+   loyalty_leaderboard.start()
+   if settings.OUTBOX_BROADCAST_ENABLED:
+       outbox_broadcast.start()
+   if settings.OUTBOX_DISPATCHER_ENABLED:
+       outbox_dispatcher.start()
+   if settings.STRIPE_EVENTS_CONSUMER_ENABLED:
+       stripe_event_consumer.start()
    yield
    # Shutdown
-   pass
+   await surge_engine.stop()
+   await loyalty_leaderboard.stop()
+   await stripe_event_consumer.stop()
+   await outbox_dispatcher.stop()
+   await outbox_broadcast.stop()
+   await contract_pdf_service.close()
+   await signature_images.close()
+   await storage.close()
 
 
 app = FastAPI(
@@ -47,6 +72,8 @@ app.include_router(kyc.router, prefix="/api/v1/kyc", tags=["KYC"])
 app.include_router(contracts.router, prefix="/api/v1/contracts", tags=["Contracts"])
 app.include_router(loyalty.router, prefix="/api/v1/loyalty", tags=["Loyalty"])
 app.include_router(reviews.router, prefix="/api/v1/reviews", tags=["Reviews"])
+app.include_router(organizations.router, prefix="/api/v1/organizations", tags=["Organizations"])
+app.include_router(uploads.router, prefix="/api/v1/uploads", tags=["Uploads"])
 
 
 if __name__ == "__main__":
@@ -0,0 +1,71 @@
+"""
+Booking Mutation Round-Trip Benchmark
+Compares the query pattern update_booking/cancel_booking used before
+(read booking, update, read vehicle) with the current one (read booking with
+its embedded vehicle, guarded update) against a real Supabase project.
+
+The update only touches updated_at, which the outbox trigger ignores, so the
+booking is left as it was.
+
+Usage (from backend/):
+    python scripts/bench_booking_roundtrips.py --booking-id <uuid> --iterations 50
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.database import get_supabase_admin  # noqa: E402
+
+
+def previous_pattern(supabase, booking_id: str) -> int:
+    """select booking -> update -> select vehicle (3 round trips)"""
+    supabase.table("bookings").select("*").eq("id", booking_id).execute()
+    updated = supabase.table("bookings").update({
+        "updated_at": datetime.utcnow().isoformat()
+    }).eq("id", booking_id).execute().data[0]
+    supabase.table("vehicles").select("*").eq("id", updated["vehicle_id"]).execute()
+    return 3
+
+
+def current_pattern(supabase, booking_id: str) -> int:
+    """select booking with vehicles(*) -> guarded update (2 round trips)"""
+    booking = supabase.table("bookings").select("*, vehicles(*)").eq("id", booking_id).execute().data[0]
+    supabase.table("bookings").update({
+        "updated_at": datetime.utcnow().isoformat()
+    }).eq("id", booking_id).eq("status", booking["status"]).execute()
+    return 2
+
+
+def run(name: str, pattern, supabase, booking_id: str, iterations: int):
+    pattern(supabase, booking_id)  # Warm the connection
+    timings = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        round_trips = pattern(supabase, booking_id)
+        timings.append((time.perf_counter() - started) * 1000)
+    timings.sort()
+    print(
+        f"{name:<10} round trips={round_trips}  "
+        f"median={statistics.median(timings):.1f} ms  "
+        f"p95={timings[int(len(timings) * 0.95) - 1]:.1f} ms"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--booking-id", required=True, help="Existing booking to read and touch")
+    parser.add_argument("--iterations", type=int, default=50)
+    args = parser.parse_args()
+
+    supabase = get_supabase_admin()
+    run("previous", previous_pattern, supabase, args.booking_id, args.iterations)
+    run("current", current_pattern, supabase, args.booking_id, args.iterations)
+
+
+if __name__ == "__main__":
+    main()
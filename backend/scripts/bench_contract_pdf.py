@@ -0,0 +1,132 @@
+"""
+Contract PDF Rendering Benchmark
+Renders a sample contract many times through ContractPdfService.render (the
+process pool the API uses) and reports throughput, latency and event loop lag.
+A sequential in-process run of render_contract is printed alongside, which is
+what rendering on the request path would cost. No database or storage is used.
+
+Usage (from backend/):
+    python scripts/bench_contract_pdf.py --renders 200 --concurrency 20 --workers 4
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Rendering needs no external services; the settings just have to load
+for name in ("SUPABASE_URL", "SUPABASE_KEY", "SUPABASE_SERVICE_KEY", "SECRET_KEY"):
+    os.environ.setdefault(name, "unused")
+
+from PIL import Image, ImageDraw  # noqa: E402
+
+from app.contract_pdf import contract_pdf_service, render_contract  # noqa: E402
+from config import settings  # noqa: E402
+
+CONTRACT = {
+    "id": "00000000-0000-0000-0000-000000000001",
+    "contract_number": "CONTRACT-20260101-BENCH001",
+    "created_at": "2026-01-01T09:00:00",
+    "start_date": "2026-01-02T10:00:00",
+    "end_date": "2026-01-09T10:00:00",
+    "customer_signed_at": "2026-01-01T09:30:00",
+    "agency_signed_at": "2026-01-01T09:45:00",
+    "special_conditions": "Vehicle to be delivered to the customer's hotel.",
+    "bookings": {
+        "pickup_location": "Dubai Marina", "rental_type": "weekly", "with_driver": False,
+        "base_price": 2100, "surge_multiplier": 1.15, "driver_fee": 0,
+        "platform_fee": 241.5, "total_price": 2656.5,
+    },
+    "vehicles": {"make": "Toyota", "model": "Land Cruiser", "year": 2025, "color": "White", "license_plate": "D 12345"},
+    "users": {"full_name": "Sample Customer", "email": "customer@example.com", "phone": "+971500000000"},
+    "organizations": {"name": "Sample Agency", "email": "agency@example.com", "phone": "+97140000000", "address": "Dubai"},
+}
+
+
+def write_signature(directory: str) -> str:
+    """A small PNG standing in for a cached signature image"""
+    path = os.path.join(directory, "signature.png")
+    image = Image.new("RGBA", (600, 180), (255, 255, 255, 0))
+    ImageDraw.Draw(image).line([(20, 150), (200, 40), (320, 140), (580, 30)], fill=(0, 0, 0, 255), width=6)
+    image.save(path)
+    return path
+
+
+async def measure_lag(stop: asyncio.Event, lags: list):
+    """Record how late a 10 ms sleep wakes up while the renders run"""
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(0.01)
+        lags.append((time.perf_counter() - started - 0.01) * 1000)
+
+
+async def run_pool(total: int, concurrency: int, signatures):
+    gate = asyncio.Semaphore(concurrency)
+    timings = []
+
+    async def one():
+        async with gate:
+            started = time.perf_counter()
+            await contract_pdf_service.render(CONTRACT, signatures)
+            timings.append((time.perf_counter() - started) * 1000)
+
+    # Start the workers (fonts and styles load once per process) before timing
+    await asyncio.gather(*(contract_pdf_service.render(CONTRACT, signatures) for _ in range(settings.CONTRACT_PDF_WORKERS)))
+
+    stop, lags = asyncio.Event(), []
+    ticker = asyncio.create_task(measure_lag(stop, lags))
+    started = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(total)))
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await ticker
+    await contract_pdf_service.close()
+    return elapsed, sorted(timings), max(lags, default=0.0)
+
+
+def run_inline(total: int, signatures):
+    render_contract(CONTRACT, signatures)  # Register fonts in this process
+    started = time.perf_counter()
+    for _ in range(total):
+        render_contract(CONTRACT, signatures)
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--renders", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--workers", type=int, default=settings.CONTRACT_PDF_WORKERS, help="Pool size")
+    parser.add_argument("--unsigned", action="store_true", help="Render without signature images")
+    parser.add_argument("--inline-renders", type=int, default=50, help="Sequential baseline size (0 to skip)")
+    args = parser.parse_args()
+
+    settings.CONTRACT_PDF_WORKERS = args.workers
+    with tempfile.TemporaryDirectory() as directory:
+        signatures = None
+        if not args.unsigned:
+            signature = write_signature(directory)
+            signatures = {"customer": signature, "agency": signature}
+
+        elapsed, timings, max_lag = asyncio.run(run_pool(args.renders, args.concurrency, signatures))
+        print(
+            f"pool    {args.renders} renders, {args.workers} workers, concurrency {args.concurrency}: "
+            f"{args.renders / elapsed:.1f} PDFs/s  "
+            f"median={statistics.median(timings):.1f} ms  p95={timings[int(len(timings) * 0.95) - 1]:.1f} ms  "
+            f"max loop lag={max_lag:.1f} ms"
+        )
+
+        if args.inline_renders:
+            elapsed = run_inline(args.inline_renders, signatures)
+            print(
+                f"inline  {args.inline_renders} renders, sequential: {args.inline_renders / elapsed:.1f} PDFs/s  "
+                f"(blocks the event loop {elapsed / args.inline_renders * 1000:.1f} ms per render)"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""
+Stripe Client Load Test
+Drives StripeService.create_payment_intent with many concurrent requests
+against stripe-mock and reports throughput, latency and event loop lag
+(a blocking call shows up as lag). A sequential run of the sync client is
+printed alongside for comparison.
+
+Start stripe-mock first:
+    docker run --rm -p 12111:12111 stripe/stripe-mock
+
+Usage (from backend/):
+    python scripts/load_test_stripe.py --requests 500 --concurrency 50
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# stripe-mock accepts any test key; the other settings are not used here
+os.environ.setdefault("STRIPE_API_BASE", "http://localhost:12111")
+os.environ.setdefault("STRIPE_SECRET_KEY", "sk_test_123")
+for name in ("SUPABASE_URL", "SUPABASE_KEY", "SUPABASE_SERVICE_KEY", "SECRET_KEY"):
+    os.environ.setdefault(name, "unused")
+
+from app.stripe_client import stripe_service  # noqa: E402
+
+PARAMS = {"amount": 25000, "currency": "aed", "payment_method_types": ["card"]}
+
+
+async def measure_lag(stop: asyncio.Event, lags: list):
+    """Record how late a 10 ms sleep wakes up while the load runs"""
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(0.01)
+        lags.append((time.perf_counter() - started - 0.01) * 1000)
+
+
+async def run_async(total: int, concurrency: int):
+    gate = asyncio.Semaphore(concurrency)
+    timings = []
+
+    async def one(index: int):
+        async with gate:
+            started = time.perf_counter()
+            await stripe_service.create_payment_intent(PARAMS, idempotency_key=f"load-{time.time()}-{index}")
+            timings.append((time.perf_counter() - started) * 1000)
+
+    stop, lags = asyncio.Event(), []
+    ticker = asyncio.create_task(measure_lag(stop, lags))
+    started = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(total)))
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await ticker
+    return elapsed, sorted(timings), max(lags, default=0.0)
+
+
+def run_sync(total: int):
+    client = stripe_service.client
+    started = time.perf_counter()
+    for _ in range(total):
+        client.payment_intents.create(params=PARAMS)
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--sync-requests", type=int, default=50, help="Sequential baseline size (0 to skip)")
+    args = parser.parse_args()
+
+    elapsed, timings, max_lag = asyncio.run(run_async(args.requests, args.concurrency))
+    print(
+        f"async  {args.requests} requests, concurrency {args.concurrency}: "
+        f"{args.requests / elapsed:.0f} req/s  "
+        f"median={statistics.median(timings):.1f} ms  p95={timings[int(len(timings) * 0.95) - 1]:.1f} ms  "
+        f"max loop lag={max_lag:.1f} ms"
+    )
+
+    if args.sync_requests:
+        elapsed = run_sync(args.sync_requests)
+        print(f"sync   {args.sync_requests} requests, sequential: {args.sync_requests / elapsed:.0f} req/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -78,6 +78,7 @@ export const API_ENDPOINTS = {
   // Booking endpoints
   BOOKINGS: {
     CREATE: `${API_BASE_URL}/api/v1/bookings/`,
+    QUOTE: `${API_BASE_URL}/api/v1/bookings/quote`,
     LIST: `${API_BASE_URL}/api/v1/bookings/`,
     DETAILS: (id) => `${API_BASE_URL}/api/v1/bookings/${id}`,
     CANCEL: (id) => `${API_BASE_URL}/api/v1/bookings/${id}/cancel`,
@@ -90,6 +91,12 @@ export const API_ENDPOINTS = {
     BOOKING_PAYMENT: (bookingId) => `${API_BASE_URL}/api/v1/payments/booking/${bookingId}`,
   },
   
+  // Direct-to-storage uploads
+  UPLOADS: {
+    SIGN: `${API_BASE_URL}/api/v1/uploads/sign`,
+    COMPLETE: `${API_BASE_URL}/api/v1/uploads/complete`,
+  },
+  
   // KYC endpoints
   KYC: {
     CREATE: `${API_BASE_URL}/api/v1/kyc/`,
@@ -111,13 +118,13 @@ export const API_ENDPOINTS = {
     POINTS: `${API_BASE_URL}/api/v1/loyalty/points`,
     TRANSACTIONS: `${API_BASE_URL}/api/v1/loyalty/transactions`,
     EARN: `${API_BASE_URL}/api/v1/loyalty/earn`,
-    REDEEM: `${API_BASE_URL}/api/v1/loyalty/redeem`,
   },
   
   // Review endpoints
   REVIEWS: {
     CREATE: `${API_BASE_URL}/api/v1/reviews/`,
     VEHICLE_REVIEWS: (vehicleId) => `${API_BASE_URL}/api/v1/reviews/vehicle/${vehicleId}`,
+    VEHICLE_SUMMARY: (vehicleId) => `${API_BASE_URL}/api/v1/reviews/vehicle/${vehicleId}/summary`,
     UPDATE: (id) => `${API_BASE_URL}/api/v1/reviews/${id}`,
     DELETE: (id) => `${API_BASE_URL}/api/v1/reviews/${id}`,
   },
@@ -173,9 +173,22 @@ class ApiService {
   }
 
   // Booking methods
-  async createBooking(bookingData) {
+  async getBookingQuote(quoteData) {
+    return this.request(API_ENDPOINTS.BOOKINGS.QUOTE, {
+      method: 'POST',
+      body: {
+        ...quoteData,
+        pickup_date: quoteData.pickup_date.toISOString(),
+        return_date: quoteData.return_date.toISOString(),
+      },
+    });
+  }
+
+  // Pass the same idempotencyKey when retrying so the booking is only created once
+  async createBooking(bookingData, idempotencyKey = null) {
     return this.request(API_ENDPOINTS.BOOKINGS.CREATE, {
       method: 'POST',
+      headers: idempotencyKey ? { 'Idempotency-Key': idempotencyKey } : undefined,
       body: {
         ...bookingData,
         pickup_date: bookingData.pickup_date.toISOString(),
@@ -204,9 +217,10 @@ class ApiService {
   }
 
   // Payment methods
-  async createPaymentIntent(paymentData) {
+  async createPaymentIntent(paymentData, idempotencyKey = null) {
     return this.request(API_ENDPOINTS.PAYMENTS.INTENT, {
       method: 'POST',
+      headers: idempotencyKey ? { 'Idempotency-Key': idempotencyKey } : undefined,
       body: paymentData,
     });
   }
@@ -257,6 +271,32 @@ class ApiService {
     return response.json();
   }
 
+  // Upload a file straight to storage: target is 'avatar', 'vehicle_image',
+  // 'kyc_document' or 'kyc_signature'; params carry vehicle_id or document_type/side
+  async uploadDirect(target, fileUri, contentType = 'image/jpeg', params = {}) {
+    const fileName = fileUri.split('/').pop();
+    const signed = await this.request(API_ENDPOINTS.UPLOADS.SIGN, {
+      method: 'POST',
+      body: { target, file_name: fileName, content_type: contentType, ...params },
+    });
+
+    const file = await fetch(fileUri);
+    const uploadResponse = await fetch(signed.signed_url, {
+      method: 'PUT',
+      headers: { 'Content-Type': contentType },
+      body: await file.blob(),
+    });
+
+    if (!uploadResponse.ok) {
+      throw new Error('Upload failed');
+    }
+
+    return this.request(API_ENDPOINTS.UPLOADS.COMPLETE, {
+      method: 'POST',
+      body: { target, path: signed.path, ...params },
+    });
+  }
+
   // Loyalty methods
   async getLoyaltyPoints() {
     return this.request(API_ENDPOINTS.LOYALTY.POINTS, {
@@ -283,6 +323,12 @@ class ApiService {
       method: 'GET',
     });
   }
+
+  async getVehicleRatingSummary(vehicleId) {
+    return this.request(API_ENDPOINTS.REVIEWS.VEHICLE_SUMMARY(vehicleId), {
+      method: 'GET',
+    });
+  }
 }
 
 export default new ApiService();